@@ -1,607 +1,2708 @@
-import math
-import time
-import rtmidi
-import asyncio
-import simpleobsws
-
-parameters = simpleobsws.IdentificationParameters(ignoreNonFatalRequestChecks=False)
-parameters.eventSubscriptions = (1 << 3) | (1 << 16)
-ws = simpleobsws.WebSocketClient(url='ws://localhost:4455', password='test', identification_parameters=parameters)
-
-midi_out = rtmidi.MidiOut()
-for idx, port in enumerate(midi_out.get_ports()):
-    if "X-Touch-Ext" in port:
-        midi_out.open_port(idx)
-        print('OUT Port opened:', midi_out.is_port_open(), midi_out.get_port_name(idx))
-        break
-
-midi_in = rtmidi.MidiIn()
-for idx, port in enumerate(midi_in.get_ports()):
-    if "X-Touch-Ext" in port:
-        midi_in.open_port(idx)
-        print('IN Port opened:', midi_in.is_port_open(), midi_in.get_port_name(idx))
-        break
-
-
-obs_inputs = {
-    0: {"name": "CANCEL", "id": "0"},
-    1: {"name": "RESET", "id": "1"}
-}
-
-
-async def filter_audio_inputs(my_reqs):
-    global obs_inputs
-
-    ret = await ws.call_batch(my_reqs, halt_on_failure=False)
-
-    for idx, result in enumerate(ret, 2):
-        if not result.ok():
-            obs_inputs.pop(idx)
-
-    obs_inputs = {new_key: value for new_key, (old_key, value) in enumerate(obs_inputs.items())}
-
-
-async def obs_request(req, data=None):
-
-    if data is None:
-        request = simpleobsws.Request(req)
-    else:
-        request = simpleobsws.Request(req, data)
-
-    ret = await ws.call(request)
-
-    return ret.responseData
-
-
-class Strip:
-
-    led_modes = {
-        0: (1, 11),
-        1: (17, 27),
-        2: (65, 75),
-        3: (81, 91),
-    }
-
-    colors = {1: "RED", 2: "GREEN", 3: "YELLOW", 4: "BLUE", 5: "MAGENTA", 6: "CYAN", 7: "WHITE", 8: "BLACK"}
-
-    def __init__(self, num):
-        self.num = num
-        self.enc_mode = 3
-        self.enc_value = -81
-        self.rec = 0
-        self.solo = 0
-        self.mute = 0
-        self.select = 0
-        self.color_cnt = 7
-        self.color_idx = 7
-        self.option = 0
-        self.source_name = ""
-        self.source_uuid = ""
-        self.source_cnt = 0
-        self.source_idx = 0
-        self.fader_current = 0
-        self.fader_busy = 0
-        self.fader_delta = 0
-
-    def reset(self):
-        # reset internal variables
-        self.enc_mode = 3
-        self.enc_value = -81
-        self.rec = 0
-        self.solo = 0
-        self.mute = 0
-        self.select = 0
-        self.color_cnt = 7
-        self.color_idx = 7
-        self.option = 0
-        self.source_name = ""
-        self.source_uuid = ""
-        self.source_cnt = 0
-        self.source_idx = 0
-        self.fader_current = 0
-        self.fader_busy = 0
-        self.fader_delta = 0
-
-        # reset LCD color
-        self.change_lcd_color(self.color_idx)
-
-        # reset LCD text
-        self.write_text(0, "")
-        self.write_text(1, "")
-
-        # power off encoder leds
-        midi_out.send_message([176, self.num + 48, 0])
-
-        # power off buttons
-        midi_out.send_message([144, self.num, 0])
-        midi_out.send_message([144, self.num + 8, 0])
-        midi_out.send_message([144, self.num + 16, 0])
-
-        # reset fader
-        midi_out.send_message([self.num + 224, 1, 0])
-
-    def restore(self):
-        # restore internal variables (counters)
-        self.source_cnt = self.source_idx
-        self.color_cnt = self.color_idx
-        self.select = 0
-
-        # restore text
-        self.write_text(0, self.source_name)
-        self.write_text(1, "")
-
-        # restore LCD color
-        self.change_lcd_color(self.color_idx)
-
-        # restore buttons leds
-        midi_out.send_message([144, self.num, self.rec * 127])
-        midi_out.send_message([144, self.num + 8, self.solo * 127])
-        midi_out.send_message([144, self.num + 16, self.mute * 127])
-        midi_out.send_message([144, self.num + 24, self.select])
-
-        # restore encoder leds
-        final_value = self.enc_value + self.led_modes[self.enc_mode][0]
-        midi_out.send_message([176, self.num + 48, final_value])
-
-        # restore fader
-        midi_out.send_message([self.num + 224, 1, self.fader_current])
-
-    async def process_button(self, msg):
-
-        button = msg[0]
-        value = msg[1]
-
-        if button == self.num:  # REC button TRACK
-            if value == 127:
-                if self.select == 0:
-                    if self.source_name != "":
-                        self.rec = 1 - self.rec
-                        midi_out.send_message([144, self.num, self.rec * 127])
-                        await obs_request("SetInputAudioTracks", {"inputUuid": self.source_uuid, "inputAudioTracks": {"2": bool(self.rec)}})
-
-        elif button == self.num + 8:  # SOLO button
-            if value == 127:
-                if self.select == 0:
-                    if self.source_name != "":
-                        self.solo = 1 - self.solo
-                        if self.solo == 1:
-                            monitor_type = "OBS_MONITORING_TYPE_MONITOR_AND_OUTPUT"
-                        else:
-                            monitor_type = "OBS_MONITORING_TYPE_NONE"
-
-                        midi_out.send_message([144, self.num + 8, self.solo * 127])
-                        await obs_request("SetInputAudioMonitorType", {"inputUuid": self.source_uuid, "monitorType": monitor_type})
-
-        elif button == self.num + 16:  # MUTE button
-            if value == 127:
-                if self.select == 0:
-                    if self.source_name != "":
-                        self.mute = 1 - self.mute
-                        midi_out.send_message([144, self.num + 16, self.mute * 127])
-                        await obs_request("SetInputMute", {"inputUuid": self.source_uuid, "inputMuted": bool(self.mute)})
-
-        elif button == self.num + 24:  # SELECT button
-            if value == 127:
-                # todo: listen to OBS EVENTS and cancel selection if sources changed while selecting
-                # restore all the other strips
-                for strip in strips.values():
-                    if strip.num != self.num:
-                        strip.restore()
-
-                # change select status
-                self.select = 1 - self.select
-                midi_out.send_message([144, self.num + 24, self.select])
-
-                if self.select == 1:
-                    # power off encoder leds
-                    midi_out.send_message([176, self.num + 48, 0])
-
-                    # power off buttons leds
-                    midi_out.send_message([144, self.num, 0])
-                    midi_out.send_message([144, self.num + 8, 0])
-                    midi_out.send_message([144, self.num + 16, 0])
-
-                    # get sources from obs
-                    req_list = []
-                    res = await obs_request("GetInputList")
-                    for idx, inpt in enumerate(res["inputs"], 2):
-                        obs_inputs[idx] = {"name": inpt["inputName"], "id": inpt["inputUuid"]}
-                        req_list.append(simpleobsws.Request('GetInputAudioMonitorType', {"inputUuid": inpt["inputUuid"]}, ))
-                    await filter_audio_inputs(req_list)
-
-                    # update LCD text
-                    if self.option == 0:
-                        self.write_text(0, "SOURCE")
-                        self.write_text(1, obs_inputs[self.source_idx]["name"])
-                    else:
-                        self.write_text(0, "COLOR")
-                        self.write_text(1, self.colors[self.color_idx])
-
-                elif self.select == 0:
-
-                    if self.option == 0:
-
-                        # get current selection
-                        source_selected_name = obs_inputs[self.source_cnt]["name"]
-                        source_selected_idx = obs_inputs[self.source_cnt]["id"]
-
-                        if source_selected_name == "CANCEL":
-                            self.restore()
-
-                        elif source_selected_name == "RESET":
-                            self.reset()
-
-                        else:
-                            if self.source_uuid != source_selected_idx:
-                                for strip in strips.values():
-                                    if strip.source_uuid == source_selected_idx:
-                                        self.color_cnt = strip.color_idx
-                                        self.color_idx = strip.color_idx
-                                        self.enc_mode = strip.enc_mode
-
-                            if self.source_uuid != source_selected_idx:
-                                # get OBS states to update button states
-                                current_solo = await obs_request("GetInputAudioMonitorType", {"inputUuid": source_selected_idx})
-                                current_solo = current_solo["monitorType"]
-                                current_mute = await obs_request("GetInputMute", {"inputUuid": source_selected_idx})
-                                current_mute = current_mute["inputMuted"]
-                                current_balance = await obs_request("GetInputAudioBalance", {"inputUuid": source_selected_idx})
-                                current_balance = current_balance["inputAudioBalance"] * 10  # instead my_map, casually the ranges are the same x10
-                                current_slider = await obs_request("GetInputVolume", {"inputUuid": source_selected_idx})
-                                current_slider = current_slider["inputVolumeMul"] ** (1 / 3)
-                                current_slider = int(my_map(current_slider, 0, 1, 0, 127))
-                                current_track = await obs_request("GetInputAudioTracks", {"inputUuid": source_selected_idx})
-                                current_track = int(current_track["inputAudioTracks"]["2"])
-
-                                # update internal variables
-                                if current_solo == "OBS_MONITORING_TYPE_MONITOR_AND_OUTPUT":
-                                    self.solo = 1
-                                else:
-                                    self.solo = 0
-
-                                self.enc_value = current_balance
-                                self.rec = current_track
-                                self.mute = int(current_mute)
-                                self.fader_current = current_slider
-                                self.source_name = source_selected_name
-                                self.source_uuid = source_selected_idx
-                                self.source_idx = self.source_cnt
-
-                            # update LCD Text
-                            self.write_text(0, self.source_name)
-                            self.write_text(1, "")
-
-                            # update LCD color
-                            self.change_lcd_color(self.color_idx)
-                            self.color_cnt = self.color_idx
-
-                            # update buttons leds
-                            midi_out.send_message([144, self.num, self.rec * 127])
-                            midi_out.send_message([144, self.num + 8, self.solo * 127])
-                            midi_out.send_message([144, self.num + 16, self.mute * 127])
-
-                            # update encoder leds
-                            final_value = self.enc_value + self.led_modes[self.enc_mode][0]
-                            midi_out.send_message([176, self.num + 48, final_value])
-
-                            # update fader
-                            midi_out.send_message([self.num + 224, 1, self.fader_current])
-
-                            # reset strips that previously have the current selection
-                            for strip in strips.values():
-                                if strip.source_uuid == source_selected_idx and strip.num != self.num:
-                                    strip.reset()
-
-                    elif self.option == 1:
-
-                        self.color_idx = self.color_cnt
-                        self.restore()
-
-        elif button == self.num + 32:  # ENCODER button
-            if value == 127:
-
-                if self.select == 0:
-                    if self.source_idx != 0:
-                        # update encoder mode
-                        self.enc_mode = self.enc_mode + 1
-                        if self.enc_mode > (len(self.led_modes) - 1):
-                            self.enc_mode = 0
-
-                        # update encoder lights
-                        final_value = self.enc_value + self.led_modes[self.enc_mode][0]
-                        midi_out.send_message([176, self.num + 48, final_value])
-
-                elif self.select == 1:
-
-                    self.option = 0 ** self.option
-
-                    if self.option == 0:
-                        self.write_text(0, "SOURCE")
-                        self.write_text(1, obs_inputs[self.source_cnt]["name"])
-                    else:
-                        self.write_text(0, "COLOR")
-                        self.write_text(1, self.colors[self.color_cnt])
-
-        else:
-            print("TOUCH", self.num)
-
-    async def process_encoder(self, msg):
-
-        if self.select == 0:
-            if self.source_idx != 0:
-
-                if msg[1] < 50:
-                    self.enc_value = self.enc_value + 1
-                    if self.enc_value > 10:
-                        self.enc_value = 10
-
-                elif msg[1] > 50:
-                    self.enc_value = self.enc_value - 1
-                    if self.enc_value < 0:
-                        self.enc_value = 0
-
-                await obs_request("SetInputAudioBalance", {"inputUuid": self.source_uuid, "inputAudioBalance": self.enc_value / 10})
-
-        if self.select == 1:
-
-            if msg[1] < 50:
-                if self.option == 0:
-                    self.source_cnt = self.source_cnt + 1
-                    if self.source_cnt > (len(obs_inputs) - 1):
-                        self.source_cnt = len(obs_inputs) - 1
-                    self.write_text(0, "SOURCE")
-                    self.write_text(1, obs_inputs[self.source_cnt]["name"])
-                elif self.option == 1:
-                    self.color_cnt = self.color_cnt + 1
-                    if self.color_cnt > 8:
-                        self.color_cnt = 1
-                    self.write_text(0, "COLOR")
-                    self.write_text(1, self.colors[self.color_cnt])
-                    self.change_lcd_color(self.color_cnt)
-
-            elif msg[1] > 50:
-                if self.option == 0:
-                    self.source_cnt = self.source_cnt - 1
-                    if self.source_cnt < 0:
-                        self.source_cnt = 0
-                    self.write_text(0, "SOURCE")
-                    self.write_text(1, obs_inputs[self.source_cnt]["name"])
-                else:
-                    self.color_cnt = self.color_cnt - 1
-                    if self.color_cnt < 1:
-                        self.color_cnt = 8
-                    self.write_text(0, "COLOR")
-                    self.write_text(1, self.colors[self.color_cnt])
-                    self.change_lcd_color(self.color_cnt)
-
-    async def process_fader(self, msg):
-
-        if self.source_name != "":
-            if self.select == 0:
-
-                self.fader_current = msg[1]
-                self.fader_delta = time.time_ns()
-                self.fader_busy = 1
-
-                fader_percentage = my_map(msg[1], 0, 127, 0, 1)
-                slider_mul = fader_percentage ** 3
-                req = simpleobsws.Request("SetInputVolume", {"inputUuid": self.source_uuid, "inputVolumeMul": slider_mul})
-                await ws.emit(req)
-
-    def pos_fader(self):
-        midi_out.send_message([self.num + 224, 1, self.fader_current])
-        self.fader_busy = 0
-
-    def write_text(self, line, my_str):
-
-        if not (0 <= line <= 1):
-            print("wrong LCD line")
-            return
-
-        my_str = my_str[:7]
-
-        # Clear LCD text
-        midi_out.send_message([
-            0xF0,  # MIDI System Exclusive Start
-            0x00, 0x00, 0x66,  # Header of Mackie Control Protocol
-            0x15,  # Device vendor ID
-            0x12,  # Command: Update LCD
-            0x00 + (7 * self.num) + (56 * line),  # Offset (starting position in LCD) 0x00 to 0x37 for the upper line and 0x38 to 0x6F for the lower line
-            0x0, 0x0, 0x0, 0x0, 0x0, 0x0, 0x0,  # Chars to display in UTF-16
-            0xF7  # MIDI System Exclusive End
-        ])
-
-        # write LCD text
-        payload = [0xF0, 0x00, 0x00, 0x66, 0x15, 0x12, 0x00 + (7 * self.num) + (56 * line)]
-        text = [ord(char) for char in my_str]
-        payload.extend(text)
-        payload.append(0xF7)
-        midi_out.send_message(payload)
-
-    def change_lcd_color(self, clr):
-
-        payload = [0xF0, 0x00, 0x00, 0x66, 0x15, 0x72]
-
-        for _, strip in strips.items():
-            payload.append(strip.color_idx)
-
-        payload.append(0xF7)
-
-        payload[self.num + 6] = clr
-
-        midi_out.send_message(payload)
-
-    def update_volumeter(self, obs_event_data):
-
-        if self.select == 0:
-
-            average_mul = [channel[1] for channel in obs_event_data]
-            average_mul = sum(average_mul) / len(average_mul)
-
-            if average_mul > 0:
-
-                current_peak_db = 20 * math.log10(average_mul)
-
-                if current_peak_db < -60:
-                    current_peak_db = -60
-                elif current_peak_db > -4:
-                    current_peak_db = 0
-
-                midi_value = my_map(current_peak_db, -60, 0, 0, 14)
-                midi_out.send_message([208, (self.num * 16 + midi_value), 0])
-
-    def update_fader(self, obs_event_data):
-
-        if self.fader_busy:
-            return
-
-        slider_percentage = obs_event_data["inputVolumeMul"] ** (1 / 3)
-        self.fader_current = int(my_map(slider_percentage, 0, 1, 0, 127))
-
-        midi_out.send_message([self.num + 224, 1, self.fader_current])
-
-    def update_mute(self, obs_event_data):
-        if self.select == 0:
-            self.mute = int(obs_event_data["inputMuted"])
-            midi_out.send_message([144, self.num + 16, self.mute * 127])
-
-    def update_track(self, obs_event_data):
-        if self.select == 0:
-            self.rec = int(obs_event_data["inputAudioTracks"]["2"])
-            midi_out.send_message([144, self.num, self.rec * 127])
-
-    def update_balance(self, obs_event_data):
-        if self.select == 0:
-            val = int(round(obs_event_data["inputAudioBalance"], 1) * 10)
-            self.enc_value = val
-            final_value = self.enc_value + self.led_modes[self.enc_mode][0]
-            midi_out.send_message([176, self.num + 48, final_value])
-
-    def update_monitor(self, obs_event_data):
-        if self.select == 0:
-            if obs_event_data["monitorType"] == "OBS_MONITORING_TYPE_NONE":
-                self.solo = 0
-            else:
-                self.solo = 1
-            midi_out.send_message([144, self.num + 8, self.solo * 127])
-
-
-strips = {
-    0: Strip(0),
-    1: Strip(1),
-    2: Strip(2),
-    3: Strip(3),
-    4: Strip(4),
-    5: Strip(5),
-    6: Strip(6),
-    7: Strip(7)
-}
-
-
-def my_map(x, in_min, in_max, out_min, out_max):
-    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
-
-
-async def obs_volumeter_callback(event_data):
-    for source in event_data["inputs"]:
-        for strip in strips.values():
-            if source["inputUuid"] == strip.source_uuid:
-                # Ignore empty lists
-                if source["inputLevelsMul"]:
-                    strip.update_volumeter(source["inputLevelsMul"])
-                break
-
-
-# todo identify event to merge all callbacks
-async def obs_slider_callback(event_data):
-    for strip in strips.values():
-        if event_data["inputUuid"] == strip.source_uuid:
-            strip.update_fader(event_data)
-            break
-
-
-async def obs_mute_callback(event_data):
-    for strip in strips.values():
-        if event_data["inputUuid"] == strip.source_uuid:
-            strip.update_mute(event_data)
-            break
-
-
-async def obs_track_callback(event_data):
-    for strip in strips.values():
-        if event_data["inputUuid"] == strip.source_uuid:
-            strip.update_track(event_data)
-            break
-
-
-async def obs_balance_callback(event_data):
-    for strip in strips.values():
-        if event_data["inputUuid"] == strip.source_uuid:
-            strip.update_balance(event_data)
-            break
-
-
-async def obs_monitor_callback(event_data):
-    for strip in strips.values():
-        if event_data["inputUuid"] == strip.source_uuid:
-            strip.update_monitor(event_data)
-            break
-
-
-async def main():
-
-    try:
-        await ws.connect()
-        await ws.wait_until_identified()
-    except Exception as e:
-        print(e)
-        loop.stop()
-
-    ws.register_event_callback(obs_balance_callback, "InputAudioBalanceChanged")
-    ws.register_event_callback(obs_track_callback, "InputAudioTracksChanged")
-    ws.register_event_callback(obs_monitor_callback, "InputAudioMonitorTypeChanged")
-    ws.register_event_callback(obs_mute_callback, "InputMuteStateChanged")
-    ws.register_event_callback(obs_volumeter_callback, "InputVolumeMeters")
-    ws.register_event_callback(obs_slider_callback, "InputVolumeChanged")
-
-    fader_timeout = 0.3
-
-    # reset all strips
-    for strip in strips.values():
-        strip.reset()
-
-    while True:
-
-        current = time.time_ns()
-        for strip in strips.values():
-            if strip.fader_busy and current - strip.fader_delta > fader_timeout * 1000000000:
-                strip.pos_fader()
-                await asyncio.sleep(0)
-
-        midi_msg = midi_in.get_message()
-        if not midi_msg:
-            await asyncio.sleep(0)
-            continue
-        b1 = midi_msg[0][0]
-        b2 = midi_msg[0][1]
-        b3 = midi_msg[0][2]
-
-        if b1 == 144:
-            strip = strips[b2 % 8]
-            await strip.process_button([b2, b3])
-        elif b1 == 176:
-            strip = strips[b2 % 8]
-            await strip.process_encoder([b2, b3])
-        else:
-            strip = strips[b1 - 224]
-            await strip.process_fader([b1, b3])
-
-        await asyncio.sleep(0)
-
-    await ws.disconnect()
-
-# todo implement RTP-MIDI (ethernet) protocol
-loop = asyncio.get_event_loop()
-loop.create_task(main())
-
-loop.run_forever()
+import os
+import sys
+import gzip
+import math
+import time
+import array
+import json
+import struct
+import queue
+import bisect
+import threading
+import collections
+import rtmidi
+import asyncio
+import websockets.exceptions
+import msgpack
+import simpleobsws
+import rtpmidi
+
+parameters = simpleobsws.IdentificationParameters(ignoreNonFatalRequestChecks=False)
+parameters.eventSubscriptions = (1 << 1) | (1 << 3) | (1 << 16)
+obs_url = 'ws://localhost:4455'
+obs_password = 'test'
+# the OBS client and the MIDI ports are created by setup(), importing the script opens nothing
+ws = None
+
+# "callback": rtmidi input callback feeds an asyncio queue, the loop sleeps until a message arrives
+# "poll": legacy busy loop calling midi_in.get_message()
+midi_input_mode = "callback"
+# fader moves are coalesced per strip: at most fader_rate SetInputVolume per second, the resting value is always sent
+fader_rate = 20
+# OBS volume feedback never moves a touched fader; on release the motor snaps once to the OBS volume as soon as the
+# echo of the last value arrives, at the latest after fader_timeout (units without touch sensing: fader_timeout after the last move)
+fader_timeout = 0.3
+# encoders accelerate with the speed the X-Touch puts in the CC value (1 to 15): a message moves balance, source and
+# color by speed ** encoder_acceleration steps, 0 moves one step per message whatever the speed
+encoder_acceleration = 1
+# balance turns are coalesced per strip like the faders: at most encoder_rate SetInputAudioBalance per second
+encoder_rate = 20
+# OBS balance changes move the ring again once the echo of the last balance sent arrives, at the latest after balance_timeout
+balance_timeout = 0.3
+# meters move locally between the OBS frames (every 50 ms): meter_fps display updates per second, a rise reaches the
+# loudest channel's peak with a meter_attack seconds time constant (0 is instant), the level falls meter_release dB per
+# second and the highest level holds meter_peak_hold seconds before it falls too
+meter_fps = 30
+meter_attack = 0
+meter_release = 20
+meter_peak_hold = 1
+# the LCD framebuffer is sent at most this many times per second, long names scroll one cell every marquee_interval
+lcd_frame_rate = 30
+marquee_interval = 0.35
+# "thread": MIDI writes go through a bounded queue to a writer thread, the asyncio loop never waits on the device
+# "direct": rtmidi is written from the asyncio loop
+midi_output_mode = "thread"
+midi_output_queue_size = 1024
+# output budget towards the device in bytes per second, 3125 is the MIDI 1.0 wire speed the X-Touch handles internally
+midi_bytes_per_second = 3125
+# one entry per chained X-Touch Extender, each opens the first unused port whose name contains it
+# network units use RTP-MIDI: "rtpmidi://192.168.1.50:5004" invites the device, "rtpmidi://:5004" waits for its invitation
+xtouch_ports = ["X-Touch-Ext"]
+# strips available through banking, the units show 8 each starting at the current bank (rounded up to a multiple of 8)
+virtual_strips = 32
+# (status, data1) of controls that move the bank by that many groups of 8 strips, e.g. {(144, 46): -1, (144, 47): 1}
+bank_controls = {}
+# what the buttons do, see xtouch-mapping.example.json; compiled at startup into a table indexed by status and data
+# byte, a mistake in the file stops the script before anything is opened. Without the file REC is audio track 2
+mapping_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xtouch-mapping.json")
+# OBS reconnect backoff in seconds, doubling from min to max; the first retry is immediate
+obs_reconnect_min = 0.25
+obs_reconnect_max = 5
+# how often the MIDI ports are checked for unplugged or returning devices
+midi_hotplug_interval = 1
+# fetch the state of every audio input at startup so assigning a strip needs no round trip
+prefetch_input_state = True
+# strips follow the program scene: its audio inputs, nested scenes and groups included, top to bottom as in the
+# OBS sources list, land on the strips from the first one and the other strips are emptied
+follow_program_scene = False
+# strip assignments, colors, encoder modes and the bank are kept here and restored at startup
+snapshot_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xtouch-layout.json")
+# changes are written once the surface has been left alone this many seconds
+snapshot_delay = 1
+# metrics in the Prometheus text format on http://metrics_host:metrics_port/metrics, None turns the endpoint off
+metrics_host = "127.0.0.1"
+metrics_port = 9464
+# /profiler/start and /profiler/stop switch a sampling profiler at runtime, /profiler returns folded stacks
+profiler_interval = 0.005
+# InputVolumeMeters (a frame with every audio input each 50 ms) is only subscribed while a visible strip shows meters,
+# False keeps the subscription on all the time
+meters_on_demand = True
+# seconds without any strip showing meters before OBS is told to stop sending them, select mode flips come and go
+meters_off_delay = 2
+# MIDI in, MIDI out and OBS events are logged here for replay.py (python replay.py <file>), None turns it off
+capture_file = None
+
+
+class Histogram:
+    # latency histogram with fixed buckets in seconds, observing is a bisect and three additions
+    buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        prefix = labels + "," if labels else ""
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, prefix, bound, cumulative))
+        lines.append("{}_sum{} {}".format(name, "{" + labels + "}" if labels else "", self.sum))
+        lines.append("{}_count{} {}".format(name, "{" + labels + "}" if labels else "", self.count))
+        return lines
+
+
+# (metric name, labels) -> Histogram or count
+histograms = collections.defaultdict(Histogram)
+counters = collections.Counter()
+
+# labels of the MIDI input and output messages by status byte
+midi_input_labels = {144: 'kind="button"', 176: 'kind="encoder"', **{224 + num: 'kind="fader"' for num in range(8)}}
+midi_output_labels = {144: 'kind="led"', 176: 'kind="ring"', 208: 'kind="meter"', 240: 'kind="sysex"',
+                      **{224 + num: 'kind="fader"' for num in range(8)}}
+# eventType -> its xtouch_obs_event_seconds Histogram
+event_histograms = {}
+
+
+def observe(name, labels, start):
+    histograms[(name, labels)].observe(time.perf_counter() - start)
+
+
+CAPTURE_MAGIC = b"XTCAP2"
+# record kinds: bridge state (msgpack), MIDI from a unit, MIDI to a unit, OBS event (msgpack [eventType, eventData]),
+# OBS answer (msgpack [requestType, requestData, result, code, responseData]) so a replay gets the same answers
+CAPTURE_STATE = 0
+CAPTURE_MIDI_IN = 1
+CAPTURE_MIDI_OUT = 2
+CAPTURE_OBS_EVENT = 3
+CAPTURE_OBS_RESPONSE = 4
+# kind and unit in one byte (3 bits kind), microseconds since the previous record, payload length
+capture_header = struct.Struct("<BII")
+
+
+class Capture:
+    # records go to a buffer on the loop thread, the gzip file gets it once a second
+
+    def __init__(self, path):
+        self.file = gzip.open(path, "wb", compresslevel=1)
+        self.file.write(CAPTURE_MAGIC)
+        self.buffer = bytearray()
+        self.last = time.perf_counter()
+        self.flush_handle = None
+        self.records = 0
+
+    def record(self, kind, unit, payload):
+        if self.file is None:
+            return
+        current = time.perf_counter()
+        delta = min(int((current - self.last) * 1000000), 0xFFFFFFFF)
+        # whole microseconds only, the rest is carried to the next record
+        self.last += delta / 1000000
+        self.buffer += capture_header.pack(kind | unit << 3, delta, len(payload))
+        self.buffer += payload
+        self.records += 1
+        if self.flush_handle is None:
+            try:
+                self.flush_handle = asyncio.get_running_loop().call_later(1, self.flush)
+            except RuntimeError:
+                self.flush()
+
+    def flush(self):
+        self.flush_handle = None
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer.clear()
+
+    def close(self):
+        # whatever is still running after this is not recorded
+        if self.file is None:
+            return
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        self.flush()
+        self.file.close()
+        self.file = None
+
+
+capture = None
+
+
+def capture_state():
+    # the catalog and the strips, a replay starts from here without asking OBS anything
+    if capture is None:
+        return
+    state = {
+        "audio_inputs": audio_inputs,
+        "input_state": input_state,
+        "bank": bank_offset,
+        "strips": {str(strip.num): [strip.source_uuid, strip.color_idx, strip.enc_mode]
+                   for strip in strips.values() if strip.source_uuid != ""},
+    }
+    capture.record(CAPTURE_STATE, 0, msgpack.packb(state))
+
+
+def capture_responses(requests, responses):
+    for request, ret in zip(requests, responses):
+        capture.record(CAPTURE_OBS_RESPONSE, 0, msgpack.packb([request.requestType, request.requestData,
+                                                               ret.requestStatus.result, ret.requestStatus.code, ret.responseData]))
+
+
+def apply_state(state):
+    # a captured state record: the catalog and the strips as they were, then one diffed repaint
+    audio_inputs.clear()
+    audio_inputs.update(state["audio_inputs"])
+    known_inputs.clear()
+    known_inputs.update(audio_inputs)
+    input_state.clear()
+    input_state.update(state["input_state"])
+    rebuild_obs_inputs()
+
+    for strip in strips.values():
+        if strip.source_uuid != "":
+            strip.clear()
+    for num, (uuid, color, enc_mode) in state["strips"].items():
+        strip = strips.get(int(num))
+        if strip is not None and uuid in input_state and uuid in audio_inputs:
+            strip.color_idx = strip.color_cnt = color
+            strip.enc_mode = enc_mode
+            strip.assign(uuid)
+
+    if state["bank"] != bank_offset:
+        switch_bank(state["bank"])
+    else:
+        for strip in visible:
+            strip.paint()
+
+
+def read_capture(path):
+    # (seconds since the capture started, kind, unit, payload) of every record; a capture cut short ends where it stops
+    data = bytearray()
+    with gzip.open(path, "rb") as f:
+        try:
+            while True:
+                chunk = f.read(1 << 16)
+                if not chunk:
+                    break
+                data += chunk
+        except EOFError:
+            pass
+    if not data.startswith(CAPTURE_MAGIC):
+        raise ValueError("{} is not an X-Touch capture".format(path))
+
+    records = []
+    stamp = 0
+    pos = len(CAPTURE_MAGIC)
+    while pos + capture_header.size <= len(data):
+        kind_unit, delta, length = capture_header.unpack_from(data, pos)
+        pos += capture_header.size
+        if pos + length > len(data):
+            break
+        stamp += delta
+        records.append((stamp / 1000000, kind_unit & 7, kind_unit >> 3, bytes(data[pos:pos + length])))
+        pos += length
+    return records
+
+
+class ThreadedMidiOut:
+    # rtmidi.MidiOut stand-in that hands messages to a writer thread
+    # the thread drains everything queued in one wake-up and writes it back to back
+
+    def __init__(self, port, maxsize=1024):
+        self.port = port
+        self.messages = queue.Queue(maxsize)
+        self.dropped = 0
+        self.errors = 0
+        # set when a message never reached the device, the mirror is out of step until the next repaint
+        self.lost = False
+        self.written = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.write_times = collections.deque(maxlen=1000)
+        self.thread = threading.Thread(target=self.run, name="midi-writer", daemon=True)
+        self.thread.start()
+
+    def send_message(self, msg):
+        try:
+            self.messages.put_nowait(msg)
+        except queue.Full:
+            self.dropped += 1
+            self.lost = True
+            return
+        self.max_depth = max(self.max_depth, self.messages.qsize())
+
+    def run(self):
+        while True:
+            batch = [self.messages.get()]
+            while True:
+                try:
+                    batch.append(self.messages.get_nowait())
+                except queue.Empty:
+                    break
+
+            failed = None
+            failures = 0
+            for msg in batch:
+                if msg is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    self.port.send_message(msg)
+                except Exception as e:
+                    # e.g. the device went away, the hot-plug check closes it and the thread keeps going
+                    self.errors += 1
+                    self.lost = True
+                    failed = e
+                    failures += 1
+                    continue
+                self.write_times.append(time.perf_counter() - start)
+            if failed is not None:
+                print("MIDI write failed:", failed)
+            self.written += len(batch) - failures
+            self.batches += 1
+
+    def close(self):
+        self.messages.put(None)
+        self.thread.join()
+
+    def stats(self):
+        times = sorted(self.write_times)
+        return {
+            "depth": self.messages.qsize(),
+            "max_depth": self.max_depth,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "write_p50": times[len(times) // 2] if times else 0,
+            "write_max": times[-1] if times else 0,
+        }
+
+
+# output priorities, lower goes first
+PRIORITY_CONTROL = 0  # faders and buttons
+PRIORITY_RING = 1
+PRIORITY_LCD = 2
+PRIORITY_METER = 3
+
+
+class OutputScheduler:
+    # collects the messages produced during a loop tick and sends them by priority within a bytes per second budget
+    # messages with a key replace a queued message with the same key, so stale values are never sent
+
+    def __init__(self, port, unit=0):
+        self.port = port
+        self.unit = unit
+        self.queues = [{}, {}, {}, {}]
+        self.serial = 0
+        self.tokens = 0
+        self.last_refill = time.monotonic()
+        self.flush_handle = None
+        # while the device is unplugged everything is discarded, the mirror repaints it on return
+        self.paused = False
+        self.sent = 0
+        self.bytes = 0
+        self.dropped = 0
+        # status byte -> messages sent
+        self.kinds = collections.Counter()
+
+    def queue(self, msg, priority, key=None):
+        if key is None:
+            self.serial += 1
+            key = self.serial
+        elif key in self.queues[priority]:
+            self.dropped += 1
+        self.queues[priority][key] = msg
+        self.schedule(0)
+
+    def schedule(self, delay):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # no loop to come back on later: everything goes out now, over budget or not
+            self.flush(budget=False)
+            return
+
+        if self.flush_handle is None:
+            self.flush_handle = loop.call_later(delay, self.flush)
+
+    def flush(self, budget=True):
+        self.flush_handle = None
+
+        if self.paused:
+            for messages in self.queues:
+                messages.clear()
+            return
+
+        # refill the budget, at most one tenth of a second can be saved up for bursts
+        current = time.monotonic()
+        self.tokens = min(midi_bytes_per_second / 10, self.tokens + (current - self.last_refill) * midi_bytes_per_second)
+        self.last_refill = current
+
+        for messages in self.queues:
+            while messages and (self.tokens > 0 or not budget):
+                msg = messages.pop(next(iter(messages)))
+                self.port.send_message(msg)
+                self.tokens -= len(msg)
+                self.sent += 1
+                self.bytes += len(msg)
+                self.kinds[msg[0]] += 1
+                if capture is not None:
+                    capture.record(CAPTURE_MIDI_OUT, self.unit, bytes(msg))
+
+            if messages:
+                # over budget, come back when there is room again
+                self.schedule((1 - self.tokens) / midi_bytes_per_second)
+                return
+
+    def pending(self):
+        return sum(len(messages) for messages in self.queues)
+
+
+class Surface:
+    # mirror of what the X-Touch is showing, Strip output goes through here and only changes are sent
+    # LCD text and colors are drawn into a framebuffer and rendered at most once per frame
+
+    # the device lets meters fall by itself, an unchanged level is refreshed after this many seconds
+    meter_refresh = 0.25
+
+    def __init__(self, output):
+        self.output = output
+        self.buttons = {}
+        self.rings = [None] * 8
+        self.faders = [None] * 8
+        self.meters = [None] * 8
+        self.meter_time = [0] * 8
+        self.lcd = [None] * 112
+        self.frame = [None] * 112
+        self.marquees = {}
+        self.colors = [None] * 8
+        self.colors_next = [None] * 8
+        self.render_handle = None
+        self.last_render = 0
+        self.sent = 0
+        self.suppressed = 0
+
+    def send(self, msg, priority, key=None):
+        self.output.queue(msg, priority, key)
+        self.sent += 1
+
+    def button(self, note, value):
+        if self.buttons.get(note) == value:
+            self.suppressed += 1
+            return
+        self.buttons[note] = value
+        self.send([144, note, value], PRIORITY_CONTROL, (144, note))
+
+    def ring(self, num, value):
+        if self.rings[num] == value:
+            self.suppressed += 1
+            return
+        self.rings[num] = value
+        self.send([176, num + 48, value], PRIORITY_RING, (176, num))
+
+    def fader(self, num, value):
+        # the motor returns to the last position it received, so this mirrors what was sent, not the hand
+        if self.faders[num] == value:
+            self.suppressed += 1
+            return
+        self.faders[num] = value
+        self.send([num + 224, 1, value], PRIORITY_CONTROL, (224, num))
+
+    def meter(self, num, segment):
+        current = time.monotonic()
+        if self.meters[num] == segment and current - self.meter_time[num] < self.meter_refresh:
+            self.suppressed += 1
+            return
+        self.meters[num] = segment
+        self.meter_time[num] = current
+        self.send([208, num * 16 + segment, 0], PRIORITY_METER, (208, num))
+
+    def text(self, num, line, my_str):
+        # 7 cells per strip, 0x00 to 0x37 for the upper line and 0x38 to 0x6F for the lower line
+        offset = (7 * num) + (56 * line)
+        cells = [ord(char) if ord(char) < 128 else 63 for char in my_str]
+
+        if len(cells) > 7:
+            # scroll long text, with a gap before it starts over
+            cells.extend([32] * 3)
+            if offset in self.marquees and self.marquees[offset][0] == cells:
+                self.suppressed += 1
+                return
+            self.marquees[offset] = (cells, time.monotonic())
+            cells = cells[:7]
+        else:
+            self.marquees.pop(offset, None)
+            cells.extend([0] * (7 - len(cells)))
+
+        if self.frame[offset:offset + 7] == cells:
+            self.suppressed += 1
+            return
+        self.frame[offset:offset + 7] = cells
+        self.schedule()
+
+    def send_text(self, offset, cells):
+        self.send([
+            0xF0,  # MIDI System Exclusive Start
+            0x00, 0x00, 0x66,  # Header of Mackie Control Protocol
+            0x15,  # Device vendor ID
+            0x12,  # Command: Update LCD
+            offset,  # Offset (starting position in LCD)
+            *cells,
+            0xF7  # MIDI System Exclusive End
+        ], PRIORITY_LCD)
+
+    def color(self, num, clr):
+        if self.colors_next[num] == clr:
+            self.suppressed += 1
+            return
+        self.colors_next[num] = clr
+        self.schedule()
+
+    def send_colors(self):
+        payload = [0xF0, 0x00, 0x00, 0x66, 0x15, 0x72]
+        payload.extend(7 if clr is None else clr for clr in self.colors_next)
+        payload.append(0xF7)
+        self.send(payload, PRIORITY_LCD, 0x72)
+        self.colors = list(self.colors_next)
+
+    def schedule(self, delay=None):
+        # render on the next frame, the first change after an idle period goes out at once
+        if delay is None:
+            delay = max(0, self.last_render + 1 / lcd_frame_rate - time.monotonic())
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.render()
+            return
+
+        if self.render_handle is not None:
+            if self.render_handle.when() <= loop.time() + delay:
+                return
+            self.render_handle.cancel()
+        self.render_handle = loop.call_later(delay, self.render)
+
+    def render(self):
+        if self.render_handle is not None:
+            self.render_handle.cancel()
+            self.render_handle = None
+        current = time.monotonic()
+        self.last_render = current
+
+        # advance the scrolling text
+        for offset, (cells, start) in self.marquees.items():
+            step = int((current - start) / marquee_interval) % len(cells)
+            self.frame[offset:offset + 7] = (cells[step:] + cells[:step])[:7]
+
+        # one SysEx per dirty range, ranges closer than a SysEx header are merged
+        idx = 0
+        while idx < 112:
+            if self.frame[idx] is None or self.frame[idx] == self.lcd[idx]:
+                idx += 1
+                continue
+            start = idx
+            end = idx + 1
+            while idx < 112 and idx - end < 8:
+                if self.frame[idx] is None:
+                    break
+                if self.frame[idx] != self.lcd[idx]:
+                    end = idx + 1
+                idx += 1
+            self.lcd[start:end] = self.frame[start:end]
+            self.send_text(start, self.lcd[start:end])
+            idx = end
+
+        if self.colors_next != self.colors:
+            self.send_colors()
+
+        if self.marquees:
+            # at least a millisecond: right on a step boundary the remainder can round to almost nothing
+            self.schedule(max(0.001, min(marquee_interval - (current - start) % marquee_interval for _, start in self.marquees.values())))
+
+    def repaint(self):
+        # force a full repaint of the known state, e.g. after the device was reconnected
+        for note, value in self.buttons.items():
+            self.send([144, note, value], PRIORITY_CONTROL, (144, note))
+        for num in range(8):
+            if self.rings[num] is not None:
+                self.send([176, num + 48, self.rings[num]], PRIORITY_RING, (176, num))
+            if self.faders[num] is not None:
+                self.send([num + 224, 1, self.faders[num]], PRIORITY_CONTROL, (224, num))
+        self.meters = [None] * 8
+
+        # forget what the LCD shows, the next frame draws everything
+        self.lcd = [None] * 112
+        if any(clr is not None for clr in self.colors_next):
+            self.colors = [None] * 8
+        self.render()
+
+
+# name -> (midi_in, midi_out) used instead of rtmidi, e.g. the simulated X-Touch in simulator.py
+midi_port_factory = None
+
+
+class Unit:
+    # one X-Touch Extender: its ports and its own output path
+
+    def __init__(self, index, name):
+        self.index = index
+        self.name = name
+        self.in_name = None
+        self.out_name = None
+        self.callback = None
+        if midi_port_factory is not None:
+            self.midi_in, self.midi_out = midi_port_factory(name)
+        elif name.startswith("rtpmidi://"):
+            # one network session is both ports, it batches each loop tick into a packet and never blocks
+            self.midi_in = self.midi_out = rtpmidi.RtpMidiPort(name)
+        else:
+            self.midi_in = rtmidi.MidiIn()
+            self.midi_out = rtmidi.MidiOut()
+        if midi_output_mode == "thread" and not self.network():
+            self.writer = ThreadedMidiOut(self.midi_out, midi_output_queue_size)
+            self.scheduler = OutputScheduler(self.writer, index)
+        else:
+            self.writer = None
+            self.scheduler = OutputScheduler(self.midi_out, index)
+        self.surface = Surface(self.scheduler)
+
+    def open(self, used_in, used_out):
+        out_idx, out_name = find_port(self.midi_out, self.name, used_out)
+        in_idx, in_name = find_port(self.midi_in, self.name, used_in)
+        if out_name is None or in_name is None:
+            return False
+
+        self.midi_out.open_port(out_idx)
+        print('OUT Port opened:', self.midi_out.is_port_open(), out_name)
+        self.midi_in.open_port(in_idx)
+        print('IN Port opened:', self.midi_in.is_port_open(), in_name)
+
+        self.out_name = out_name
+        self.in_name = in_name
+        # closing the port cancelled the input callback
+        if self.callback is not None:
+            self.midi_in.set_callback(*self.callback)
+        self.scheduler.paused = False
+        return True
+
+    def close(self):
+        self.scheduler.paused = True
+        self.midi_in.close_port()
+        self.midi_out.close_port()
+        self.in_name = None
+        self.out_name = None
+
+    def online(self):
+        return self.out_name is not None
+
+    def network(self):
+        return isinstance(self.midi_out, rtpmidi.RtpMidiPort)
+
+    def set_callback(self, func, data):
+        self.callback = (func, data)
+        self.midi_in.set_callback(func, data)
+
+
+def find_port(port, name, used):
+    for idx, port_name in enumerate(port.get_ports()):
+        if name in port_name and port_name not in used:
+            return idx, port_name
+    return None, None
+
+
+def open_units():
+    units = []
+    for index, name in enumerate(xtouch_ports):
+        unit = Unit(index, name)
+        unit.open({other.in_name for other in units}, {other.out_name for other in units})
+        units.append(unit)
+    return units
+
+
+units = []
+
+
+obs_inputs = {
+    0: {"name": "CANCEL", "id": "0"},
+    1: {"name": "RESET", "id": "1"}
+}
+
+
+# audio inputs offered by SELECT (inputUuid -> inputName, in OBS order), loaded once and kept current from events
+audio_inputs = {}
+
+# every inputUuid OBS has, audio or not, to notice changes missed while disconnected
+known_inputs = set()
+
+
+# inputUuid -> what a strip shows for that input, kept current from events once fetched
+input_state = {}
+
+# requests that hydrate input_state, and the response field each one fills
+input_state_requests = {
+    "GetInputAudioMonitorType": "monitorType",
+    "GetInputMute": "inputMuted",
+    "GetInputAudioBalance": "inputAudioBalance",
+    "GetInputVolume": "inputVolumeMul",
+    "GetInputAudioTracks": "inputAudioTracks",
+}
+
+# eventType -> input_state field it carries
+input_state_events = {
+    "InputAudioMonitorTypeChanged": "monitorType",
+    "InputMuteStateChanged": "inputMuted",
+    "InputAudioBalanceChanged": "inputAudioBalance",
+    "InputVolumeChanged": "inputVolumeMul",
+    "InputAudioTracksChanged": "inputAudioTracks",
+}
+
+
+def input_state_batch(uuids):
+    req_list = []
+    for uuid in uuids:
+        for req in input_state_requests:
+            req_list.append(simpleobsws.Request(req, {"inputUuid": uuid}))
+    return req_list
+
+
+def store_input_state(uuids, ret):
+    fields = list(input_state_requests.values())
+    for idx, uuid in enumerate(uuids):
+        results = ret[idx * len(fields):(idx + 1) * len(fields)]
+        if len(results) == len(fields) and all(result.ok() for result in results):
+            input_state[uuid] = {field: result.responseData[field] for field, result in zip(fields, results)}
+
+
+async def hydrate_inputs(uuids):
+    # the state of all the inputs in a single call_batch
+    req_list = input_state_batch(uuids)
+    if not req_list:
+        return
+
+    ret = await obs_batch(req_list)
+    store_input_state(uuids, ret)
+
+
+async def hydrate_in_background(uuids):
+    # a connection lost meanwhile is handled by the next resync
+    try:
+        await hydrate_inputs(uuids)
+    except obs_errors:
+        pass
+
+
+async def resync():
+    # after a reconnect: the input list and the assigned strips' state in one batch, then one diffed repaint
+    assigned = list(strip_by_uuid)
+    ret = await obs_batch([simpleobsws.Request("GetInputList")] + input_state_batch(assigned))
+    inputs = {inpt["inputUuid"]: inpt["inputName"] for inpt in ret[0].responseData["inputs"]}
+
+    if set(inputs) != known_inputs:
+        # inputs were created or removed while disconnected, start over
+        await load_audio_inputs()
+    else:
+        # anything missed while disconnected is stale now
+        input_state.clear()
+        for uuid in audio_inputs:
+            audio_inputs[uuid] = inputs[uuid]
+        rebuild_obs_inputs()
+
+    store_input_state(assigned, ret[1:])
+    for uuid, strip in strip_by_uuid.items():
+        strip.source_name = audio_inputs[uuid]
+        if uuid in input_state:
+            strip.apply_input_state(input_state[uuid])
+
+    for strip in visible:
+        if strip.select == 0:
+            strip.paint()
+
+    # the other inputs get their state back in the background
+    if prefetch_input_state:
+        asyncio.create_task(hydrate_in_background([uuid for uuid in audio_inputs if uuid not in input_state]))
+
+
+def rebuild_obs_inputs():
+    global obs_inputs
+
+    # strips browsing sources keep pointing at the same input if it still exists
+    browsing = {strip.num: obs_inputs[strip.source_cnt]["id"] for strip in strips.values() if strip.select == 1}
+
+    # which scene items are audio inputs may have changed
+    scene_index.clear()
+
+    obs_inputs = {
+        0: {"name": "CANCEL", "id": "0"},
+        1: {"name": "RESET", "id": "1"}
+    }
+    for idx, (uuid, name) in enumerate(audio_inputs.items(), 2):
+        obs_inputs[idx] = {"name": name, "id": uuid}
+    index = {entry["id"]: idx for idx, entry in obs_inputs.items()}
+
+    for strip in strips.values():
+        strip.source_idx = index.get(strip.source_uuid, 0)
+        if strip.select == 0:
+            strip.source_cnt = strip.source_idx
+        else:
+            strip.source_cnt = index.get(browsing[strip.num], min(strip.source_cnt, len(obs_inputs) - 1))
+            if strip.option == 0:
+                strip.write_text(1, obs_inputs[strip.source_cnt]["name"])
+
+
+async def load_audio_inputs():
+    res = await obs_request("GetInputList")
+
+    # only inputs with audio answer GetInputAudioMonitorType
+    req_list = [simpleobsws.Request('GetInputAudioMonitorType', {"inputUuid": inpt["inputUuid"]}) for inpt in res["inputs"]]
+    ret = await obs_batch(req_list) if req_list else []
+
+    known_inputs.clear()
+    known_inputs.update(inpt["inputUuid"] for inpt in res["inputs"])
+
+    audio_inputs.clear()
+    for inpt, result in zip(res["inputs"], ret):
+        if result.ok():
+            audio_inputs[inpt["inputUuid"]] = inpt["inputName"]
+
+    for strip in strips.values():
+        if strip.source_uuid != "" and strip.source_uuid not in audio_inputs:
+            strip.reset()
+
+    input_state.clear()
+    if prefetch_input_state:
+        await hydrate_inputs(list(audio_inputs))
+
+    rebuild_obs_inputs()
+
+
+async def input_created(event_data):
+    known_inputs.add(event_data["inputUuid"])
+    try:
+        ret = await obs_call(simpleobsws.Request('GetInputAudioMonitorType', {"inputUuid": event_data["inputUuid"]}))
+        if not ret.ok():
+            return
+        audio_inputs[event_data["inputUuid"]] = event_data["inputName"]
+        if prefetch_input_state:
+            await hydrate_inputs([event_data["inputUuid"]])
+    except obs_errors as e:
+        # the input is listed if it made it this far, its state is fetched on assignment; a reconnect resyncs the rest
+        print("OBS request failed:", e)
+        if event_data["inputUuid"] not in audio_inputs:
+            return
+    rebuild_obs_inputs()
+    follow_input_change()
+
+
+def input_removed(event_data):
+    known_inputs.discard(event_data["inputUuid"])
+    input_state.pop(event_data["inputUuid"], None)
+    if audio_inputs.pop(event_data["inputUuid"], None) is None:
+        return
+
+    strip = strip_by_uuid.get(event_data["inputUuid"])
+    if strip is not None:
+        strip.reset()
+
+    rebuild_obs_inputs()
+    follow_input_change()
+
+
+def input_name_changed(event_data):
+    if event_data["inputUuid"] not in audio_inputs:
+        return
+
+    audio_inputs[event_data["inputUuid"]] = event_data["inputName"]
+
+    strip = strip_by_uuid.get(event_data["inputUuid"])
+    if strip is not None:
+        strip.source_name = event_data["inputName"]
+        if strip.select == 0:
+            strip.write_text(0, strip.source_name)
+
+    rebuild_obs_inputs()
+
+
+async def scene_collection_changed(event_data):
+    # every input may be different now
+    try:
+        await load_audio_inputs()
+        await follow_scenes()
+    except obs_errors as e:
+        # the source list matches whatever was loaded, the resync after a reconnect completes it
+        print("OBS request failed:", e)
+        rebuild_obs_inputs()
+
+
+# sceneName -> its items bottom to top as OBS lists them, groups included, kept current from scene item events
+scene_items = {}
+
+# sceneName -> audio inputUuids it shows, nested scenes and groups flattened, top to bottom; computed when needed
+scene_index = {}
+
+program_scene = None
+
+
+def scene_item(item):
+    return {"id": item["sceneItemId"], "name": item["sourceName"], "uuid": item.get("sourceUuid")}
+
+
+async def load_scenes():
+    # the scene and group names, then every item list in a single batch
+    global program_scene
+
+    ret = await obs_batch([simpleobsws.Request("GetSceneList"), simpleobsws.Request("GetGroupList")])
+    scenes = [scene["sceneName"] for scene in ret[0].responseData["scenes"]]
+    groups = ret[1].responseData["groups"] if ret[1].ok() else []
+
+    req_list = [simpleobsws.Request("GetSceneItemList", {"sceneName": name}) for name in scenes]
+    req_list += [simpleobsws.Request("GetGroupSceneItemList", {"sceneName": name}) for name in groups]
+    items = await obs_batch(req_list) if req_list else []
+
+    scene_items.clear()
+    scene_index.clear()
+    for name, result in zip(scenes + groups, items):
+        if result.ok():
+            ordered = sorted(result.responseData["sceneItems"], key=lambda item: item["sceneItemIndex"])
+            scene_items[name] = [scene_item(item) for item in ordered]
+    program_scene = ret[0].responseData["currentProgramSceneName"]
+
+
+def scene_audio(name, parents=()):
+    # each audio input once, where it first appears from the top; a scene is never followed into itself
+    uuids = scene_index.get(name)
+    if uuids is not None:
+        return uuids
+
+    uuids = []
+    for item in reversed(scene_items.get(name, [])):
+        if item["name"] in scene_items:
+            if item["name"] != name and item["name"] not in parents:
+                uuids += [uuid for uuid in scene_audio(item["name"], parents + (name,)) if uuid not in uuids]
+        elif item["uuid"] in audio_inputs and item["uuid"] not in uuids:
+            uuids.append(item["uuid"])
+    scene_index[name] = uuids
+    return uuids
+
+
+def invalidate_scene(name):
+    # a scene is only indexed after the scenes inside it, so nothing above an unindexed scene is indexed either
+    if scene_index.pop(name, None) is None:
+        return
+    for parent, items in scene_items.items():
+        if any(item["name"] == name for item in items):
+            invalidate_scene(parent)
+
+
+def scene_changed(name):
+    invalidate_scene(name)
+    # the program scene shows it: the strips follow the edit
+    if follow_program_scene and program_scene is not None and program_scene not in scene_index:
+        layout_scene(program_scene)
+
+
+def layout_scene(name, hydrate=True):
+    # the scene's audio inputs on the strips from the caches, then one diffed repaint
+    uuids = scene_audio(name)
+    if hydrate and any(uuid not in input_state for uuid in uuids):
+        # without prefetch_input_state the missing state comes first, in one batch
+        asyncio.create_task(layout_hydrated(name, [uuid for uuid in uuids if uuid not in input_state]))
+        return
+    uuids = [uuid for uuid in uuids if uuid in input_state][:len(strips)]
+
+    for strip in strips.values():
+        if strip.select == 1:
+            strip.restore()
+
+    for num, strip in strips.items():
+        if num < len(uuids):
+            if strip.source_uuid != uuids[num]:
+                strip.assign(uuids[num])
+        elif strip.source_uuid != "":
+            strip.clear()
+
+    for strip in visible:
+        strip.paint()
+
+
+async def layout_hydrated(name, uuids):
+    try:
+        await hydrate_inputs(uuids)
+    except obs_errors:
+        return
+    if name == program_scene:
+        layout_scene(name, False)
+
+
+async def follow_scenes():
+    # after connecting or a scene collection change: the scene index from scratch and the program scene on the strips
+    if not follow_program_scene:
+        return
+    await load_scenes()
+    layout_scene(program_scene)
+
+
+def follow_input_change():
+    # an audio input that came or went may be in the program scene
+    if follow_program_scene and program_scene is not None:
+        layout_scene(program_scene)
+
+
+def program_scene_changed(event_data):
+    global program_scene
+
+    program_scene = event_data["sceneName"]
+    if follow_program_scene:
+        layout_scene(program_scene)
+
+
+def scene_item_created(event_data):
+    if not follow_program_scene:
+        return
+    items = scene_items.setdefault(event_data["sceneName"], [])
+    items.insert(event_data["sceneItemIndex"], scene_item(event_data))
+    scene_changed(event_data["sceneName"])
+
+
+def scene_item_removed(event_data):
+    if not follow_program_scene:
+        return
+    items = scene_items.get(event_data["sceneName"], [])
+    items[:] = [item for item in items if item["id"] != event_data["sceneItemId"]]
+    scene_changed(event_data["sceneName"])
+
+
+def scene_item_list_reindexed(event_data):
+    if not follow_program_scene:
+        return
+    items = {item["id"]: item for item in scene_items.get(event_data["sceneName"], [])}
+    ordered = sorted(event_data["sceneItems"], key=lambda entry: entry["sceneItemIndex"])
+    scene_items[event_data["sceneName"]] = [items[entry["sceneItemId"]] for entry in ordered if entry["sceneItemId"] in items]
+    scene_changed(event_data["sceneName"])
+
+
+def scene_created(event_data):
+    if follow_program_scene:
+        scene_items.setdefault(event_data["sceneName"], [])
+
+
+def scene_removed(event_data):
+    if not follow_program_scene:
+        return
+    # the scenes showing it get their own SceneItemRemoved
+    invalidate_scene(event_data["sceneName"])
+    scene_items.pop(event_data["sceneName"], None)
+
+
+def scene_name_changed(event_data):
+    global program_scene
+
+    if not follow_program_scene:
+        return
+    old_name = event_data["oldSceneName"]
+    invalidate_scene(old_name)
+    scene_items[event_data["sceneName"]] = scene_items.pop(old_name, [])
+    for items in scene_items.values():
+        for item in items:
+            if item["name"] == old_name:
+                item["name"] = event_data["sceneName"]
+    if program_scene == old_name:
+        program_scene = event_data["sceneName"]
+
+
+# what a request can raise while OBS is away
+obs_errors = (simpleobsws.NotIdentifiedError, simpleobsws.MessageTimeout, websockets.exceptions.ConnectionClosed)
+
+
+async def obs_request(req, data=None):
+
+    if data is None:
+        request = simpleobsws.Request(req)
+    else:
+        request = simpleobsws.Request(req, data)
+
+    ret = await obs_call(request)
+
+    return ret.responseData
+
+
+# every request goes through these three, they keep the OBS latency histograms and counters
+
+async def obs_call(request):
+    start = time.perf_counter()
+    try:
+        ret = await ws.call(request)
+        if capture is not None:
+            capture_responses([request], [ret])
+        return ret
+    except obs_errors:
+        counters[("xtouch_obs_request_errors_total", 'request="{}"'.format(request.requestType))] += 1
+        raise
+    finally:
+        observe("xtouch_obs_request_seconds", 'request="{}"'.format(request.requestType), start)
+
+
+async def obs_batch(requests):
+    start = time.perf_counter()
+    counters[("xtouch_obs_batched_requests_total", "")] += len(requests)
+    try:
+        ret = await ws.call_batch(requests, halt_on_failure=False)
+        if capture is not None:
+            capture_responses(requests, ret)
+        return ret
+    except obs_errors:
+        counters[("xtouch_obs_request_errors_total", 'request="batch"')] += 1
+        raise
+    finally:
+        observe("xtouch_obs_request_seconds", 'request="batch"', start)
+
+
+async def obs_emit(request):
+    # fire and forget, OBS does not answer
+    counters[("xtouch_obs_emits_total", 'request="{}"'.format(request.requestType))] += 1
+    await ws.emit(request)
+
+
+# levels in dB where the meter climbs one segment: -60 dB to 0 dB over 14 segments,
+# anything above -4 dB lights the whole meter
+meter_thresholds_db = [-60 + segment * 60 / 14 for segment in range(1, 14)] + [-4]
+# the same thresholds as multipliers: OBS frames are placed on the meter without a log10
+meter_thresholds = [10 ** (db / 20) for db in meter_thresholds_db]
+
+
+class MeterBallistics:
+    # per strip number: level and held peak in dB, when the hold ends, the last OBS peak (as a multiplier) and when it came
+    # the meter shows the held peak, a segment is only sent when it changes (and when the Surface refreshes it)
+    # frames are only stored, the dB conversion runs on the meter_fps ticks
+
+    floor = -60.0
+    # a level older than this counts as silence: the frames stopped (select mode, meters unsubscribed, input gone)
+    stale = 0.15
+
+    def __init__(self, size):
+        self.level = array.array("d", [self.floor]) * size
+        self.peak = array.array("d", [self.floor]) * size
+        self.hold_until = array.array("d", [0]) * size
+        self.target = array.array("d", [0]) * size
+        self.target_time = array.array("d", [0]) * size
+        self.shown = array.array("b", [0]) * size
+        self.last = time.monotonic()
+        self.handle = None
+        self.ticks = 0
+
+    def feed(self, num, mul):
+        current = time.monotonic()
+        self.target[num] = mul
+        self.target_time[num] = current
+        if meter_attack <= 0:
+            # an instant attack does not wait for the next tick, the tick then holds the peak
+            segment = bisect.bisect_right(meter_thresholds, mul)
+            if segment > self.shown[num]:
+                self.show(num, segment)
+        if self.handle is None:
+            self.last = current
+            self.schedule()
+
+    def reset(self, num):
+        self.level[num] = self.peak[num] = self.floor
+        self.target[num] = 0
+        self.target_time[num] = 0
+        self.shown[num] = 0
+
+    def schedule(self):
+        try:
+            self.handle = asyncio.get_running_loop().call_later(1 / meter_fps, self.tick)
+        except RuntimeError:
+            self.handle = None
+
+    def tick(self):
+        current = time.monotonic()
+        elapsed = current - self.last
+        self.last = current
+        self.ticks += 1
+        active = False
+        for num in range(len(self.level)):
+            if self.peak[num] > self.floor or self.target[num] > 0:
+                self.step(num, current, elapsed)
+                active = True
+        # nothing moves once every meter is down, the next OBS frame starts it again
+        if active:
+            self.schedule()
+        else:
+            self.handle = None
+
+    def step(self, num, current, elapsed):
+        mul = self.target[num] if current - self.target_time[num] < self.stale else 0
+        target = max(self.floor, 20 * math.log10(mul)) if mul > 0 else self.floor
+        level = self.level[num]
+        if target > level:
+            if meter_attack <= 0:
+                level = target
+            else:
+                level += (target - level) * (1 - math.exp(-elapsed / meter_attack))
+        else:
+            level = max(target, level - meter_release * elapsed)
+        peak = self.peak[num]
+        if level >= peak:
+            peak = level
+            self.hold_until[num] = current + meter_peak_hold
+        elif current >= self.hold_until[num]:
+            peak = max(level, peak - meter_release * elapsed)
+        self.level[num] = level
+        self.peak[num] = peak
+        if current - self.target_time[num] >= self.stale:
+            self.target[num] = 0
+
+        segment = bisect.bisect_right(meter_thresholds_db, peak) if peak > self.floor else 0
+        # a lit meter is passed on every tick so the Surface can refresh it before the device lets it fall
+        if segment != self.shown[num] or segment > 0:
+            self.show(num, segment)
+
+    def show(self, num, segment):
+        strip = strips.get(num)
+        if strip is None or strip.select == 1:
+            return
+        self.shown[num] = segment
+        strip.show_meter(segment)
+
+
+meter_ballistics = None
+
+# inputUuid -> Strip for every assigned strip, maintained by Strip.set_source
+strip_by_uuid = {}
+
+
+class Strip:
+
+    led_modes = {
+        0: (1, 11),
+        1: (17, 27),
+        2: (65, 75),
+        3: (81, 91),
+    }
+
+    colors = {1: "RED", 2: "GREEN", 3: "YELLOW", 4: "BLUE", 5: "MAGENTA", 6: "CYAN", 7: "WHITE", 8: "BLACK"}
+
+    def __init__(self, num):
+        self.num = num
+        self.surface = None
+        self.slot = None
+        self.enc_mode = 3
+        self.enc_value = -81
+        self.tracks = {}
+        self.solo = 0
+        self.mute = 0
+        self.select = 0
+        self.color_cnt = 7
+        self.color_idx = 7
+        self.option = 0
+        self.source_name = ""
+        self.source_uuid = ""
+        self.source_cnt = 0
+        self.source_idx = 0
+        self.fader_current = 0
+        self.fader_pending = None
+        self.fader_sent = 0
+        self.fader_sent_mul = None
+        self.fader_echoed = True
+        self.fader_task = None
+        # the volume OBS reports, in fader units, and the timer that snaps the motor back to it
+        self.fader_obs = 0
+        self.fader_release = None
+        self.touched = False
+        self.lifted = False
+        # balance turns waiting to be sent, the last one sent and whether OBS has echoed it back yet
+        self.balance_pending = None
+        self.balance_sent = 0
+        self.balance_sent_value = None
+        self.balance_echoed = True
+        self.balance_task = None
+        self.balance_release = None
+        # MIDI waiting to be handled, in arrival order, and the task handling it
+        self.inbox = collections.deque()
+        self.inbox_task = None
+        # (requestType, inputUuid) -> Request waiting to be sent, in order, and the task sending them
+        self.requests = {}
+        self.request_task = None
+
+    def reset(self):
+        self.clear()
+
+        # reset LCD color
+        self.change_lcd_color(self.color_idx)
+
+        # reset LCD text
+        self.write_text(0, "")
+        self.write_text(1, "")
+
+        # power off encoder leds
+        self.show_ring(0)
+
+        # power off buttons
+        self.show_buttons(False)
+
+        # reset fader
+        self.show_fader(0)
+
+    def clear(self):
+        # reset internal variables, nothing is drawn
+        self.enc_mode = 3
+        self.enc_value = -81
+        self.tracks = {}
+        self.solo = 0
+        self.mute = 0
+        self.select = 0
+        self.color_cnt = 7
+        self.color_idx = 7
+        self.option = 0
+        self.set_source("", "")
+        self.source_cnt = 0
+        self.source_idx = 0
+        self.fader_current = 0
+        self.fader_obs = 0
+        self.touched = False
+        self.stop_moves()
+
+    def stop_moves(self):
+        # fader and balance values on their way belong to the input the strip showed so far
+        self.fader_pending = None
+        self.fader_sent_mul = None
+        self.fader_echoed = True
+        self.lifted = False
+        if self.fader_task is not None:
+            self.fader_task.cancel()
+            self.fader_task = None
+        if self.fader_release is not None:
+            self.fader_release.cancel()
+            self.fader_release = None
+        self.balance_pending = None
+        self.balance_sent_value = None
+        self.balance_echoed = True
+        if self.balance_task is not None:
+            self.balance_task.cancel()
+            self.balance_task = None
+        if self.balance_release is not None:
+            self.balance_release.cancel()
+            self.balance_release = None
+
+    def assign(self, uuid):
+        # show an audio input from the caches, nothing is asked to OBS and nothing is drawn
+        self.stop_moves()
+        self.apply_input_state(input_state[uuid])
+        self.set_source(audio_inputs[uuid], uuid)
+        self.source_idx = self.source_cnt = next((idx for idx, entry in obs_inputs.items() if entry["id"] == uuid), 0)
+
+    def set_source(self, name, uuid):
+        # keep strip_by_uuid in step, another strip may already own the old uuid
+        if strip_by_uuid.get(self.source_uuid) is self:
+            del strip_by_uuid[self.source_uuid]
+        self.source_name = name
+        self.source_uuid = uuid
+        if uuid != "":
+            strip_by_uuid[uuid] = self
+        if meter_ballistics is not None:
+            meter_ballistics.reset(self.num)
+        compile_event_dispatch()
+        meters_changed()
+        save_snapshot()
+
+    def apply_input_state(self, state):
+        if state["monitorType"] == "OBS_MONITORING_TYPE_MONITOR_AND_OUTPUT":
+            self.solo = 1
+        else:
+            self.solo = 0
+
+        self.enc_value = int(round(state["inputAudioBalance"], 1) * 10)  # instead my_map, casually the ranges are the same x10
+        self.tracks = dict(state["inputAudioTracks"])
+        self.mute = int(state["inputMuted"])
+        self.fader_current = self.fader_obs = int(my_map(state["inputVolumeMul"] ** (1 / 3), 0, 1, 0, 127))
+
+    def restore(self):
+        # restore internal variables (counters)
+        self.source_cnt = self.source_idx
+        self.color_cnt = self.color_idx
+        self.select = 0
+        meters_changed()
+
+        self.paint()
+
+    def paint(self):
+        # draw the whole strip from its state, nothing is asked to OBS
+
+        # restore text
+        self.write_text(0, self.source_name)
+        self.write_text(1, "")
+
+        # restore LCD color
+        self.change_lcd_color(self.color_idx)
+
+        # restore buttons leds
+        self.show_buttons()
+
+        # restore encoder leds
+        final_value = self.enc_value + self.led_modes[self.enc_mode][0]
+        self.show_ring(final_value)
+
+        # restore fader
+        self.show_fader(self.fader_current)
+
+    def post(self, handler, msg):
+        # MIDI for this strip is handled in arrival order by its own task, the other strips never wait for it
+        self.inbox.append((handler, msg))
+        if self.inbox_task is None:
+            self.inbox_task = asyncio.create_task(self.handle_inbox())
+
+    async def handle_inbox(self):
+        # handlers only wait for OBS when a SELECT needs input state that is not cached yet
+        try:
+            while self.inbox:
+                handler, msg = self.inbox.popleft()
+                try:
+                    await handler(msg)
+                except obs_errors as e:
+                    print("OBS request failed:", e)
+                except Exception as e:
+                    # one bad message must not strand the ones queued behind it
+                    print("Strip {} failed on {}: {!r}".format(self.num, msg, e))
+        finally:
+            self.inbox_task = None
+
+    def request(self, request_type, data):
+        # OBS writes go out in order from the strip's own task, a newer value replaces one still queued for the same input
+        key = (request_type, data["inputUuid"])
+        if key in self.requests:
+            counters[("xtouch_obs_merged_requests_total", 'request="{}"'.format(request_type))] += 1
+            # fields of the newer request win, others still queued (another audio track) are kept
+            queued = self.requests[key].requestData
+            data = {field: dict(queued[field], **value) if isinstance(value, dict) and field in queued else value
+                    for field, value in data.items()}
+        self.requests[key] = simpleobsws.Request(request_type, data)
+        if self.request_task is None:
+            self.request_task = asyncio.create_task(self.send_requests())
+
+    async def send_requests(self):
+        try:
+            while self.requests:
+                await obs_call(self.requests.pop(next(iter(self.requests))))
+        except obs_errors as e:
+            # the resync after the reconnect reads the state back from OBS
+            print("OBS request failed:", e)
+            self.requests.clear()
+        finally:
+            self.request_task = None
+
+    async def process_button(self, msg):
+        # a strip button by its row (0 REC, 8 SOLO, 16 MUTE, 24 SELECT, 32 ENCODER, 104 TOUCH), as the mapping has it
+        action = strip_buttons.get(msg[0])
+        if action is not None:
+            await getattr(self, action[0])([action[1], msg[1]])
+
+    async def press_track(self, msg):
+        # toggle the strip's input on an audio track, "1" to "6"
+        track, value = msg
+
+        if value == 127:
+            if self.select == 0:
+                if self.source_name != "":
+                    self.tracks[track] = not self.tracks.get(track, False)
+                    self.show_buttons()
+                    self.request("SetInputAudioTracks", {"inputUuid": self.source_uuid, "inputAudioTracks": {track: self.tracks[track]}})
+
+    async def press_monitor(self, msg):
+        # monitor and output, or output only
+        _, value = msg
+
+        if value == 127:
+            if self.select == 0:
+                if self.source_name != "":
+                    self.solo = 1 - self.solo
+                    if self.solo == 1:
+                        monitor_type = "OBS_MONITORING_TYPE_MONITOR_AND_OUTPUT"
+                    else:
+                        monitor_type = "OBS_MONITORING_TYPE_NONE"
+
+                    self.show_buttons()
+                    self.request("SetInputAudioMonitorType", {"inputUuid": self.source_uuid, "monitorType": monitor_type})
+
+    async def press_mute(self, msg):
+        # mute the strip's input
+        _, value = msg
+
+        if value == 127:
+            if self.select == 0:
+                if self.source_name != "":
+                    self.mute = 1 - self.mute
+                    self.show_buttons()
+                    self.request("SetInputMute", {"inputUuid": self.source_uuid, "inputMuted": bool(self.mute)})
+
+    async def press_select(self, msg):
+        # browse sources or colors, a second press assigns the selection
+        _, value = msg
+
+        if value == 127:
+            # restore all the other strips
+            for strip in strips.values():
+                if strip.num != self.num:
+                    strip.restore()
+
+            # change select status
+            self.select = 1 - self.select
+            meters_changed()
+
+            if self.select == 1:
+                # power off encoder leds
+                self.show_ring(0)
+
+                # power off buttons leds, SELECT stays lit
+                self.show_buttons(False)
+
+                # update LCD text
+                if self.option == 0:
+                    self.write_text(0, "SOURCE")
+                    self.write_text(1, obs_inputs[self.source_idx]["name"])
+                else:
+                    self.write_text(0, "COLOR")
+                    self.write_text(1, self.colors[self.color_idx])
+
+            elif self.select == 0:
+
+                if self.option == 0:
+
+                    # get current selection
+                    source_selected_name = obs_inputs[self.source_cnt]["name"]
+                    source_selected_idx = obs_inputs[self.source_cnt]["id"]
+
+                    if source_selected_name == "CANCEL":
+                        self.restore()
+
+                    elif source_selected_name == "RESET":
+                        self.reset()
+
+                    else:
+                        if self.source_uuid != source_selected_idx:
+                            for strip in strips.values():
+                                if strip.source_uuid == source_selected_idx:
+                                    self.color_cnt = strip.color_idx
+                                    self.color_idx = strip.color_idx
+                                    self.enc_mode = strip.enc_mode
+
+                        if self.source_uuid != source_selected_idx:
+                            # get OBS states to update button states, cached or in one batch
+                            state = input_state.get(source_selected_idx)
+                            if state is None:
+                                await hydrate_inputs([source_selected_idx])
+                                state = input_state.get(source_selected_idx)
+
+                            if state is None:
+                                # the input went away while selecting
+                                self.restore()
+                                return
+
+                            self.apply_input_state(state)
+                            self.set_source(source_selected_name, source_selected_idx)
+                            self.source_idx = self.source_cnt
+
+                        # update LCD Text
+                        self.write_text(0, self.source_name)
+                        self.write_text(1, "")
+
+                        # update LCD color
+                        self.change_lcd_color(self.color_idx)
+                        self.color_cnt = self.color_idx
+
+                        # update buttons leds
+                        self.show_buttons()
+
+                        # update encoder leds
+                        final_value = self.enc_value + self.led_modes[self.enc_mode][0]
+                        self.show_ring(final_value)
+
+                        # update fader
+                        self.show_fader(self.fader_current)
+
+                        # reset strips that previously have the current selection
+                        for strip in strips.values():
+                            if strip.source_uuid == source_selected_idx and strip.num != self.num:
+                                strip.reset()
+
+                elif self.option == 1:
+
+                    self.color_idx = self.color_cnt
+                    self.restore()
+                    save_snapshot()
+
+    async def press_encoder(self, msg):
+        # encoder push: next ring mode, or sources/colors while selecting
+        _, value = msg
+
+        if value == 127:
+
+            if self.select == 0:
+                if self.source_idx != 0:
+                    # update encoder mode
+                    self.enc_mode = self.enc_mode + 1
+                    if self.enc_mode > (len(self.led_modes) - 1):
+                        self.enc_mode = 0
+                    save_snapshot()
+
+                    # update encoder lights
+                    final_value = self.enc_value + self.led_modes[self.enc_mode][0]
+                    self.show_ring(final_value)
+
+            elif self.select == 1:
+
+                self.option = 0 ** self.option
+
+                if self.option == 0:
+                    self.write_text(0, "SOURCE")
+                    self.write_text(1, obs_inputs[self.source_cnt]["name"])
+                else:
+                    self.write_text(0, "COLOR")
+                    self.write_text(1, self.colors[self.color_cnt])
+
+    async def touch_fader(self, msg):
+        # the motor stays still while the fader is touched
+        _, value = msg
+
+        self.touched = value == 127
+        self.lifted = False
+        if self.touched:
+            if self.fader_release is not None:
+                self.fader_release.cancel()
+                self.fader_release = None
+        elif self.source_name != "":
+            if self.fader_task is None and self.fader_echoed:
+                self.release_fader()
+            else:
+                self.lifted = True
+                self.arm_fader_release()
+
+    async def process_encoder(self, msg):
+
+        steps = encoder_steps(msg[1])
+
+        if self.select == 0:
+            if self.source_idx != 0:
+
+                enc_value = min(10, max(0, int(self.enc_value) + steps))
+                # detents against an end stop change nothing, OBS would not echo them
+                if enc_value == self.enc_value:
+                    return
+                self.enc_value = enc_value
+
+                # the ring follows the hand at once, OBS gets the newest balance from send_balance
+                final_value = self.enc_value + self.led_modes[self.enc_mode][0]
+                self.show_ring(final_value)
+
+                self.balance_pending = self.enc_value
+                if self.balance_task is None:
+                    self.balance_task = asyncio.create_task(self.send_balance())
+
+        if self.select == 1:
+
+            if self.option == 0:
+                self.source_cnt = min(len(obs_inputs) - 1, max(0, self.source_cnt + steps))
+                self.write_text(0, "SOURCE")
+                self.write_text(1, obs_inputs[self.source_cnt]["name"])
+            else:
+                # colors 1 to 8 wrap around
+                self.color_cnt = (self.color_cnt - 1 + steps) % 8 + 1
+                self.write_text(0, "COLOR")
+                self.write_text(1, self.colors[self.color_cnt])
+                self.change_lcd_color(self.color_cnt)
+
+    async def send_balance(self):
+        # latest value wins: the newest balance is sent at most encoder_rate times per second
+        try:
+            while self.balance_pending is not None:
+                wait = self.balance_sent + 1 / encoder_rate - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    # the strip may have been reassigned meanwhile
+                    if self.balance_pending is None:
+                        break
+
+                self.balance_sent_value = self.balance_pending
+                self.balance_pending = None
+                self.balance_sent = time.monotonic()
+
+                self.balance_echoed = False
+                self.arm_balance_release()
+                req = simpleobsws.Request("SetInputAudioBalance", {"inputUuid": self.source_uuid, "inputAudioBalance": self.balance_sent_value / 10})
+                try:
+                    await obs_emit(req)
+                except obs_errors as e:
+                    print("OBS request failed:", e)
+                    # no echo is coming, OBS events move the ring again
+                    self.release_balance()
+        finally:
+            # a cancelled task must not clear the handle of the one that replaced it
+            if self.balance_task is asyncio.current_task():
+                self.balance_task = None
+
+    def arm_balance_release(self):
+        if self.balance_release is not None:
+            self.balance_release.cancel()
+        self.balance_release = asyncio.get_running_loop().call_later(balance_timeout, self.release_balance)
+
+    def release_balance(self):
+        # the echo arrived or never will: OBS balance changes move the ring again
+        if self.balance_release is not None:
+            self.balance_release.cancel()
+            self.balance_release = None
+        self.balance_echoed = True
+
+    async def process_fader(self, msg):
+
+        if self.source_name != "":
+            if self.select == 0:
+
+                self.fader_current = msg[1]
+                self.fader_pending = msg[1]
+
+                if self.fader_task is None:
+                    self.fader_task = asyncio.create_task(self.send_fader())
+
+                # without touch sensing every move counts as a release
+                if not self.touched:
+                    self.arm_fader_release()
+
+    async def send_fader(self):
+        # latest value wins: the newest pending position is sent at most fader_rate times per second
+        try:
+            while self.fader_pending is not None:
+                wait = self.fader_sent + 1 / fader_rate - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    # the strip may have been reassigned meanwhile
+                    if self.fader_pending is None:
+                        break
+
+                fader_percentage = my_map(self.fader_pending, 0, 127, 0, 1)
+                self.fader_pending = None
+                self.fader_sent = time.monotonic()
+
+                self.fader_sent_mul = fader_percentage ** 3
+                self.fader_echoed = False
+                req = simpleobsws.Request("SetInputVolume", {"inputUuid": self.source_uuid, "inputVolumeMul": self.fader_sent_mul})
+                try:
+                    await obs_emit(req)
+                except obs_errors as e:
+                    print("OBS request failed:", e)
+        finally:
+            # a cancelled task must not clear the handle of the one that replaced it
+            if self.fader_task is asyncio.current_task():
+                self.fader_task = None
+
+    def arm_fader_release(self):
+        if self.fader_release is not None:
+            self.fader_release.cancel()
+        self.fader_release = asyncio.get_running_loop().call_later(fader_timeout, self.release_fader)
+
+    def release_fader(self):
+        # the hand is off and OBS has the last word: one motor move to the volume OBS reports
+        if self.fader_task is not None:
+            # the last value is still on its way
+            self.arm_fader_release()
+            return
+        self.fader_release = None
+        self.lifted = False
+        self.fader_current = self.fader_obs
+        self.show_fader(self.fader_current)
+
+    def write_text(self, line, my_str):
+
+        if not (0 <= line <= 1):
+            print("wrong LCD line")
+            return
+
+        if self.surface is not None:
+            self.surface.text(self.slot, line, my_str)
+
+    def change_lcd_color(self, clr):
+        if self.surface is not None:
+            self.surface.color(self.slot, clr)
+
+    # output goes to the unit and slot the strip is shown on, a strip in a hidden bank only keeps its state
+    def show_button(self, row, value):
+        if self.surface is not None:
+            self.surface.button(self.slot + row, value)
+
+    def show_ring(self, value):
+        if self.surface is not None:
+            self.surface.ring(self.slot, value)
+
+    def show_buttons(self, lit=True):
+        # button LEDs from the state of the actions the rows are mapped to, SELECT lights while browsing
+        for row, (name, arg) in strip_buttons.items():
+            if name == "press_select":
+                self.show_button(row, self.select)
+                continue
+            elif name == "press_track":
+                on = self.tracks.get(arg, False)
+            elif name == "press_monitor":
+                on = self.solo
+            elif name == "press_mute":
+                on = self.mute
+            else:
+                continue
+            self.show_button(row, int(lit and on) * 127)
+
+    def show_fader(self, value):
+        if self.surface is not None:
+            self.surface.fader(self.slot, value)
+
+    def show_meter(self, segment):
+        if self.surface is not None:
+            self.surface.meter(self.slot, segment)
+
+    def update_volumeter(self, obs_event_data):
+
+        if self.select == 0:
+            # true peak: the loudest channel's peak, the ballistics take it from there
+            meter_ballistics.feed(self.num, max(channel[1] for channel in obs_event_data))
+
+    def update_fader(self, obs_event_data):
+
+        slider_percentage = obs_event_data["inputVolumeMul"] ** (1 / 3)
+        self.fader_obs = int(my_map(slider_percentage, 0, 1, 0, 127))
+        if self.fader_sent_mul is not None and abs(obs_event_data["inputVolumeMul"] - self.fader_sent_mul) < 1e-6:
+            self.fader_echoed = True
+
+        # our own echoes never fight the hand
+        if self.touched:
+            return
+        if self.fader_release is not None:
+            if self.lifted and self.fader_task is None and self.fader_echoed:
+                # the hand is off and this is the echo of the last value sent, nothing else is on its way
+                self.fader_release.cancel()
+                self.release_fader()
+            return
+
+        self.fader_current = self.fader_obs
+        self.show_fader(self.fader_current)
+
+    def update_mute(self, obs_event_data):
+        if self.select == 0:
+            self.mute = int(obs_event_data["inputMuted"])
+            self.show_buttons()
+
+    def update_track(self, obs_event_data):
+        if self.select == 0:
+            self.tracks.update(obs_event_data["inputAudioTracks"])
+            self.show_buttons()
+
+    def update_balance(self, obs_event_data):
+        if self.select == 0:
+            val = int(round(obs_event_data["inputAudioBalance"], 1) * 10)
+            if val == self.balance_sent_value:
+                self.release_balance()
+            # echoes of older values while the encoder turns would pull the ring back
+            if self.balance_task is not None or not self.balance_echoed:
+                return
+            self.enc_value = val
+            final_value = self.enc_value + self.led_modes[self.enc_mode][0]
+            self.show_ring(final_value)
+
+    def update_monitor(self, obs_event_data):
+        if self.select == 0:
+            if obs_event_data["monitorType"] == "OBS_MONITORING_TYPE_NONE":
+                self.solo = 0
+            else:
+                self.solo = 1
+            self.show_buttons()
+
+
+strips = {}
+
+# physical slot (unit * 8 + strip on the unit) -> Strip shown there
+visible = []
+bank_offset = 0
+
+
+def layout():
+    visible.clear()
+    width = 8 * len(units)
+    for strip in strips.values():
+        position = strip.num - bank_offset
+        if 0 <= position < width:
+            strip.surface = units[position // 8].surface
+            strip.slot = position % 8
+        else:
+            strip.surface = None
+            strip.slot = None
+    for position in range(width):
+        visible.append(strips[bank_offset + position])
+    meters_changed()
+
+
+def switch_bank(offset):
+    global bank_offset
+
+    # banks move in groups of 8 strips and always fill every unit
+    offset = max(0, min(offset - offset % 8, len(strips) - 8 * len(units)))
+    if offset == bank_offset:
+        return
+
+    # leave select mode everywhere, the surface is about to show other strips
+    for strip in visible:
+        if strip.select == 1:
+            strip.restore()
+
+    bank_offset = offset
+    layout()
+    save_snapshot()
+
+    # repaint from the cached strip state, the device mirrors only send what differs
+    for strip in visible:
+        strip.paint()
+
+
+# the snapshot on disk is only replaced once it has been restored, the startup resets must not clobber it
+snapshot_restored = False
+snapshot_handle = None
+
+
+def save_snapshot():
+    global snapshot_handle
+
+    if not snapshot_restored:
+        return
+    if snapshot_handle is not None:
+        snapshot_handle.cancel()
+    try:
+        snapshot_handle = asyncio.get_running_loop().call_later(snapshot_delay, write_snapshot)
+    except RuntimeError:
+        write_snapshot()
+
+
+def write_snapshot():
+    global snapshot_handle
+    snapshot_handle = None
+
+    # strip -> [inputUuid, color, encoder mode, source index], only assigned strips are kept
+    snapshot = {
+        "bank": bank_offset,
+        "strips": {str(strip.num): [strip.source_uuid, strip.color_idx, strip.enc_mode, strip.source_idx]
+                   for strip in strips.values() if strip.source_uuid != ""}
+    }
+    try:
+        with open(snapshot_file + ".tmp", "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(snapshot_file + ".tmp", snapshot_file)
+    except OSError as e:
+        print("Could not save the strip layout:", e)
+
+
+def read_snapshot():
+    try:
+        with open(snapshot_file) as f:
+            snapshot = json.load(f)
+        bank = snapshot["bank"]
+        if not valid_index(bank):
+            raise ValueError("bank {!r} is not a strip number".format(bank))
+        saved = {}
+        for num, entry in snapshot["strips"].items():
+            # a hand-edited or damaged entry only loses that strip
+            if valid_snapshot_entry(entry):
+                saved[int(num)] = entry
+            else:
+                print("Ignoring the saved layout of strip {}: {!r}".format(num, entry))
+        return bank, saved
+    except FileNotFoundError:
+        return 0, {}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        print("Ignoring the saved strip layout:", e)
+        return 0, {}
+
+
+def valid_index(value):
+    return type(value) is int and value >= 0
+
+
+def valid_snapshot_entry(entry):
+    # [inputUuid, color, encoder mode, source index]
+    return (isinstance(entry, list) and len(entry) == 4 and isinstance(entry[0], str) and entry[0] != ""
+            and type(entry[1]) is int and entry[1] in Strip.colors and type(entry[2]) is int and entry[2] in Strip.led_modes
+            and valid_index(entry[3]))
+
+
+async def restore_snapshot():
+    # the input list and the saved strips' state in one batch, the surface is painted after a single round trip
+    global snapshot_restored
+
+    bank, saved = read_snapshot()
+    saved = {num: entry for num, entry in saved.items() if num in strips}
+    if not saved:
+        switch_bank(bank)
+        snapshot_restored = True
+        return
+
+    # a batch that fails leaves the snapshot alone, the next connection restores it
+    uuids = [entry[0] for entry in saved.values()]
+    ret = await obs_batch([simpleobsws.Request("GetInputList")] + input_state_batch(uuids))
+    names = {inpt["inputUuid"]: inpt["inputName"] for inpt in ret[0].responseData["inputs"]}
+    store_input_state(uuids, ret[1:])
+
+    for num, (uuid, color, enc_mode, source_idx) in saved.items():
+        # inputs that are gone or lost their audio are left unassigned
+        if uuid not in names or uuid not in input_state or uuid in strip_by_uuid:
+            continue
+        strip = strips[num]
+        strip.color_idx = strip.color_cnt = color
+        strip.enc_mode = enc_mode
+        strip.source_idx = strip.source_cnt = source_idx
+        strip.set_source(names[uuid], uuid)
+        strip.apply_input_state(input_state[uuid])
+
+    if bank != bank_offset:
+        switch_bank(bank)
+    else:
+        for strip in visible:
+            strip.paint()
+    snapshot_restored = True
+
+
+def my_map(x, in_min, in_max, out_min, out_max):
+    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+
+
+def encoder_steps(value):
+    # relative encoder CC: bit 6 is the direction (set = counter-clockwise), the low bits are the speed
+    speed = value & 0x3F
+    steps = max(1, int(round(speed ** encoder_acceleration)))
+    return -steps if value & 0x40 else steps
+
+
+meters_check_handle = None
+meters_off_handle = None
+
+
+def meters_wanted():
+    return any(strip.source_uuid != "" and strip.select == 0 for strip in visible)
+
+
+def meters_changed():
+    # every strip change of a loop tick ends in one check
+    global meters_check_handle
+
+    if not meters_on_demand or meters_check_handle is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # setup() picks the subscriptions of the first Identify
+        return
+    meters_check_handle = loop.call_soon(update_meter_subscription)
+
+
+def update_meter_subscription():
+    global meters_check_handle, meters_off_handle
+
+    meters_check_handle = None
+    if meters_wanted():
+        if meters_off_handle is not None:
+            meters_off_handle.cancel()
+            meters_off_handle = None
+        if not parameters.eventSubscriptions & (1 << 16):
+            set_meter_subscription(True)
+    elif parameters.eventSubscriptions & (1 << 16) and meters_off_handle is None:
+        meters_off_handle = asyncio.get_running_loop().call_later(meters_off_delay, set_meter_subscription, False)
+
+
+def set_meter_subscription(enabled):
+    global meters_off_handle
+
+    meters_off_handle = None
+    # the Identify after a reconnect uses the same parameters
+    if enabled:
+        parameters.eventSubscriptions |= 1 << 16
+    else:
+        parameters.eventSubscriptions &= ~(1 << 16)
+    if ws is not None and ws.identified:
+        asyncio.create_task(reidentify(parameters.eventSubscriptions))
+
+
+async def reidentify(subscriptions):
+    # simpleobsws has no Reidentify, the message goes out on its socket
+    counters[("xtouch_obs_reidentify_total", "")] += 1
+    try:
+        await ws.ws.send(msgpack.packb({"op": 3, "d": {"eventSubscriptions": subscriptions}}))
+    except websockets.exceptions.ConnectionClosed:
+        # closing anyway, the reconnect identifies with the new subscriptions
+        pass
+    except Exception as e:
+        print("OBS reidentify failed:", e)
+
+
+def obs_volumeter_callback(event_data):
+    for source in event_data["inputs"]:
+        strip = strip_by_uuid.get(source["inputUuid"])
+        # Ignore unassigned inputs and empty lists
+        if strip is not None and source["inputLevelsMul"]:
+            strip.update_volumeter(source["inputLevelsMul"])
+
+
+# eventType -> Strip method for events about a single input, the strip is found by inputUuid
+input_events = {
+    "InputAudioBalanceChanged": "update_balance",
+    "InputAudioTracksChanged": "update_track",
+    "InputAudioMonitorTypeChanged": "update_monitor",
+    "InputMuteStateChanged": "update_mute",
+    "InputVolumeChanged": "update_fader",
+}
+
+# eventType -> function for events that are not about a single input
+obs_events = {
+    "InputVolumeMeters": obs_volumeter_callback,
+    "InputCreated": input_created,
+    "InputRemoved": input_removed,
+    "InputNameChanged": input_name_changed,
+    "CurrentSceneCollectionChanged": scene_collection_changed,
+    "CurrentProgramSceneChanged": program_scene_changed,
+    "SceneItemCreated": scene_item_created,
+    "SceneItemRemoved": scene_item_removed,
+    "SceneItemListReindexed": scene_item_list_reindexed,
+    "SceneCreated": scene_created,
+    "SceneRemoved": scene_removed,
+    "SceneNameChanged": scene_name_changed,
+}
+
+# (eventType, inputUuid) -> bound Strip method, compiled from input_events and strip_by_uuid
+event_dispatch = {}
+
+
+def compile_event_dispatch():
+    event_dispatch.clear()
+    for uuid, strip in strip_by_uuid.items():
+        for event_type, method in input_events.items():
+            event_dispatch[(event_type, uuid)] = getattr(strip, method)
+
+
+def register_input_event(event_type, method):
+    input_events[event_type] = method
+    compile_event_dispatch()
+
+
+def register_obs_event(event_type, function):
+    obs_events[event_type] = function
+
+
+async def obs_event_callback(event_type, event_data):
+    if event_data is None:
+        return
+    if capture is not None:
+        capture.record(CAPTURE_OBS_EVENT, 0, msgpack.packb([event_type, event_data]))
+
+    start = time.perf_counter()
+    try:
+        uuid = event_data.get("inputUuid")
+        if uuid is not None:
+            field = input_state_events.get(event_type)
+            if field is not None and uuid in input_state:
+                input_state[uuid][field] = event_data[field]
+
+            handler = event_dispatch.get((event_type, uuid))
+            if handler is not None:
+                handler(event_data)
+            if event_type in input_events:
+                return
+
+        handler = obs_events.get(event_type)
+        if handler is not None:
+            ret = handler(event_data)
+            if asyncio.iscoroutine(ret):
+                await ret
+    finally:
+        histogram = event_histograms.get(event_type)
+        if histogram is None:
+            histogram = event_histograms[event_type] = histograms[("xtouch_obs_event_seconds", 'type="{}"'.format(event_type))]
+        histogram.observe(time.perf_counter() - start)
+
+
+# the classic layout, used when there is no mapping file
+default_mapping = {
+    "strip": {
+        "0": {"action": "track", "track": 2},
+        "8": {"action": "monitor"},
+        "16": {"action": "mute"},
+        "24": {"action": "select"},
+        "32": {"action": "encoder_mode"},
+        "104": {"action": "touch"},
+    },
+    "controls": [],
+}
+
+# strip button action -> Strip method, and the parameter it takes
+strip_actions = {
+    "track": ("press_track", "track"),
+    "monitor": ("press_monitor", None),
+    "mute": ("press_mute", None),
+    "select": ("press_select", None),
+    "encoder_mode": ("press_encoder", None),
+    "touch": ("touch_fader", None),
+}
+
+# control action -> parameters it takes
+control_actions = {
+    "bank": ("step",),
+    "scene": ("scene",),
+    "filter": ("source", "filter"),
+    "hotkey": ("hotkey",),
+}
+
+# ((status & 0x7F) << 7 | data1) -> handler(unit, value) or None
+dispatch_table = [None] * (128 * 128)
+# strip button row -> (Strip method, parameter)
+strip_buttons = {}
+
+
+def load_mapping():
+    global dispatch_table, strip_buttons
+
+    mapping = default_mapping
+    source = "default mapping"
+    if mapping_file is not None and os.path.exists(mapping_file):
+        source = mapping_file
+        try:
+            with open(mapping_file) as f:
+                mapping = json.load(f)
+        except ValueError as e:
+            raise ValueError("{}: {}".format(mapping_file, e))
+    dispatch_table, strip_buttons = compile_mapping(mapping, source)
+
+
+def compile_mapping(mapping, source="mapping"):
+    # every mistake is reported here, at startup, never when the button is pressed during the show
+
+    def fail(where, message):
+        raise ValueError("{}, {}: {}".format(source, where, message))
+
+    def midi_byte(where, value):
+        if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value <= 127:
+            fail(where, "{!r} is not a MIDI data byte (0 to 127)".format(value))
+        return value
+
+    def parameters(where, entry, allowed):
+        for key in entry:
+            if key not in allowed:
+                fail(where, "unknown key {!r}".format(key))
+
+    if not isinstance(mapping, dict):
+        fail("top level", "expected an object with \"strip\" and \"controls\"")
+    parameters("top level", mapping, ("strip", "controls"))
+    if not isinstance(mapping.get("strip", {}), dict):
+        fail("strip", "expected an object with a row per key, e.g. {\"16\": {\"action\": \"mute\"}}")
+    if not isinstance(mapping.get("controls", []), list):
+        fail("controls", "expected a list of controls")
+
+    table = [None] * (128 * 128)
+    owners = {}
+
+    def claim(where, status, data1, handler):
+        index = (status & 0x7F) << 7 | data1
+        if index in owners:
+            fail(where, "status {} data {} is already used by {}".format(status, data1, owners[index]))
+        owners[index] = where
+        table[index] = handler
+
+    # the strip buttons, one row of 8 notes each
+    buttons = {}
+    for row, entry in mapping.get("strip", {}).items():
+        where = "strip row {}".format(row)
+        if not isinstance(row, str) or not row.isdigit() or int(row) % 8 or int(row) > 120:
+            fail(where, "rows are the note of the first strip: 0, 8, ... 120")
+        if not isinstance(entry, dict) or entry.get("action") not in strip_actions:
+            fail(where, "action must be one of " + ", ".join(strip_actions))
+        name, parameter = strip_actions[entry["action"]]
+        parameters(where, entry, ("action", parameter))
+        arg = None
+        if parameter == "track":
+            track = entry.get("track")
+            if not isinstance(track, int) or isinstance(track, bool) or not 1 <= track <= 6:
+                fail(where, "track must be 1 to 6, not {!r}".format(track))
+            arg = str(track)
+        buttons[int(row)] = (name, arg)
+        for slot in range(8):
+            claim(where, 144, int(row) + slot, strip_control(slot, name, arg))
+
+    # encoders and faders are fixed
+    for slot in range(8):
+        claim("encoders", 176, 16 + slot, strip_control(slot, "process_encoder", 16))
+        for data1 in range(128):
+            # pitch bend carries the LSB in the first data byte, every value is the same fader
+            claim("faders", 224 + slot, data1, strip_control(slot, "process_fader", 224 + slot))
+
+    # controls outside the strips
+    controls = list(mapping.get("controls", []))
+    controls += [{"status": status, "data": data1, "action": "bank", "step": step}
+                 for (status, data1), step in bank_controls.items()]
+    for idx, entry in enumerate(controls):
+        where = "control {}".format(idx)
+        if not isinstance(entry, dict):
+            fail(where, "expected an object")
+        if "note" in entry:
+            status, data1 = 144, midi_byte(where, entry["note"])
+        elif "cc" in entry:
+            status, data1 = 176, midi_byte(where, entry["cc"])
+        elif "status" in entry:
+            status, data1 = entry["status"], midi_byte(where, entry.get("data"))
+            if status not in (144, 176):
+                fail(where, "status {!r} is not a note (144) or a control change (176)".format(status))
+        else:
+            fail(where, "needs a \"note\" or a \"cc\"")
+        action = entry.get("action")
+        if action not in control_actions:
+            fail(where, "action must be one of " + ", ".join(control_actions))
+        parameters(where, entry, ("note", "cc", "status", "data", "action") + control_actions[action])
+        args = []
+        for key in control_actions[action]:
+            value = entry.get(key)
+            if key == "step":
+                if not isinstance(value, int) or isinstance(value, bool) or value == 0:
+                    fail(where, "step must be a non-zero number of banks")
+            elif not isinstance(value, str) or value == "":
+                fail(where, "{} must be a name".format(key))
+            args.append(value)
+        claim(where, status, data1, control(action, args))
+
+    return table, buttons
+
+
+def strip_control(slot, name, arg):
+    # strips see the action's parameter and the value, the strip shown on the slot right now gets it
+    def handler(unit, value):
+        strip = visible[unit * 8 + slot]
+        strip.post(getattr(strip, name), [arg, value])
+    return handler
+
+
+def control(action, args):
+    # the action is chosen here, pressing the control only runs it
+    if action == "bank":
+        def run():
+            switch_bank(bank_offset + args[0] * 8)
+    elif action == "scene":
+        def run():
+            asyncio.create_task(control_request("SetCurrentProgramScene", {"sceneName": args[0]}))
+    elif action == "filter":
+        def run():
+            asyncio.create_task(toggle_filter(args[0], args[1]))
+    else:
+        def run():
+            asyncio.create_task(control_request("TriggerHotkeyByName", {"hotkeyName": args[0]}))
+
+    # a control fires when pressed (note on, CC 64 and up), releases do nothing
+    def handler(unit, value):
+        if value >= 64:
+            run()
+    return handler
+
+
+async def control_request(request_type, data):
+    try:
+        ret = await obs_call(simpleobsws.Request(request_type, data))
+        if not ret.ok():
+            print("{} failed: {}".format(request_type, ret.requestStatus.comment))
+    except obs_errors as e:
+        print("OBS request failed:", e)
+
+
+async def toggle_filter(source, filter_name):
+    data = {"sourceName": source, "filterName": filter_name}
+    try:
+        ret = await obs_call(simpleobsws.Request("GetSourceFilter", data))
+        if not ret.ok():
+            print("GetSourceFilter failed: {}".format(ret.requestStatus.comment))
+            return
+        data["filterEnabled"] = not ret.responseData["filterEnabled"]
+        await control_request("SetSourceFilterEnabled", data)
+    except obs_errors as e:
+        print("OBS request failed:", e)
+
+
+def dispatch_midi(midi_msg, unit=0):
+    # one lookup by status and first data byte, the mapping was compiled at startup
+    if capture is not None:
+        capture.record(CAPTURE_MIDI_IN, unit, bytes(midi_msg))
+    if len(midi_msg) < 3:
+        return
+    handler = dispatch_table[(midi_msg[0] & 0x7F) << 7 | midi_msg[1]]
+    if handler is not None:
+        handler(unit, midi_msg[2])
+
+
+midi_queue = None
+
+
+def midi_in_callback(event, data):
+    # called from the rtmidi thread: stamp the message and hand it to the asyncio loop
+    loop, unit = data
+    loop.call_soon_threadsafe(midi_queue.put_nowait, (event[0], time.perf_counter(), unit))
+
+
+async def read_midi_callback():
+    while True:
+        midi_msg, stamp, unit = await midi_queue.get()
+        dispatch_midi(midi_msg, unit)
+        # from the rtmidi callback until handed to its strip, the time spent queued included
+        observe("xtouch_midi_input_seconds", midi_input_labels.get(midi_msg[0], 'kind="other"'), stamp)
+
+
+async def read_midi_poll():
+    while True:
+
+        for unit in units:
+            midi_msg = unit.midi_in.get_message()
+            if midi_msg:
+                stamp = time.perf_counter()
+                dispatch_midi(midi_msg[0], unit.index)
+                observe("xtouch_midi_input_seconds", midi_input_labels.get(midi_msg[0][0], 'kind="other"'), stamp)
+
+        await asyncio.sleep(0)
+
+
+async def obs_supervisor():
+    # keep the OBS connection up, with backoff between failed attempts
+    delay = 0
+    loaded = False
+
+    while True:
+        try:
+            await ws.connect()
+            if not await ws.wait_until_identified():
+                raise simpleobsws.NotIdentifiedError("OBS did not identify the connection")
+
+            print("OBS connected")
+            if not loaded:
+                await restore_snapshot()
+                await load_audio_inputs()
+                loaded = True
+            else:
+                await resync()
+            await follow_scenes()
+            capture_state()
+            # only a connection that got the bridge going resets the backoff, a failing load keeps backing off
+            delay = 0
+
+            await ws.recv_task
+            print("OBS connection lost")
+
+        except Exception as e:
+            print("OBS connection failed:", e)
+
+        await ws.disconnect()
+        await asyncio.sleep(delay)
+        delay = min(max(delay * 2, obs_reconnect_min), obs_reconnect_max)
+
+
+async def midi_supervisor():
+    # reopen units whose USB cable came back, the mirror repaints them in full
+    while True:
+        await asyncio.sleep(midi_hotplug_interval)
+
+        for unit in units:
+            if unit.online():
+                if unit.out_name not in unit.midi_out.get_ports():
+                    print("X-Touch unplugged:", unit.out_name)
+                    unit.close()
+                elif unit.writer is not None and unit.writer.lost and unit.writer.messages.qsize() < unit.writer.messages.maxsize // 2:
+                    # messages were dropped or failed: once the writer has room again the mirror sends everything it knows
+                    unit.writer.lost = False
+                    unit.surface.repaint()
+            else:
+                others = [other for other in units if other is not unit]
+                if unit.open({other.in_name for other in others}, {other.out_name for other in others}):
+                    unit.surface.repaint()
+
+
+class SamplingProfiler:
+    # samples the asyncio thread's stack from a helper thread, while stopped nothing runs at all
+
+    def __init__(self):
+        self.thread = None
+        self.stopping = threading.Event()
+        self.target = None
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    def running(self):
+        return self.thread is not None
+
+    def start(self, interval):
+        if self.running():
+            return
+        # started from the loop, so this is the thread to sample
+        self.target = threading.get_ident()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, args=(interval,), name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.running():
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self, interval):
+        while not self.stopping.wait(interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                stack.append("{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self):
+        # folded stacks, the input format of flamegraph.pl and speedscope
+        return "".join("{} {}\n".format(stack, count) for stack, count in self.stacks.most_common())
+
+
+profiler = SamplingProfiler()
+metrics_server = None
+
+metric_types = {
+    "xtouch_midi_input_seconds": ("histogram", "MIDI input from the rtmidi callback until handed to its strip"),
+    "xtouch_obs_event_seconds": ("histogram", "OBS event handling time"),
+    "xtouch_obs_request_seconds": ("histogram", "OBS request round trip"),
+    "xtouch_obs_request_errors_total": ("counter", "OBS requests that failed because the connection was lost"),
+    "xtouch_obs_batched_requests_total": ("counter", "requests sent inside request batches"),
+    "xtouch_obs_emits_total": ("counter", "requests sent without waiting for the answer"),
+    "xtouch_obs_merged_requests_total": ("counter", "queued strip requests replaced by a newer value before sending"),
+    "xtouch_obs_connected": ("gauge", "1 while the OBS connection is identified"),
+    "xtouch_obs_pending_requests": ("gauge", "OBS requests waiting for their answer"),
+    "xtouch_obs_reidentify_total": ("counter", "event subscription changes sent to OBS"),
+    "xtouch_obs_meters_subscribed": ("gauge", "1 while InputVolumeMeters is subscribed"),
+    "xtouch_unit_online": ("gauge", "1 while the X-Touch unit is connected"),
+    "xtouch_midi_output_messages_total": ("counter", "MIDI messages sent to the unit"),
+    "xtouch_midi_output_bytes_total": ("counter", "MIDI bytes sent to the unit"),
+    "xtouch_output_pending": ("gauge", "messages waiting in the output scheduler"),
+    "xtouch_output_coalesced_total": ("counter", "queued messages replaced by a newer value before sending"),
+    "xtouch_output_suppressed_total": ("counter", "messages not sent because the device already shows them"),
+    "xtouch_writer_queue_depth": ("gauge", "messages waiting for the MIDI writer thread"),
+    "xtouch_writer_queue_max_depth": ("gauge", "deepest the MIDI writer queue has been"),
+    "xtouch_writer_dropped_total": ("counter", "messages dropped because the MIDI writer queue was full"),
+    "xtouch_writer_errors_total": ("counter", "MIDI writes that failed in the writer thread"),
+    "xtouch_rtpmidi_rtt_seconds": ("gauge", "RTP-MIDI round trip from the last clock sync"),
+    "xtouch_rtpmidi_jitter_seconds": ("gauge", "RTP-MIDI interarrival jitter"),
+    "xtouch_rtpmidi_lost_packets_total": ("counter", "RTP-MIDI packets missing from the device"),
+    "xtouch_profiler_samples_total": ("counter", "stacks sampled by the profiler"),
+}
+
+
+def render_metrics():
+    # name -> list of (labels, value or Histogram)
+    families = collections.defaultdict(list)
+    for (name, labels), histogram in histograms.items():
+        families[name].append((labels, histogram))
+    for (name, labels), count in counters.items():
+        families[name].append((labels, count))
+
+    families["xtouch_obs_connected"].append(("", int(ws is not None and ws.identified)))
+    families["xtouch_obs_pending_requests"].append(("", len(ws.waiters) if ws is not None else 0))
+    families["xtouch_obs_meters_subscribed"].append(("", int(bool(parameters.eventSubscriptions & (1 << 16)))))
+    families["xtouch_profiler_samples_total"].append(("", profiler.samples))
+    for unit in units:
+        label = 'unit="{}"'.format(unit.index)
+        families["xtouch_unit_online"].append((label, int(unit.online())))
+        kinds = collections.Counter()
+        for status, count in unit.scheduler.kinds.items():
+            kinds[midi_output_labels.get(status, 'kind="other"')] += count
+        for kind, count in kinds.items():
+            families["xtouch_midi_output_messages_total"].append((label + "," + kind, count))
+        families["xtouch_midi_output_bytes_total"].append((label, unit.scheduler.bytes))
+        families["xtouch_output_pending"].append((label, unit.scheduler.pending()))
+        families["xtouch_output_coalesced_total"].append((label, unit.scheduler.dropped))
+        families["xtouch_output_suppressed_total"].append((label, unit.surface.suppressed))
+        if unit.writer is not None:
+            families["xtouch_writer_queue_depth"].append((label, unit.writer.messages.qsize()))
+            families["xtouch_writer_queue_max_depth"].append((label, unit.writer.max_depth))
+            families["xtouch_writer_dropped_total"].append((label, unit.writer.dropped))
+            families["xtouch_writer_errors_total"].append((label, unit.writer.errors))
+        if unit.network():
+            stats = unit.midi_out.stats()
+            families["xtouch_rtpmidi_rtt_seconds"].append((label, stats["rtt"]))
+            families["xtouch_rtpmidi_jitter_seconds"].append((label, stats["jitter"]))
+            families["xtouch_rtpmidi_lost_packets_total"].append((label, stats["lost"]))
+
+    lines = []
+    for name in sorted(families):
+        kind, text = metric_types.get(name, ("untyped", ""))
+        lines.append("# HELP {} {}".format(name, text))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for labels, value in sorted(families[name], key=lambda entry: entry[0]):
+            if isinstance(value, Histogram):
+                lines.extend(value.render(name, labels))
+            else:
+                lines.append("{}{} {}".format(name, "{" + labels + "}" if labels else "", value))
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_handler(reader, writer):
+    # just enough HTTP/1.0 for curl, a browser and a Prometheus scraper
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.split()
+        path = parts[1].decode(errors="replace") if len(parts) > 1 else "/"
+
+        status = "200 OK"
+        if path == "/metrics":
+            body = render_metrics()
+        elif path == "/profiler/start":
+            profiler.start(profiler_interval)
+            body = "profiler started\n"
+        elif path == "/profiler/stop":
+            profiler.stop()
+            body = "profiler stopped\n"
+        elif path == "/profiler":
+            body = profiler.report()
+        else:
+            status = "404 Not Found"
+            body = "try /metrics, /profiler/start, /profiler/stop or /profiler\n"
+
+        payload = body.encode()
+        writer.write("HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {}\r\n\r\n".format(
+            status, len(payload)).encode() + payload)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def setup():
+    global ws, units, strips, capture, meter_ballistics
+
+    load_mapping()
+    if capture_file is not None:
+        capture = Capture(capture_file)
+    if follow_program_scene:
+        # scene switches (Scenes) and scene item edits (SceneItems)
+        parameters.eventSubscriptions |= (1 << 2) | (1 << 7)
+    # simpleobsws always speaks obswebsocket.msgpack, there is no JSON to opt out of
+    ws = simpleobsws.WebSocketClient(url=obs_url, password=obs_password, identification_parameters=parameters)
+    units = open_units()
+    strips = {num: Strip(num) for num in range(max(-(-virtual_strips // 8) * 8, 8 * len(units)))}
+    meter_ballistics = MeterBallistics(len(strips))
+    layout()
+    if meters_on_demand and not meters_wanted():
+        # nothing assigned yet, the first strip that shows meters turns them on
+        parameters.eventSubscriptions &= ~(1 << 16)
+
+
+async def main():
+    global midi_queue, metrics_server
+
+    ws.register_event_callback(obs_event_callback)
+
+    # reset all strips
+    for strip in strips.values():
+        strip.reset()
+
+    # network units open their sockets now, the hot-plug check opens them once the session is up
+    for unit in units:
+        if unit.network():
+            await unit.midi_out.start()
+
+    if metrics_port is not None:
+        try:
+            metrics_server = await asyncio.start_server(metrics_handler, metrics_host, metrics_port)
+            print("Metrics on http://{}:{}/metrics".format(metrics_host, metrics_server.sockets[0].getsockname()[1]))
+        except OSError as e:
+            # the surface and OBS work without the endpoint
+            metrics_server = None
+            print("Metrics endpoint not started:", e)
+
+    asyncio.create_task(obs_supervisor())
+    asyncio.create_task(midi_supervisor())
+
+    if midi_input_mode == "callback":
+        midi_queue = asyncio.Queue()
+        for unit in units:
+            unit.set_callback(midi_in_callback, (asyncio.get_running_loop(), unit.index))
+        await read_midi_callback()
+    else:
+        await read_midi_poll()
+
+    await ws.disconnect()
+
+
+if __name__ == "__main__":
+    setup()
+    loop = asyncio.get_event_loop()
+    loop.create_task(main())
+
+    try:
+        loop.run_forever()
+    finally:
+        if capture is not None:
+            capture.close()
@@ -0,0 +1,1336 @@
+import os
+import math
+import sys
+import json
+import bisect
+import time
+import asyncio
+import threading
+import collections
+import tempfile
+
+import msgpack
+import simpleobsws
+
+import replay
+import simulator
+from simulator import StandInOBS, make_inputs
+from rtpmidi import RtpMidiPort
+
+
+def load_bridge(units=1, **config):
+    # never read or replace the layout saved next to the real script
+    config.setdefault("snapshot_file", os.path.join(tempfile.mkdtemp(prefix="xtouch-bench-"), "xtouch-layout.json"))
+    # benches that run main() get an endpoint on a free port instead of the fixed one
+    config.setdefault("metrics_port", 0)
+    # the built-in layout, whatever mapping file sits next to the script
+    config.setdefault("mapping_file", None)
+    return simulator.load_bridge(units, **config)
+
+
+def percentiles(samples, points=(50, 90, 99, 100)):
+    ordered = sorted(samples)
+    if not ordered:
+        return {p: 0.0 for p in points}
+    return {p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+
+def print_row(name, values, unit="ms", scale=1000):
+    cells = "  ".join("p{}={:8.3f}{}".format(p, v * scale, unit) for p, v in values.items())
+    print("{:<24} {}".format(name, cells))
+
+
+class SimulatedMidiIn:
+    # rtmidi.MidiIn look-alike, messages are fed from a separate thread like the rtmidi one
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.sent_at = collections.deque()
+        self.callback = None
+        self.data = None
+
+    def get_message(self):
+        with self.lock:
+            if self.pending:
+                return self.pending.popleft(), 0.0
+        return None
+
+    def set_callback(self, func, data=None):
+        self.callback = func
+        self.data = data
+
+    def feed(self, msg):
+        self.sent_at.append(time.perf_counter())
+        if self.callback:
+            self.callback((msg, 0.0), self.data)
+        else:
+            with self.lock:
+                self.pending.append(msg)
+
+    def play(self, count, interval):
+        for idx in range(count):
+            self.feed([176, 16 + idx % 8, 1])
+            time.sleep(interval)
+
+
+async def bench_midi_input_mode(mode, idle_seconds=1.0, count=500, interval=0.002):
+    bridge = load_bridge()
+    source = SimulatedMidiIn()
+    bridge.units[0].midi_in = source
+    latencies = []
+    done = asyncio.Event()
+
+    def dispatch(midi_msg, unit=0):
+        latencies.append(time.perf_counter() - source.sent_at.popleft())
+        if len(latencies) == count:
+            done.set()
+
+    bridge.dispatch_midi = dispatch
+
+    if mode == "callback":
+        bridge.midi_queue = asyncio.Queue()
+        source.set_callback(bridge.midi_in_callback, (asyncio.get_running_loop(), 0))
+        task = asyncio.create_task(bridge.read_midi_callback())
+    else:
+        task = asyncio.create_task(bridge.read_midi_poll())
+
+    # idle: nothing arrives, measure how much CPU the input loop burns
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    await asyncio.sleep(idle_seconds)
+    idle_cpu = (time.process_time() - cpu) / (time.perf_counter() - wall) * 100
+
+    # active: messages arrive from another thread at a steady rate
+    player = threading.Thread(target=source.play, args=(count, interval), daemon=True)
+    player.start()
+    await asyncio.wait_for(done.wait(), count * interval + 10)
+    player.join()
+
+    task.cancel()
+    return idle_cpu, latencies
+
+
+async def bench_midi_input():
+    print("MIDI input: idle CPU and input-to-dispatch latency")
+    for mode in ("poll", "callback"):
+        idle_cpu, latencies = await bench_midi_input_mode(mode)
+        print("{:<8} idle CPU {:6.1f}%".format(mode, idle_cpu))
+        print_row("  latency", percentiles(latencies))
+
+
+class CountingMidiOut:
+    # rtmidi.MidiOut look-alike that only counts traffic
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def send_message(self, msg):
+        self.messages += 1
+        self.bytes += len(msg)
+
+
+def meter_levels(frame, strip_num):
+    # a slowly breathing level per strip, one OBS meter frame every ~50 ms
+    level = 0.05 + 0.04 * math.sin(frame / 20 + strip_num)
+    return [[level * 1.2, level, level * 0.9], [level * 1.1, level * 0.95, level * 0.9]]
+
+
+async def bench_mirror(frames=100, interval=0.05):
+    print("Device-state mirror: MIDI messages sent vs suppressed")
+    bridge = load_bridge()
+    port = CountingMidiOut()
+    bridge.units[0].scheduler.port = port
+
+    for strip in bridge.visible:
+        strip.reset()
+        strip.set_source("Mic {}".format(strip.num), "uuid-{}".format(strip.num))
+        strip.restore()
+
+    for frame in range(frames):
+        for strip in bridge.visible:
+            strip.update_volumeter(meter_levels(frame, strip.num))
+        # OBS echoes our own changes back a few times per second
+        if frame % 5 == 0:
+            for strip in bridge.visible:
+                strip.update_fader({"inputVolumeMul": 0.5})
+                strip.update_mute({"inputMuted": False})
+                strip.update_balance({"inputAudioBalance": 0.5})
+        await asyncio.sleep(interval)
+
+    surface = bridge.units[0].surface
+    total = surface.sent + surface.suppressed
+    print("requested {:6d}  sent {:6d}  suppressed {:6d} ({:.1f}%)  bytes {}".format(
+        total, surface.sent, surface.suppressed, surface.suppressed / total * 100, port.bytes))
+
+
+async def connect_bridge(bridge, obs):
+    bridge.ws = simpleobsws.WebSocketClient(url=obs.url, identification_parameters=bridge.parameters)
+    await bridge.ws.connect()
+    await bridge.ws.wait_until_identified()
+
+
+async def bench_fader(sweeps=10, steps=64, interval=0.008):
+    print("Fader coalescing: SetInputVolume per sweep and end-of-move latency (rate {}/s)".format(load_bridge().fader_rate))
+    bridge = load_bridge()
+    bridge.units[0].scheduler.port = CountingMidiOut()
+    obs = await StandInOBS().start()
+    await connect_bridge(bridge, obs)
+
+    strip = bridge.strips[0]
+    strip.set_source("Input 0", "input-0000")
+
+    counts = []
+    latencies = []
+    for sweep in range(sweeps):
+        values = [int(idx * 127 / (steps - 1)) for idx in range(steps)]
+        if sweep % 2:
+            values.reverse()
+        before = len(obs.received("SetInputVolume"))
+        for value in values:
+            await strip.process_fader([224, value])
+            last_move = time.perf_counter()
+            await asyncio.sleep(interval)
+        final_mul = (values[-1] / 127) ** 3
+        # the last SetInputVolume is emitted, not awaited: wait until it is at OBS
+        await wait_for(lambda: strip.fader_task is None and len(obs.received("SetInputVolume")) > before
+                       and abs(obs.received("SetInputVolume")[-1][2]["inputVolumeMul"] - final_mul) < 1e-9, timeout=2)
+
+        received = obs.received("SetInputVolume")[before:]
+        counts.append(len(received))
+        stamp, _, data = received[-1]
+        latencies.append(stamp - last_move)
+
+    print("moves per sweep {}  requests per sweep min {} max {}".format(steps, min(counts), max(counts)))
+    print_row("end-of-move latency", percentiles(latencies))
+
+    await bridge.ws.disconnect()
+    await obs.stop()
+
+
+def meter_payload(inputs, frame):
+    return {"inputs": [
+        {"inputName": "Input {}".format(idx), "inputUuid": "input-{:04d}".format(idx), "inputLevelsMul": meter_levels(frame, idx)}
+        for idx in range(inputs)]}
+
+
+async def legacy_volumeter_callback(bridge, event_data):
+    # the nested scan and per-event log10 the bridge used before the uuid index and threshold table
+    for source in event_data["inputs"]:
+        for strip in bridge.visible:
+            if source["inputUuid"] == strip.source_uuid:
+                if source["inputLevelsMul"] and strip.select == 0:
+                    average_mul = [channel[1] for channel in source["inputLevelsMul"]]
+                    average_mul = sum(average_mul) / len(average_mul)
+                    if average_mul > 0:
+                        current_peak_db = 20 * math.log10(average_mul)
+                        if current_peak_db < -60:
+                            current_peak_db = -60
+                        elif current_peak_db > -4:
+                            current_peak_db = 0
+                        midi_value = bridge.my_map(current_peak_db, -60, 0, 0, 14)
+                        bridge.units[0].surface.meter(strip.num, int(midi_value))
+                break
+
+
+async def bench_meter_dispatch(inputs=60, events=3000):
+    print("InputVolumeMeters dispatch: {} inputs, 8 assigned strips".format(inputs))
+    bridge = load_bridge()
+    bridge.units[0].scheduler.port = CountingMidiOut()
+    for strip in bridge.visible:
+        # spread the assigned inputs over the payload
+        strip.set_source("Input {}".format(strip.num * 7), "input-{:04d}".format(strip.num * 7))
+    payloads = [meter_payload(inputs, frame) for frame in range(50)]
+
+    async def legacy(event_data):
+        await legacy_volumeter_callback(bridge, event_data)
+
+    async def dispatcher(event_data):
+        await bridge.obs_event_callback("InputVolumeMeters", event_data)
+
+    for name, callback in (("before", legacy), ("after", dispatcher)):
+        start = time.perf_counter()
+        for idx in range(events):
+            await callback(payloads[idx % len(payloads)])
+        elapsed = time.perf_counter() - start
+        print("{:<8} {:10.0f} events/s".format(name, events / elapsed))
+
+
+async def legacy_hydrate(bridge, uuid):
+    # the five sequential requests a strip assignment used to await
+    state = {}
+    for req, field in bridge.input_state_requests.items():
+        ret = await bridge.obs_request(req, {"inputUuid": uuid})
+        state[field] = ret[field]
+    bridge.input_state[uuid] = state
+
+
+async def bench_assign(latency=0.02, assignments=10):
+    print("Strip assignment latency, stand-in OBS answering after {:.0f} ms".format(latency * 1000))
+    obs = await StandInOBS(latency=latency).start()
+
+    for mode in ("sequential", "batched", "prefetched"):
+        bridge = load_bridge()
+        bridge.units[0].scheduler.port = CountingMidiOut()
+        bridge.prefetch_input_state = mode == "prefetched"
+        await connect_bridge(bridge, obs)
+        bridge.ws.register_event_callback(bridge.obs_event_callback)
+        await bridge.load_audio_inputs()
+
+        strip = bridge.strips[0]
+        latencies = []
+        for _ in range(assignments):
+            await strip.process_button([24, 127])  # SELECT
+            await strip.process_encoder([16, 1])  # next source
+            while bridge.obs_inputs[strip.source_cnt]["id"] in ("0", "1"):
+                await strip.process_encoder([16, 1])
+            uuid = bridge.obs_inputs[strip.source_cnt]["id"]
+            if mode != "prefetched":
+                bridge.input_state.clear()
+
+            start = time.perf_counter()
+            if mode == "sequential":
+                await legacy_hydrate(bridge, uuid)
+            await strip.process_button([24, 127])  # confirm
+            latencies.append(time.perf_counter() - start)
+            assert strip.source_uuid == uuid
+
+        print_row(mode, percentiles(latencies))
+        await bridge.ws.disconnect()
+
+    await obs.stop()
+
+
+async def bench_lcd(detents=40, interval=0.005):
+    print("LCD: fast encoder spin while browsing sources in select mode")
+    bridge = load_bridge()
+    port = CountingMidiOut()
+    bridge.units[0].scheduler.port = port
+    for idx in range(30):
+        bridge.audio_inputs["input-{:04d}".format(idx)] = "Input {}".format(idx)
+    bridge.rebuild_obs_inputs()
+
+    strip = bridge.strips[0]
+    await strip.process_button([24, 127])  # SELECT
+    await asyncio.sleep(0.1)
+
+    writes = 0
+    write_text = strip.write_text
+
+    def counting_write_text(line, my_str):
+        nonlocal writes
+        writes += 1
+        write_text(line, my_str)
+
+    strip.write_text = counting_write_text
+    before = port.messages, port.bytes
+    for _ in range(detents):
+        await strip.process_encoder([16, 1])
+        await asyncio.sleep(interval)
+    await asyncio.sleep(0.1)
+
+    print("write_text calls {} (the old path sent {} SysEx)  sent {} messages, {} bytes".format(
+        writes, writes * 2, port.messages - before[0], port.bytes - before[1]))
+
+
+class TimingMidiOut:
+    # rtmidi.MidiOut look-alike that notes when each message reaches it
+
+    def __init__(self):
+        self.received = collections.defaultdict(collections.deque)
+        self.bytes = 0
+
+    def send_message(self, msg):
+        self.received[msg[0]].append(time.perf_counter())
+        self.bytes += len(msg)
+
+
+async def bench_scheduler(seconds=3.0, meter_rate=400, press_interval=0.05):
+    print("Output scheduler: button LED latency under meter load ({} B/s budget)".format(load_bridge().midi_bytes_per_second))
+    bridge = load_bridge()
+    port = TimingMidiOut()
+    bridge.units[0].scheduler.port = port
+    surface = bridge.units[0].surface
+    pressed = []
+
+    async def meter_storm():
+        frame = 0
+        while True:
+            frame += 1
+            for num in range(8):
+                surface.meter(num, (frame + num) % 15)
+            await asyncio.sleep(1 / meter_rate)
+
+    async def lcd_churn():
+        frame = 0
+        while True:
+            frame += 1
+            surface.text(frame % 8, 1, "v{:05d}".format(frame))
+            await asyncio.sleep(0.02)
+
+    tasks = [asyncio.create_task(meter_storm()), asyncio.create_task(lcd_churn())]
+    end = time.perf_counter() + seconds
+    value = 0
+    while time.perf_counter() < end:
+        value = 127 - value
+        surface.button(16, value)
+        pressed.append(time.perf_counter())
+        await asyncio.sleep(press_interval)
+    await asyncio.sleep(0.5)
+    for task in tasks:
+        task.cancel()
+
+    latencies = [sent - press for press, sent in zip(pressed, port.received[144])]
+    offered = 8 * 3 * meter_rate
+    print("meter load offered {} B/s, sent {} B/s, meter frames replaced before sending {}".format(
+        offered, int(port.bytes / (seconds + 0.5)), bridge.units[0].scheduler.dropped))
+    print_row("button LED latency", percentiles(latencies))
+
+
+class SlowMidiOut:
+    # rtmidi.MidiOut look-alike where every write takes as long as a busy USB link
+
+    def __init__(self, write_time=0.002):
+        self.write_time = write_time
+
+    def send_message(self, msg):
+        time.sleep(self.write_time)
+
+
+async def bench_writer(seconds=2.0, burst=20, interval=0.05):
+    print("MIDI output transport: event loop lag with a device taking 2 ms per write")
+    for mode in ("direct", "thread"):
+        bridge = load_bridge()
+        bridge.midi_bytes_per_second = 1000000
+        writer = bridge.ThreadedMidiOut(SlowMidiOut()) if mode == "thread" else None
+        bridge.units[0].scheduler.port = writer or SlowMidiOut()
+
+        lags = []
+
+        async def ticker():
+            while True:
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lags.append(time.perf_counter() - start - 0.001)
+
+        task = asyncio.create_task(ticker())
+        end = time.perf_counter() + seconds
+        value = 0
+        while time.perf_counter() < end:
+            value = 127 - value
+            for note in range(burst):
+                bridge.units[0].surface.button(note, value)
+            await asyncio.sleep(interval)
+        task.cancel()
+
+        print_row(mode + " loop lag", percentiles(lags))
+        if writer:
+            stats = writer.stats()
+            writer.close()
+            print("  writer: max depth {max_depth}, {written} writes in {batches} batches, write p50 {:.2f} ms max {:.2f} ms".format(
+                stats["write_p50"] * 1000, stats["write_max"] * 1000, **stats))
+
+
+async def bench_bank(virtual=64, units=2, switches=200):
+    print("Bank switch repaint: {} virtual strips on {} units".format(virtual, units))
+    bridge = load_bridge(units, virtual_strips=virtual)
+    ports = [CountingMidiOut() for _ in bridge.units]
+    for unit, port in zip(bridge.units, ports):
+        unit.scheduler.port = port
+
+    for strip in bridge.strips.values():
+        strip.set_source("Src {}".format(strip.num), "input-{:04d}".format(strip.num))
+        strip.apply_input_state({"monitorType": "OBS_MONITORING_TYPE_NONE", "inputMuted": strip.num % 3 == 0,
+                                 "inputAudioBalance": 0.5, "inputVolumeMul": (strip.num % 8) / 8,
+                                 "inputAudioTracks": {"2": strip.num % 2 == 0}})
+        strip.color_idx = 1 + strip.num % 8
+    for strip in bridge.visible:
+        strip.paint()
+    await asyncio.sleep(0.1)
+
+    timings = []
+    before = sum(port.messages for port in ports), sum(port.bytes for port in ports)
+    offsets = list(range(0, virtual - 8 * units + 1, 8))
+    for idx in range(switches):
+        start = time.perf_counter()
+        bridge.switch_bank(offsets[(idx + 1) % len(offsets)])
+        for unit in bridge.units:
+            unit.surface.render()
+            unit.scheduler.flush()
+        timings.append(time.perf_counter() - start)
+        await asyncio.sleep(0.12)  # let the output budget refill between switches
+    messages = sum(port.messages for port in ports) - before[0]
+    sent = sum(port.bytes for port in ports) - before[1]
+
+    print_row("switch + repaint", percentiles(timings))
+    print("per switch: {:.1f} messages, {:.0f} bytes".format(messages / switches, sent / switches))
+
+
+async def wait_for(condition, timeout=10, interval=0.001):
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            raise TimeoutError("condition not reached")
+        await asyncio.sleep(interval)
+
+
+async def bench_recovery(outages=5, outage=0.5):
+    print("OBS reconnect: time from OBS coming back to a resynced surface ({:.1f} s outages)".format(outage))
+    obs = await StandInOBS(latency=0.005).start()
+    bridge = load_bridge()
+    bridge.units[0].scheduler.port = CountingMidiOut()
+    bridge.ws = simpleobsws.WebSocketClient(url=obs.url, identification_parameters=bridge.parameters)
+    bridge.ws.register_event_callback(bridge.obs_event_callback)
+    supervisor = asyncio.create_task(bridge.obs_supervisor())
+    await wait_for(lambda: len(bridge.obs_inputs) > 2)
+
+    surface = bridge.units[0].surface
+    assigned = list(bridge.audio_inputs)[:8]
+    for strip, uuid in zip(bridge.visible, assigned):
+        strip.set_source(bridge.audio_inputs[uuid], uuid)
+        strip.apply_input_state(bridge.input_state[uuid])
+        strip.paint()
+
+    timings = []
+    round_trips = []
+    for _ in range(outages):
+        await obs.stop()
+        await wait_for(lambda: not bridge.ws.identified)
+
+        # OBS changes while the bridge is away
+        for uuid in assigned:
+            obs.inputs[uuid]["inputMuted"] = not obs.inputs[uuid]["inputMuted"]
+        expected = [obs.inputs[uuid]["inputMuted"] * 127 for uuid in assigned]
+        await asyncio.sleep(outage)
+
+        before = obs.round_trips
+        await obs.start()
+        start = time.perf_counter()
+        await wait_for(lambda: [surface.buttons.get(16 + slot) for slot in range(8)] == expected)
+        timings.append(time.perf_counter() - start)
+        round_trips.append(obs.round_trips - before)
+
+    supervisor.cancel()
+    await bridge.ws.disconnect()
+    await obs.stop()
+    print_row("time to recovered", percentiles(timings))
+    print("OBS round trips until recovered: {}".format(max(round_trips)))
+
+
+async def bench_startup(latency=0.02, restored=8, runs=5):
+    print("Startup from a saved layout: {} strips, {:.0f} ms OBS latency".format(restored, latency * 1000))
+    obs = await StandInOBS(inputs=None, latency=latency).start()
+    uuids = list(obs.inputs)[:restored]
+    for uuid in uuids:
+        obs.inputs[uuid]["inputMuted"] = True
+
+    timings = []
+    for _ in range(runs):
+        bridge = load_bridge()
+        bridge.units[0].scheduler.port = CountingMidiOut()
+        with open(bridge.snapshot_file, "w") as f:
+            json.dump({"bank": 0, "strips": {str(num): [uuid, 3, 1, num + 2] for num, uuid in enumerate(uuids)}}, f)
+        surface = bridge.units[0].surface
+        bridge.ws = simpleobsws.WebSocketClient(url=obs.url, identification_parameters=bridge.parameters)
+        bridge.ws.register_event_callback(bridge.obs_event_callback)
+
+        start = time.perf_counter()
+        supervisor = asyncio.create_task(bridge.obs_supervisor())
+        await wait_for(lambda: bridge.ws.identified)
+        identified = time.perf_counter()
+        await wait_for(lambda: all(surface.buttons.get(16 + slot) == 127 for slot in range(restored)))
+        timings.append(time.perf_counter() - identified)
+        assert [strip.color_idx for strip in bridge.visible[:restored]] == [3] * restored
+
+        supervisor.cancel()
+        await bridge.ws.disconnect()
+
+    await obs.stop()
+    print("connect to identified: {:.1f} ms".format((identified - start) * 1000))
+    print_row("identified to restored", percentiles(timings))
+    print("restored after {:.1f} OBS round trips".format(min(timings) / latency))
+
+
+async def bench_rtpmidi(ticks=200, burst=16, interval=0.005):
+    print("RTP-MIDI over loopback: {} ticks of {} messages each way".format(ticks, burst))
+    # the listening side stands in for the X-Touch
+    device = await RtpMidiPort("rtpmidi://:0", bind="127.0.0.1").start()
+    host = await RtpMidiPort("rtpmidi://127.0.0.1:{}".format(device.local_port), bind="127.0.0.1").start()
+    start = time.perf_counter()
+    await wait_for(lambda: host.get_ports() and device.get_ports())
+    print("session open after {:.1f} ms".format((time.perf_counter() - start) * 1000))
+    await wait_for(lambda: host.syncs >= 1)
+
+    results = {}
+    for sender, receiver, label in ((host, device, "bridge -> device"), (device, host, "device -> bridge")):
+        sent = {}
+        latencies = []
+        sender.open_port(0)
+        receiver.open_port(0)
+        receiver.set_callback(lambda event, data: latencies.append(time.perf_counter() - sent[tuple(event[0])]))
+        packets = sender.packets_sent
+        for tick in range(ticks):
+            for idx in range(burst):
+                counter = tick * burst + idx
+                msg = [144, counter >> 7 & 0x7F, counter & 0x7F]
+                sent[tuple(msg)] = time.perf_counter()
+                sender.send_message(msg)
+            await asyncio.sleep(interval)
+        await wait_for(lambda: len(latencies) == ticks * burst, timeout=2)
+        print_row(label, percentiles(latencies))
+        results[label] = (sender.packets_sent - packets, len(latencies))
+
+    # a few LCD updates, the SysEx has to survive the trip intact
+    received = []
+    device.set_callback(lambda event, data: received.append(event[0]))
+    lcd = [0xF0, 0x00, 0x00, 0x66, 0x15, 0x12, 0] + [65 + idx % 26 for idx in range(112)] + [0xF7]
+    host.send_message(lcd)
+    host.send_message([176, 48, 17])
+    await wait_for(lambda: len(received) == 2)
+    assert received == [lcd, [176, 48, 17]]
+
+    for label, (packets, delivered) in results.items():
+        print("{:24s} {} messages in {} packets".format(label, delivered, packets))
+    stats = host.stats()
+    print("clock sync rtt {:.3f} ms, jitter {:.3f} ms, lost {}".format(
+        stats["rtt_p50"] * 1000, stats["jitter"] * 1000, stats["lost"] + device.stats()["lost"]))
+
+    await host.stop()
+    await wait_for(lambda: not device.get_ports())
+    await device.stop()
+
+
+async def start_bridge(obs, assigned=8, **config):
+    # the whole bridge as it runs on the show PC, with a simulated X-Touch and the first audio inputs on its strips
+    bridge = load_bridge(obs_url=obs.url, obs_password=None, **config)
+    task = asyncio.create_task(bridge.main())
+    await wait_for(lambda: len(bridge.obs_inputs) > 2)
+    for strip, uuid in zip(bridge.visible, list(bridge.audio_inputs)[:assigned]):
+        strip.set_source(bridge.audio_inputs[uuid], uuid)
+        strip.apply_input_state(bridge.input_state[uuid])
+        strip.paint()
+    bridge.rebuild_obs_inputs()
+    await asyncio.sleep(0.1)
+    return bridge, task, bridge.units[0].midi_out.device
+
+
+async def stop_bridge(bridge, task):
+    task.cancel()
+    if bridge.metrics_server is not None:
+        bridge.metrics_server.close()
+    await bridge.ws.disconnect()
+
+
+async def bench_fader_to_obs(moves=50, sweeps=10, steps=64, interval=0.008):
+    print("Fader move to SetInputVolume at OBS (simulated X-Touch, fader_rate {}/s)".format(load_bridge().fader_rate))
+    obs = await StandInOBS().start()
+    bridge, task, device = await start_bridge(obs)
+
+    def first_request(value, after):
+        volume = (value / 127) ** 3
+        for stamp, _, data in obs.received("SetInputVolume"):
+            if stamp >= after and abs(data["inputVolumeMul"] - volume) < 1e-9:
+                return stamp
+        return None
+
+    # single moves, far enough apart that coalescing never holds them back
+    single = []
+    for idx in range(moves):
+        value = 20 + idx % 2 * 80 + idx % 7
+        device.move_fader(0, value)
+        moved = device.last_input
+        await wait_for(lambda: first_request(value, moved) is not None, timeout=2)
+        single.append(first_request(value, moved) - moved)
+        await asyncio.sleep(0.1)
+
+    # sweeps: only the resting value matters to the operator
+    resting = []
+    for sweep in range(sweeps):
+        values = [int(idx * 127 / (steps - 1)) for idx in range(steps)]
+        if sweep % 2:
+            values.reverse()
+        for value in values:
+            device.move_fader(0, value)
+            await asyncio.sleep(interval)
+        moved = device.last_input
+        await wait_for(lambda: first_request(values[-1], moved - interval) is not None, timeout=2)
+        resting.append(first_request(values[-1], moved - interval) - moved)
+        await asyncio.sleep(0.4)
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+    print_row("single move", percentiles(single))
+    print_row("end of sweep", percentiles(resting))
+
+
+async def bench_obs_to_led(changes=100, interval=0.02, meter_rate=20):
+    print("OBS mute event to MUTE LED on the simulated X-Touch")
+    obs = await StandInOBS(make_inputs(60)).start()
+    bridge, task, device = await start_bridge(obs)
+    assigned = [strip.source_uuid for strip in bridge.visible]
+
+    for label, rate in (("idle", None), ("meters {}/s".format(meter_rate), meter_rate)):
+        storm = asyncio.create_task(obs.meter_storm(rate, 3600)) if rate else None
+        latencies = []
+        for idx in range(changes):
+            slot = idx % 8
+            muted = not obs.inputs[assigned[slot]]["inputMuted"]
+            obs.set_input(assigned[slot], inputMuted=muted)
+            emitted = obs.events[-1][0]
+            await wait_for(lambda: device.buttons.get(16 + slot) == muted * 127, timeout=2)
+            latencies.append(device.changed[("button", 16 + slot)] - emitted)
+            await asyncio.sleep(interval)
+        if storm:
+            storm.cancel()
+        print_row(label, percentiles(latencies))
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+
+
+async def bench_meter_throughput(inputs=60, duration=2.0, rates=(20, 100, 500, 2000, None), max_p99=0.1):
+    print("Sustained InputVolumeMeters throughput: {} inputs, 8 strips metering, {:.0f} s per rate".format(inputs, duration))
+    print("(stand-in OBS runs in the same process and shares the CPU)")
+    obs = await StandInOBS(make_inputs(inputs)).start()
+    bridge, task, device = await start_bridge(obs)
+
+    processed = []
+
+    async def count_meters(event_type, event_data):
+        # registered after the bridge's callback, its task runs once the bridge handled the event
+        if event_type == "InputVolumeMeters":
+            processed.append(time.perf_counter())
+
+    bridge.ws.register_event_callback(count_meters)
+
+    sustained = 0
+    for rate in rates:
+        processed.clear()
+        before = len(obs.events)
+        sent = await obs.meter_storm(rate, duration)
+        emitted = [stamp for stamp, event_type in obs.events[before:] if event_type == "InputVolumeMeters"]
+        await wait_for(lambda: len(processed) >= sent, timeout=30)
+        latencies = [done - start for start, done in zip(emitted, processed)]
+        delivered = len(processed) / (processed[-1] - emitted[0])
+        label = "as fast as possible" if rate is None else "offered {}/s".format(rate)
+        print_row("{:<20s} {:7.0f}/s".format(label, delivered), percentiles(latencies))
+        if percentiles(latencies, (99,))[99] < max_p99 and (rate is None or delivered > rate * 0.95):
+            sustained = max(sustained, delivered)
+    print("max sustained with p99 under {:.0f} ms: {:.0f} events/s ({:.0f} meter updates/s)".format(
+        max_p99 * 1000, sustained, sustained * inputs))
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+
+
+async def http_get(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write("GET {} HTTP/1.0\r\n\r\n".format(path).encode())
+    response = await reader.read()
+    writer.close()
+    return response.split(b"\r\n\r\n", 1)[1].decode()
+
+
+async def bench_metrics(inputs=60, events=2000, seconds=2.0):
+    print("Instrumentation: cost on the meter path, metrics scrape and profiler")
+    obs = await StandInOBS(make_inputs(inputs)).start()
+    bridge, task, device = await start_bridge(obs)
+    port = bridge.metrics_server.sockets[0].getsockname()[1]
+    payloads = [meter_payload(inputs, frame) for frame in range(50)]
+
+    async def meter_rate():
+        start = time.perf_counter()
+        for idx in range(events):
+            await bridge.obs_event_callback("InputVolumeMeters", payloads[idx % len(payloads)])
+        return (time.perf_counter() - start) / events
+
+    # histograms switched off, on, and on with the profiler sampling; interleaved rounds, best of each
+    observe = bridge.Histogram.observe
+    best = {"bare": 1, "instrumented": 1, "profiler on": 1}
+    for _ in range(5):
+        for mode in best:
+            bridge.Histogram.observe = (lambda histogram, value: None) if mode == "bare" else observe
+            if mode == "profiler on":
+                await http_get(port, "/profiler/start")
+            best[mode] = min(best[mode], await meter_rate())
+            if mode == "profiler on":
+                await http_get(port, "/profiler/stop")
+    bridge.Histogram.observe = observe
+    print("per meter event " + "  ".join("{} {:.2f} us ({:+.1f}%)".format(mode, value * 1e6, (value / best["bare"] - 1) * 100)
+                                         for mode, value in best.items()))
+
+    # some real traffic, then scrape
+    for value in range(0, 128, 8):
+        device.move_fader(0, value)
+        await asyncio.sleep(0.01)
+    await obs.meter_storm(20, seconds / 2)
+    start = time.perf_counter()
+    text = await http_get(port, "/metrics")
+    print("scrape {:.2f} ms, {} lines, {} bytes".format((time.perf_counter() - start) * 1000, len(text.splitlines()), len(text)))
+    for line in text.splitlines():
+        if line.startswith(("xtouch_obs_event_seconds_count", "xtouch_obs_request_seconds_count", "xtouch_midi_input_seconds_count",
+                            "xtouch_midi_output_messages_total", "xtouch_obs_emits_total", "xtouch_profiler_samples_total")):
+            print("  " + line)
+    folded = await http_get(port, "/profiler")
+    print("profiler: {} distinct stacks, hottest: {}".format(len(folded.splitlines()), folded.splitlines()[0].rsplit(";", 1)[-1] if folded else "-"))
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+
+
+async def bench_strip_queues(slow=0.3, presses=20):
+    print("Per-strip work: SetInputMute on strip 4 takes {:.0f} ms at OBS".format(slow * 1000))
+    obs = await StandInOBS().start()
+    bridge, task, device = await start_bridge(obs)
+    obs.delays["SetInputMute"] = slow
+
+    # strip 4 is stuck waiting for OBS while the other strips are used
+    device.press(16 + 3)
+    await asyncio.sleep(0.01)
+    leds = []
+    volumes = []
+    for idx in range(presses):
+        slot = idx % 3
+        expected = 0 if device.buttons.get(8 + slot) else 127
+        device.press(8 + slot)  # SOLO, answered at normal speed
+        pressed = device.last_input
+        await wait_for(lambda: device.buttons.get(8 + slot) == expected, timeout=2)
+        leds.append(device.changed[("button", 8 + slot)] - pressed)
+
+        value = 30 + idx * 4
+        device.move_fader(4, value)
+        moved = device.last_input
+        await wait_for(lambda: any(stamp > moved and abs(data["inputVolumeMul"] - (value / 127) ** 3) < 1e-9
+                                   for stamp, _, data in obs.received("SetInputVolume")), timeout=2)
+        volumes.append(max(stamp for stamp, _, data in obs.received("SetInputVolume")) - moved)
+        await asyncio.sleep(0.06)
+    print_row("other strips' LEDs", percentiles(leds))
+    print_row("other strips' faders", percentiles(volumes))
+
+    # SOLO answered slowly on strip 4 holds back nothing but strip 4's own requests
+    obs.delays["SetInputAudioMonitorType"] = slow
+    before = len(obs.received("SetInputMute"))
+    device.press(8 + 3)
+    pressed = device.last_input
+    device.press(16 + 3)
+    await wait_for(lambda: len(obs.received("SetInputMute")) > before, timeout=10)
+    mutes = obs.received("SetInputMute")
+    print("MUTE on strip 4 behind its slow SOLO reached OBS after {:.0f} ms, in order".format(
+        (mutes[-1][0] - pressed) * 1000))
+    assert obs.received("SetInputAudioMonitorType")[-1][0] < mutes[-1][0]
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+
+
+async def bench_touch(sweeps=10, steps=64, interval=0.008, hold=0.1):
+    print("Touched fader: motor messages while the hand is on it, snap to OBS on release (fader_timeout {:.0f} ms)".format(
+        load_bridge().fader_timeout * 1000))
+    obs = await StandInOBS().start()
+    bridge, task, device = await start_bridge(obs)
+    scheduler = bridge.units[0].scheduler
+    uuid = bridge.visible[0].source_uuid
+
+    def motor():
+        return scheduler.kinds[224]
+
+    async def sweep(idx, touched, other=None):
+        values = [int(step * 127 / (steps - 1)) for step in range(steps)]
+        if idx % 2:
+            values.reverse()
+        if touched:
+            device.touch(0)
+        before = motor()
+        for value in values:
+            device.move_fader(0, value)
+            await asyncio.sleep(interval)
+        if other is not None:
+            # somebody else moves the volume in the OBS window while the hand is still on the fader
+            await wait_for(lambda: bridge.visible[0].fader_task is None and bridge.visible[0].fader_echoed, timeout=2)
+            obs.set_input(uuid, inputVolumeMul=(other / 127) ** 3)
+        await asyncio.sleep(hold)
+        during = motor() - before
+        snapped = device.changed.get(("fader", 0), 0)
+        if touched:
+            device.touch(0, False)
+        else:
+            await asyncio.sleep(bridge.fader_timeout)
+        released = time.perf_counter() if not touched else device.last_input
+        await wait_for(lambda: bridge.visible[0].fader_release is None and bridge.visible[0].fader_task is None, timeout=2)
+        await asyncio.sleep(0.05)
+        changed = device.changed.get(("fader", 0), 0)
+        return during, changed - released if changed > snapped else None, device.faders[0]
+
+    results = {}
+    for touched in (True, False):
+        during = []
+        for idx in range(sweeps):
+            moved, _, _ = await sweep(idx, touched)
+            during.append(moved)
+        results[touched] = during
+        print("{:<24} {} motor messages during {} sweeps".format(
+            "touched" if touched else "untouched", sum(during), sweeps))
+
+    # the value OBS ends up with after release wins, without another move of the fader
+    snaps = []
+    for idx in range(sweeps):
+        other = 20 + idx * 7
+        _, snap, position = await sweep(idx, True, other)
+        assert abs(position - other) <= 1, (position, other)
+        snaps.append(snap)
+    print_row("release -> snap", percentiles(snaps))
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+
+
+async def bench_encoder(latency=0.02, turns=50, spins=10, spin=30, interval=0.005, inputs=60):
+    print("Encoder: turn to ring LED with OBS {:.0f} ms away, spins and source browsing with acceleration".format(latency * 1000))
+    obs = await StandInOBS(make_inputs(inputs), latency=latency).start()
+    bridge, task, device = await start_bridge(obs)
+    strip = bridge.visible[0]
+
+    # single detents: the ring moves before OBS has even seen the request
+    rings = []
+    for idx in range(turns):
+        device.turn(0, 1 if idx % 2 else 65)
+        turned = device.last_input
+        await wait_for(lambda: device.changed.get(("ring", 0), 0) > turned, timeout=2)
+        rings.append(device.changed[("ring", 0)] - turned)
+        await asyncio.sleep(0.08)
+    print_row("turn -> ring", percentiles(rings))
+
+    # fast spins: one request per encoder_rate tick, the ring ends where the hand left it
+    counts = []
+    for idx in range(spins):
+        before = len(obs.received("SetInputAudioBalance"))
+        for _ in range(spin):
+            device.turn(0, 2 if idx % 2 else 66)
+            await asyncio.sleep(interval)
+        await wait_for(lambda: strip.balance_task is None and strip.balance_echoed, timeout=2)
+        await asyncio.sleep(latency * 2)
+        received = obs.received("SetInputAudioBalance")[before:]
+        counts.append(len(received))
+        assert received[-1][2]["inputAudioBalance"] == strip.enc_value / 10
+        assert device.rings[0] == strip.enc_value + strip.led_modes[strip.enc_mode][0]
+    print("{} messages per spin -> SetInputAudioBalance min {} max {}".format(spin, min(counts), max(counts)))
+
+    # turning on against the end stop sends nothing, balance changes made in OBS still move the ring
+    for _ in range(spin):
+        device.turn(0, 15)
+        await asyncio.sleep(interval)
+    await wait_for(lambda: strip.balance_task is None and strip.balance_echoed, timeout=2)
+    before = len(obs.received("SetInputAudioBalance"))
+    for _ in range(spin):
+        device.turn(0, 1)
+        await asyncio.sleep(interval)
+    await asyncio.sleep(latency * 2)
+    stopped = len(obs.received("SetInputAudioBalance")) - before
+    obs.set_input(strip.source_uuid, inputAudioBalance=0.3)
+    await wait_for(lambda: device.rings[0] == 3 + strip.led_modes[strip.enc_mode][0], timeout=2)
+    print("{} messages against the end stop -> SetInputAudioBalance {}, OBS balance change -> ring followed".format(spin, stopped))
+    assert stopped == 0
+
+    # browsing sources in select mode: messages needed from the first input to the last
+    for speed in (1, 4, 7):
+        device.press(24)
+        await asyncio.sleep(0.02)
+        messages = 0
+        first = strip.source_cnt
+        while strip.source_cnt != len(bridge.obs_inputs) - 1:
+            device.turn(0, speed)
+            messages += 1
+            await asyncio.sleep(interval)
+        print("browse {} sources at speed {}: {} messages".format(strip.source_cnt - first, speed, messages))
+        for _ in range(len(bridge.obs_inputs)):
+            device.turn(0, 64 + 15)
+            await asyncio.sleep(0.001)
+        device.press(24)
+        await asyncio.sleep(0.02)
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+
+
+def legacy_dispatch(bridge, midi_msg, unit=0):
+    # the routing before the mapping table: bank controls, then by status byte, then the row chain in the strip
+    b1, b2, b3 = midi_msg
+    step = bridge.bank_controls.get((b1, b2))
+    if step is not None:
+        return
+    if b1 == 144:
+        strip = bridge.visible[unit * 8 + b2 % 8]
+        row = b2 - b2 % 8
+        if row == 0:
+            strip.post(strip.press_track, ["2", b3])
+        elif row == 8:
+            strip.post(strip.press_monitor, [None, b3])
+        elif row == 16:
+            strip.post(strip.press_mute, [None, b3])
+        elif row == 24:
+            strip.post(strip.press_select, [None, b3])
+        elif row == 32:
+            strip.post(strip.press_encoder, [None, b3])
+        elif row == 104:
+            strip.post(strip.touch_fader, [None, b3])
+    elif b1 == 176:
+        strip = bridge.visible[unit * 8 + b2 % 8]
+        strip.post(strip.process_encoder, [b2 - b2 % 8, b3])
+    elif 224 <= b1 < 232:
+        strip = bridge.visible[unit * 8 + b1 - 224]
+        strip.post(strip.process_fader, [b1, b3])
+
+
+async def bench_mapping(messages=200000, presses=50, latency=0.02):
+    print("Control mapping: compile time, dispatch cost per message, global controls end to end")
+    mapping = {
+        "strip": {"0": {"action": "track", "track": 3}, "8": {"action": "monitor"}, "16": {"action": "mute"},
+                  "24": {"action": "select"}, "32": {"action": "encoder_mode"}, "104": {"action": "touch"}},
+        "controls": [{"note": 84, "action": "scene", "scene": "Intro"},
+                     {"note": 85, "action": "filter", "source": "Mic", "filter": "Noise Gate"},
+                     {"note": 86, "action": "hotkey", "hotkey": "OBSBasic.StartStreaming"},
+                     {"cc": 64, "action": "scene", "scene": "Outro"},
+                     {"note": 46, "action": "bank", "step": -1},
+                     {"note": 47, "action": "bank", "step": 1}],
+    }
+    bridge = load_bridge()
+    start = time.perf_counter()
+    for _ in range(100):
+        bridge.compile_mapping(mapping)
+    print("compile                  {:.3f} ms".format((time.perf_counter() - start) / 100 * 1000))
+
+    # the strips only count what they are handed, the cost measured is the routing
+    for strip in bridge.visible:
+        strip.post = lambda handler, msg: None
+    stream = [[144, 24 + idx % 8, 127] if idx % 3 == 0 else [176, 16 + idx % 8, 1] if idx % 3 == 1 else [224 + idx % 8, 0, idx % 128]
+              for idx in range(1000)]
+    for name, dispatch in (("legacy if/elif", lambda msg: legacy_dispatch(bridge, msg)), ("mapping table", bridge.dispatch_midi)):
+        best = None
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(messages // len(stream)):
+                for msg in stream:
+                    dispatch(msg)
+            elapsed = (time.perf_counter() - start) / messages
+            best = elapsed if best is None else min(best, elapsed)
+        print("{:<24} {:.0f} ns per message".format(name, best * 1e9))
+
+    # bad files are refused when they are loaded
+    for bad in ({"strip": {"5": {"action": "mute"}}},
+                {"strip": {"0": {"action": "track", "track": 9}}},
+                {"controls": [{"note": 26, "action": "scene", "scene": "Intro"}]},
+                {"controls": [{"cc": 64, "action": "scene"}]},
+                {"controls": [{"note": 90, "action": "launch"}]}):
+        try:
+            bridge.compile_mapping(dict(bad, strip=bad.get("strip", bridge.default_mapping["strip"])))
+            print("accepted", bad)
+        except ValueError as e:
+            print("refused:", e)
+
+    # the global controls on a simulated X-Touch, OBS 20 ms away
+    path = os.path.join(tempfile.mkdtemp(prefix="xtouch-bench-"), "xtouch-mapping.json")
+    with open(path, "w") as f:
+        json.dump(mapping, f)
+    obs = await StandInOBS(latency=latency).start()
+    obs.filters[("Mic", "Noise Gate")] = True
+    bridge, task, device = await start_bridge(obs, mapping_file=path)
+    for note, request_type in ((84, "SetCurrentProgramScene"), (85, "SetSourceFilterEnabled"), (86, "TriggerHotkeyByName")):
+        latencies = []
+        for _ in range(presses // 5):
+            before = len(obs.received(request_type))
+            device.press(note)
+            pressed = device.last_input
+            device.release(note)
+            await wait_for(lambda: len(obs.received(request_type)) > before, timeout=2)
+            latencies.append(obs.received(request_type)[-1][0] - pressed)
+        print_row(request_type, percentiles(latencies))
+    assert obs.filters[("Mic", "Noise Gate")] == (presses // 5 % 2 == 0)
+    device.press(0)
+    await wait_for(lambda: len(obs.received("SetInputAudioTracks")) > 0, timeout=2)
+    print("REC on track 3:", obs.received("SetInputAudioTracks")[-1][2]["inputAudioTracks"])
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+
+
+async def bench_scenes(scenes=12, switches=60, interval=0.05):
+    print("Strips following the program scene: {} scenes with nested scenes and groups".format(scenes))
+    obs = await StandInOBS(make_inputs(60, audio_every=2)).start()
+    audio = [uuid for uuid, inpt in obs.inputs.items() if inpt["audio"]]
+    images = [uuid for uuid, inpt in obs.inputs.items() if not inpt["audio"]]
+    obs.add_scene("Shared", [audio[0], images[0], audio[1]])
+    obs.add_scene("Band", [audio[2], audio[3], audio[4]], group=True)
+    names = []
+    for idx in range(scenes):
+        name = "Scene {}".format(idx)
+        own = audio[5 + idx * 2:7 + idx * 2]
+        obs.add_scene(name, [images[idx + 1], own[0], "Shared"] + (["Band"] if idx % 2 else []) + [own[1]])
+        names.append(name)
+    obs.program_scene = names[0]
+
+    bridge = load_bridge(obs_url=obs.url, obs_password=None, follow_program_scene=True)
+    before = obs.round_trips
+    task = asyncio.create_task(bridge.main())
+    await wait_for(lambda: bridge.program_scene is not None and bridge.visible[0].source_uuid != "")
+    device = bridge.units[0].midi_out.device
+    scene_requests = [entry[1] for entry in obs.requests if entry[1].startswith(("GetScene", "GetGroup"))]
+    print("startup: {} requests for the scene index, {} OBS round trips in all".format(len(scene_requests), obs.round_trips - before))
+
+    def expected(name):
+        # top to bottom as OBS shows them, each input once
+        uuids = []
+        for item in reversed(obs.scenes[name]):
+            nested = expected(item["sourceName"]) if item["sourceName"] in obs.scenes else [item["sourceUuid"]]
+            uuids += [uuid for uuid in nested if uuid in audio and uuid not in uuids]
+        return uuids
+
+    def shown():
+        return [strip.source_uuid for strip in bridge.visible if strip.source_uuid != ""]
+
+    # program scene switches: the strips from the caches only
+    requests = len(obs.requests)
+    messages = device.received
+    layouts = []
+    for idx in range(switches):
+        name = names[(idx + 1) % len(names)]
+        obs.switch_scene(name)
+        switched = time.perf_counter()
+        await wait_for(lambda: shown() == expected(name)[:8], timeout=2)
+        layouts.append(time.perf_counter() - switched)
+        await asyncio.sleep(interval)
+    print_row("switch -> strips", percentiles(layouts))
+    print("{} switches: {} OBS requests, {:.1f} MIDI messages per switch".format(
+        switches, len(obs.requests) - requests, (device.received - messages) / switches))
+
+    # edits of the program scene and of a scene nested in it
+    edits = []
+    program = obs.program_scene
+    others = [uuid for uuid in audio if uuid not in expected(program)]
+    for idx in range(10):
+        item = obs.add_scene_item(program, others[idx % len(others)])
+        edited = time.perf_counter()
+        await wait_for(lambda: shown() == expected(program)[:8], timeout=2)
+        edits.append(time.perf_counter() - edited)
+        obs.remove_scene_item(program, item)
+        await wait_for(lambda: shown() == expected(program)[:8], timeout=2)
+        item = obs.add_scene_item("Shared", others[-1 - idx % len(others)], 0)
+        edited = time.perf_counter()
+        await wait_for(lambda: shown() == expected(program)[:8], timeout=2)
+        edits.append(time.perf_counter() - edited)
+        obs.remove_scene_item("Shared", item)
+        await wait_for(lambda: shown() == expected(program)[:8], timeout=2)
+    print_row("scene item -> strips", percentiles(edits))
+    print("requests after the switches: {}".format(len(obs.requests) - requests))
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+
+
+async def bench_replay(duration=3.0):
+    print("Capture and replay: a {:.0f} s session with meters, fader moves and OBS changes recorded, then replayed".format(duration))
+    capture_file = os.path.join(tempfile.mkdtemp(prefix="xtouch-bench-"), "session.xtcap")
+    obs = await StandInOBS(make_inputs(24, audio_every=2)).start()
+    bridge, task, device = await start_bridge(obs, capture_file=capture_file)
+    bridge.capture_state()
+    audio = [uuid for uuid, inpt in obs.inputs.items() if inpt["audio"]]
+
+    async def operator():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        count = 0
+        while loop.time() - start < duration:
+            slot = count % 8
+            device.touch(slot)
+            for step in range(16):
+                device.move_fader(slot, (step * 8 + count) % 128)
+                await asyncio.sleep(0.008)
+            device.touch(slot, False)
+            device.turn(slot, 1 if count % 2 else 65)
+            obs.set_input(audio[(count + 3) % len(audio)], inputMuted=bool(count % 2))
+            count += 1
+            await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    await asyncio.gather(obs.meter_storm(20, duration), operator())
+    await asyncio.sleep(0.2)
+    recorded = time.perf_counter() - started
+    await stop_bridge(bridge, task)
+    bridge.capture.close()
+    await obs.stop()
+    print("capture: {} records in {:.0f} kB, {:.0f} bytes per second of session".format(
+        bridge.capture.records, os.path.getsize(capture_file) / 1024, os.path.getsize(capture_file) / recorded))
+
+    # the replay runs its own loop on the capture's clock
+    for label, realtime in (("as fast as possible:", False), ("again:", False), ("paced:", True)):
+        result = await asyncio.to_thread(replay.replay, capture_file, realtime)
+        print("replay {:<21} {:.3f} s, {:.0f} inputs/s, {} MIDI messages / {} bytes out (captured {} / {}), digest {}, {} unanswered".format(
+            label, result["elapsed"], result["throughput"], result["messages"], result["bytes"],
+            result["captured_messages"], result["captured_bytes"], result["digest"][:12], sum(result["missing"].values())))
+
+
+async def bench_meter_subscription(inputs=60, frames=2000, duration=1.0):
+    print("InputVolumeMeters on the wire: decode cost of a {}-input frame, subscription only while strips show meters".format(inputs))
+    message = {"op": 5, "d": {"eventType": "InputVolumeMeters", "eventIntent": 1 << 16, "eventData": meter_payload(inputs, 0)}}
+    as_json = json.dumps(message).encode()
+    as_msgpack = msgpack.packb(message)
+    decoders = (
+        ("json.loads", lambda: json.loads(as_json), len(as_json)),
+        ("msgpack.unpackb", lambda: msgpack.unpackb(as_msgpack), len(as_msgpack)),
+        # what simpleobsws does with every message: unpack, then format it for a debug log that is usually off
+        ("simpleobsws receive", lambda: json.dumps(msgpack.unpackb(as_msgpack), indent=2), len(as_msgpack)),
+    )
+    for name, decode, size in decoders:
+        start = time.perf_counter()
+        for _ in range(frames):
+            decode()
+        elapsed = (time.perf_counter() - start) / frames
+        print("{:<20} {:6d} bytes  {:7.1f} us per frame  {:5.2f}% of a core at 20 frames/s".format(
+            name, size, elapsed * 1e6, elapsed * 20 * 100))
+
+    obs = await StandInOBS(make_inputs(inputs)).start()
+    bridge = load_bridge(obs_url=obs.url, obs_password=None, meters_off_delay=0.2)
+    task = asyncio.create_task(bridge.main())
+    await wait_for(lambda: len(bridge.obs_inputs) > 2)
+    device = bridge.units[0].midi_out.device
+
+    def subscribed():
+        return any(subscriptions & (1 << 16) for subscriptions in obs.subscriptions.values())
+
+    async def storm(label):
+        before = obs.delivered["InputVolumeMeters"]
+        sent = await obs.meter_storm(20, duration)
+        print("{:<34} {:3d} of {} frames delivered".format(label, obs.delivered["InputVolumeMeters"] - before, sent))
+
+    await storm("no strip assigned:")
+    strip = bridge.visible[0]
+    assigned = time.perf_counter()
+    strip.assign(list(bridge.audio_inputs)[0])
+    strip.paint()
+    await wait_for(subscribed)
+    print("assign -> subscribed: {:.2f} ms".format((time.perf_counter() - assigned) * 1000))
+    await storm("one strip showing meters:")
+    device.press(24)
+    await storm("its strip in select mode:")
+    device.press(24)
+    await wait_for(subscribed)
+    await storm("select mode left:")
+    print("Reidentify messages: {}".format(obs.reidentified))
+
+    await stop_bridge(bridge, task)
+    await obs.stop()
+
+
+class RecordingMidiOut:
+    # rtmidi.MidiOut look-alike keeping (perf_counter timestamp, message)
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, msg):
+        self.messages.append((time.perf_counter(), list(msg)))
+
+
+def program_levels(frame, strip_num, hits):
+    # program audio: a quiet bed in both channels, a drum hit on the left one every few frames decaying over two frames
+    rng = hits[strip_num]
+    bed = 0.02 + 0.01 * math.sin(frame / 7 + strip_num)
+    since = frame % (7 + strip_num % 3)
+    left = bed + rng[frame // (7 + strip_num % 3) % len(rng)] * (0.5 ** since if since < 3 else 0)
+    return [[left * 0.7, left, left], [bed * 0.7, bed, bed]]
+
+
+async def bench_meter_ballistics(frames=100, interval=0.05):
+    print("Meter ballistics: {} OBS frames of drum hits on 8 strips, per-frame channel average vs local true peak at {} fps".format(
+        frames, load_bridge().meter_fps))
+    random_hits = [[0.3 + 0.6 * ((idx * 7919 + num * 104729) % 97) / 97 for idx in range(16)] for num in range(8)]
+
+    for mode in ("before", "after"):
+        bridge = load_bridge()
+        port = RecordingMidiOut()
+        bridge.units[0].scheduler.port = port
+        for strip in bridge.visible:
+            strip.reset()
+            strip.set_source("Drums {}".format(strip.num), "uuid-{}".format(strip.num))
+            strip.restore()
+        await asyncio.sleep(0.1)
+        port.messages.clear()
+
+        hits = []
+        start = time.perf_counter()
+        for frame in range(frames):
+            for strip in bridge.visible:
+                levels = program_levels(frame, strip.num, random_hits)
+                if mode == "before":
+                    # each frame straight to the meter, the channels averaged
+                    average_mul = sum(channel[1] for channel in levels) / len(levels)
+                    strip.show_meter(bisect.bisect_right(bridge.meter_thresholds, average_mul))
+                else:
+                    strip.update_volumeter(levels)
+                if frame % (7 + strip.num % 3) == 0:
+                    hits.append((time.perf_counter(), strip.num, bisect.bisect_right(bridge.meter_thresholds, levels[0][1])))
+            await asyncio.sleep(max(0, start + (frame + 1) * interval - time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(1.5)
+
+        meters = [(stamp, msg[1] >> 4, msg[1] & 15) for stamp, msg in port.messages if msg[0] == 208]
+        shown = collections.defaultdict(list)
+        falls = []
+        for stamp, slot, segment in meters:
+            if shown[slot] and segment < shown[slot][-1][1]:
+                falls.append(shown[slot][-1][1] - segment)
+            shown[slot].append((stamp, segment))
+
+        def peak_shown(slot, stamp):
+            # the highest segment on the device in the 100 ms after the hit, what was already lit included
+            values = [value for at, value in shown[slot] if stamp <= at < stamp + 0.1]
+            before = [value for at, value in shown[slot] if at < stamp]
+            return max(values + before[-1:], default=0)
+
+        caught = sum(1 for stamp, slot, segment in hits if peak_shown(slot, stamp) >= segment)
+        during = [entry for entry in meters if entry[0] < start + elapsed]
+        print("{:<8} {:5.1f} meter messages/s  hits shown at full height {:3d}/{}  falls: mean {:.2f} max {} segments".format(
+            mode, len(during) / elapsed, caught, len(hits), sum(falls) / max(1, len(falls)), max(falls, default=0)))
+
+
+BENCHMARKS = {
+    "midi_input": bench_midi_input,
+    "mirror": bench_mirror,
+    "fader": bench_fader,
+    "meter_dispatch": bench_meter_dispatch,
+    "assign": bench_assign,
+    "lcd": bench_lcd,
+    "scheduler": bench_scheduler,
+    "writer": bench_writer,
+    "bank": bench_bank,
+    "recovery": bench_recovery,
+    "startup": bench_startup,
+    "rtpmidi": bench_rtpmidi,
+    "fader_to_obs": bench_fader_to_obs,
+    "obs_to_led": bench_obs_to_led,
+    "meter_throughput": bench_meter_throughput,
+    "metrics": bench_metrics,
+    "strip_queues": bench_strip_queues,
+    "touch": bench_touch,
+    "encoder": bench_encoder,
+    "mapping": bench_mapping,
+    "scenes": bench_scenes,
+    "replay": bench_replay,
+    "meter_subscription": bench_meter_subscription,
+    "meter_ballistics": bench_meter_ballistics,
+}
+
+
+async def run(names):
+    for name in names:
+        await BENCHMARKS[name]()
+        print()
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        if name not in BENCHMARKS:
+            print("unknown benchmark:", name, "choose from", ", ".join(BENCHMARKS))
+            sys.exit(1)
+    asyncio.run(run(selected))
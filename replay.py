@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import tempfile
+import selectors
+import collections
+
+import msgpack
+import simpleobsws
+
+import simulator
+
+# replays a capture (capture_file in Xtouch-Simpleobsws.py) through the bridge, with simulated X-Touch units and no OBS:
+#   python replay.py show.xtcap              as fast as possible
+#   python replay.py show.xtcap --realtime   paced like the capture
+# the bridge runs on a virtual clock driven by the capture's timestamps, so rate limits, LCD frames, fader release
+# timers and meter ballistics behave as they did during the show and two replays of a capture send the same bytes
+# whatever the host; the output digest compares runs before and after a change
+
+
+class VirtualClock:
+    # the bridge's time module and the event loop's clock; it only moves when the loop would wait for its next timer
+
+    def __init__(self, realtime=False):
+        self.now = time.monotonic()
+        self.realtime = realtime
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+
+class VirtualSelector(selectors.DefaultSelector):
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        if timeout is None or timeout <= 0:
+            return super().select(timeout)
+        # the loop waits for a timer: jump to it, paced replays wait for real first
+        events = super().select(timeout if self.clock.realtime else 0)
+        if not events:
+            self.clock.now += timeout
+        return events
+
+
+class VirtualLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, clock):
+        super().__init__(VirtualSelector(clock))
+        self.clock = clock
+
+    def time(self):
+        return self.clock.now
+
+
+class ReplayOBS:
+    # takes the place of the OBS connection: requests get the answers captured for them, events come from the capture
+
+    # an answer is captured after its request left, never before it
+    tolerance = 0.001
+
+    def __init__(self, clock, responses):
+        self.clock = clock
+        self.start = clock.now
+        self.identified = True
+        self.requests = collections.Counter()
+        self.missing = collections.Counter()
+        # (requestType, packed requestData) -> deque of (seconds, result, code, responseData)
+        self.responses = responses
+        # the bridge sends Reidentify on the socket itself
+        self.ws = self
+
+    def answer(self, request):
+        self.requests[request.requestType] += 1
+        response = simpleobsws.RequestResponse(request.requestType)
+        answers = self.responses.get((request.requestType, msgpack.packb(request.requestData)), ())
+        current = self.clock.now - self.start
+        while answers and answers[0][0] < current - self.tolerance:
+            answers.popleft()
+        if answers:
+            _, response.requestStatus.result, response.requestStatus.code, response.responseData = answers.popleft()
+        elif request.requestType.startswith("Get"):
+            # the bridge asked something the capture has no answer for, what follows may differ from the show
+            self.missing[request.requestType] += 1
+            print("replay diverges at {:.3f} s: no captured answer to {} {}".format(current, request.requestType, request.requestData))
+            response.requestStatus.code = 600
+        else:
+            response.requestStatus.result = True
+            response.requestStatus.code = 100
+        return response
+
+    async def call(self, request, timeout=15):
+        return self.answer(request)
+
+    async def call_batch(self, requests, timeout=15, halt_on_failure=None):
+        return [self.answer(request) for request in requests]
+
+    async def send(self, message):
+        self.requests["Reidentify"] += 1
+
+    async def emit(self, request):
+        self.requests[request.requestType] += 1
+
+    async def disconnect(self):
+        pass
+
+
+class DigestPort:
+    # passes MIDI on to the simulated unit and hashes it in order
+
+    def __init__(self, port, digest):
+        self.port = port
+        self.digest = digest
+
+    def send_message(self, msg):
+        self.digest.update(bytes(msg))
+        self.port.send_message(msg)
+
+
+def idle(bridge):
+    return all(strip.inbox_task is None and strip.request_task is None and strip.fader_task is None
+               and strip.balance_task is None for strip in bridge.strips.values())
+
+
+async def run(path, clock):
+    loop = asyncio.get_running_loop()
+    # as many units as the capture used, the bridge keeps time with the replay
+    config = {"snapshot_file": os.path.join(tempfile.mkdtemp(prefix="xtouch-replay-"), "xtouch-layout.json"),
+              "metrics_port": None, "midi_output_mode": "direct", "time": clock}
+    records = simulator.load_bridge(**config).read_capture(path)
+    units = max([unit for _, _, unit, _ in records] + [0]) + 1
+    bridge = simulator.load_bridge(units, **config)
+    for strip in bridge.strips.values():
+        strip.reset()
+    await asyncio.sleep(0.1)
+
+    responses = collections.defaultdict(collections.deque)
+    for stamp, kind, unit, payload in records:
+        if kind == bridge.CAPTURE_OBS_RESPONSE:
+            request_type, request_data, result, code, response_data = msgpack.unpackb(payload)
+            responses[(request_type, msgpack.packb(request_data))].append((stamp, result, code, response_data))
+    obs = bridge.ws = ReplayOBS(clock, responses)
+    digest = hashlib.sha1()
+    for unit in bridge.units:
+        unit.scheduler.port = DigestPort(unit.scheduler.port, digest)
+    before = [(unit.scheduler.sent, unit.scheduler.bytes) for unit in bridge.units]
+
+    counts = collections.Counter()
+    captured_out = [0, 0]
+    stated = False
+    start = time.perf_counter()
+    for stamp, kind, unit, payload in records:
+        wait = obs.start + stamp - loop.time()
+        await asyncio.sleep(max(0, wait))
+        counts[kind] += 1
+        if kind == bridge.CAPTURE_MIDI_IN:
+            bridge.dispatch_midi(list(payload), unit)
+        elif kind == bridge.CAPTURE_OBS_EVENT:
+            event_type, event_data = msgpack.unpackb(payload)
+            await bridge.obs_event_callback(event_type, event_data)
+        elif kind == bridge.CAPTURE_STATE:
+            bridge.apply_state(msgpack.unpackb(payload))
+            stated = True
+        elif kind == bridge.CAPTURE_MIDI_OUT and stated:
+            # what the bridge sent from the first state on, the replay starts there too
+            captured_out[0] += 1
+            captured_out[1] += len(payload)
+
+    # strips finish their queues, the LCD its last frame
+    while not idle(bridge):
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)
+    handled = time.perf_counter() - start
+
+    sent = sum(unit.scheduler.sent for unit in bridge.units) - sum(entry[0] for entry in before)
+    sent_bytes = sum(unit.scheduler.bytes for unit in bridge.units) - sum(entry[1] for entry in before)
+    duration = records[-1][0] if records else 0
+    inputs = counts[bridge.CAPTURE_MIDI_IN] + counts[bridge.CAPTURE_OBS_EVENT]
+    return {
+        "records": len(records),
+        "duration": duration,
+        "midi_in": counts[bridge.CAPTURE_MIDI_IN],
+        "obs_events": counts[bridge.CAPTURE_OBS_EVENT],
+        "answers": counts[bridge.CAPTURE_OBS_RESPONSE],
+        "captured_messages": captured_out[0],
+        "captured_bytes": captured_out[1],
+        "elapsed": handled,
+        "throughput": inputs / handled if handled else 0,
+        "messages": sent,
+        "bytes": sent_bytes,
+        "digest": digest.hexdigest(),
+        "requests": dict(obs.requests),
+        "missing": dict(obs.missing),
+    }
+
+
+def replay(path, realtime=False):
+    # its own loop on the virtual clock, callers already running a loop use a thread
+    clock = VirtualClock(realtime)
+    loop = VirtualLoop(clock)
+    try:
+        return loop.run_until_complete(run(path, clock))
+    finally:
+        loop.close()
+
+
+def report(result, realtime):
+    print("capture: {:.1f} s, {} MIDI in, {} OBS events, {} OBS answers, {} MIDI out messages / {} bytes after the state".format(
+        result["duration"], result["midi_in"], result["obs_events"], result["answers"],
+        result["captured_messages"], result["captured_bytes"]))
+    print("replay {}: {:.3f} s, {:.0f} inputs/s{}".format(
+        "paced" if realtime else "as fast as possible", result["elapsed"], result["throughput"],
+        "" if realtime or not result["elapsed"] else ", {:.1f}x real time".format(result["duration"] / result["elapsed"])))
+    print("output: {} MIDI messages / {} bytes, digest {}".format(result["messages"], result["bytes"], result["digest"]))
+    print("OBS requests: {}".format(sum(result["requests"].values())),
+          " ".join("{}={}".format(name, count) for name, count in sorted(result["requests"].items())))
+    if result["missing"]:
+        print("requests without a captured answer:", " ".join("{}={}".format(name, count) for name, count in sorted(result["missing"].items())))
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if len(args) != 1:
+        print("usage: python replay.py <capture file> [--realtime]")
+        sys.exit(1)
+    realtime = "--realtime" in sys.argv
+    result = replay(args[0], realtime)
+    report(result, realtime)
+    # a replay that had to make up answers is not the show any more
+    sys.exit(1 if result["missing"] else 0)
@@ -0,0 +1,455 @@
+import time
+import random
+import struct
+import asyncio
+import collections
+import urllib.parse
+
+# RTP-MIDI (RFC 6295) with the AppleMIDI session protocol over UDP
+# an RtpMidiPort behaves like an opened rtmidi MidiIn and MidiOut at the same time:
+#   rtpmidi://192.168.1.50:5004  invites the device listening on that control port
+#   rtpmidi://:5004              waits for the device to invite us on ports 5004 (control) and 5005 (data)
+
+SESSION_NAME = "Xtouch-Simpleobsws"
+PROTOCOL_VERSION = 2
+PAYLOAD_TYPE = 0x61
+# keep packets well below the ethernet MTU, a tick with more commands goes out in several packets
+MAX_COMMAND_BYTES = 1000
+
+# MIDI data bytes after each status, by the status high nibble (channel messages) or the status itself
+CHANNEL_LENGTHS = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+SYSTEM_LENGTHS = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0, 0xF8: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFE: 0, 0xFF: 0}
+
+
+def ticks():
+    # AppleMIDI timestamps count 100 microsecond ticks
+    return int(time.monotonic() * 10000)
+
+
+def encode_commands(messages):
+    # MIDI command section: every command after the first carries a zero delta time, they share the packet timestamp
+    body = bytearray()
+    for msg in messages:
+        if body:
+            body.append(0)
+        body.extend(msg)
+
+    if len(body) <= 15:
+        return bytes([len(body)]) + body
+    return bytes([0x80 | len(body) >> 8, len(body) & 0xFF]) + body
+
+
+def decode_commands(data, pos, sysex):
+    # returns the complete messages of a MIDI command section, sysex holds an unfinished SysEx between packets
+    flags = data[pos]
+    if flags & 0x80:
+        length = (flags & 0x0F) << 8 | data[pos + 1]
+        pos += 2
+    else:
+        length = flags & 0x0F
+        pos += 1
+    end = min(pos + length, len(data))
+
+    messages = []
+    status = None
+    first = True
+    while pos < end:
+        # delta time, absent before the first command unless the Z flag is set
+        if not first or flags & 0x20:
+            while pos < end and data[pos] & 0x80:
+                pos += 1
+            pos += 1
+        first = False
+        if pos >= end:
+            break
+
+        byte = data[pos]
+        if byte in (0xF0, 0xF7):
+            # SysEx, possibly split in segments: F0 .. F0, then F7 .. F0, then F7 .. F7
+            stop = pos + 1
+            while stop < end and data[stop] not in (0xF0, 0xF7, 0xF4):
+                stop += 1
+            if stop >= end:
+                break
+            if byte == 0xF0:
+                sysex[:] = [0xF0]
+            sysex.extend(data[pos + 1:stop])
+            if data[stop] == 0xF7 and sysex:
+                sysex.append(0xF7)
+                messages.append(list(sysex))
+                sysex.clear()
+            elif data[stop] == 0xF4:
+                sysex.clear()
+            pos = stop + 1
+            continue
+
+        if byte & 0x80:
+            pos += 1
+            if byte >= 0xF0:
+                count = SYSTEM_LENGTHS.get(byte, 0)
+                messages.append([byte, *data[pos:pos + count]])
+                pos += count
+                if byte < 0xF8:
+                    # system common cancels running status, real-time does not
+                    status = None
+                continue
+            status = byte
+        elif status is None:
+            # data byte without a status to run on, skip it
+            pos += 1
+            continue
+
+        count = CHANNEL_LENGTHS[status & 0xF0]
+        messages.append([status, *data[pos:pos + count]])
+        pos += count
+
+    return messages
+
+
+class Endpoint(asyncio.DatagramProtocol):
+
+    def __init__(self, session, channel):
+        self.session = session
+        self.channel = channel
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.session.received(self.channel, data, addr)
+
+
+class RtpMidiPort:
+    # one AppleMIDI session, a Unit uses the same object as its midi_in and midi_out
+    # it is driven by the asyncio loop: send_message must be called from the loop thread
+
+    # clock syncs are fast right after the session opens, then every sync_interval seconds
+    sync_interval = 10
+    # the session is considered gone without a clock sync for this many seconds
+    sync_timeout = 30
+    # invitations are repeated this often until the device answers
+    invite_interval = 1
+
+    def __init__(self, url, bind="0.0.0.0"):
+        address = urllib.parse.urlsplit(url)
+        self.url = url
+        self.host = address.hostname
+        self.port = 5004 if address.port is None else address.port
+        self.bind = bind
+        self.local_port = None
+        self.ssrc = random.getrandbits(32)
+        self.control = None
+        self.data = None
+        self.task = None
+
+        # session: "idle", "control" and "data" while inviting, "open"
+        self.state = "idle"
+        self.token = 0
+        self.peer_name = None
+        self.peer_ssrc = None
+        self.peer_control = None
+        self.peer_data = None
+        self.last_invite = 0
+        self.last_sync = 0
+        self.syncs = 0
+
+        # rtmidi port emulation
+        self.opened = False
+        self.callback = None
+        self.messages = collections.deque(maxlen=1024)
+        self.last_message = None
+        self.pending = []
+        self.flush_handle = None
+        self.sysex = []
+
+        # RTP
+        self.sequence = random.getrandbits(16)
+        self.received_sequence = None
+        self.feedback_sequence = None
+
+        # statistics
+        self.rtt = None
+        self.rtt_samples = collections.deque(maxlen=100)
+        self.jitter = 0
+        self.last_transit = None
+        self.packets_sent = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.packets_received = 0
+        self.messages_received = 0
+        self.lost = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+
+        # the data port is always the control port + 1, a free pair is searched unless we listen on a fixed port
+        fixed = 0 if self.host else self.port
+        for _ in range(20):
+            _, control = await loop.create_datagram_endpoint(lambda: Endpoint(self, "control"), local_addr=(self.bind, fixed))
+            port = control.transport.get_extra_info("sockname")[1]
+            try:
+                _, data = await loop.create_datagram_endpoint(lambda: Endpoint(self, "data"), local_addr=(self.bind, port + 1))
+            except OSError:
+                control.transport.close()
+                if fixed:
+                    raise
+                continue
+            break
+        else:
+            raise OSError("no free UDP port pair for RTP-MIDI")
+
+        self.control = control
+        self.data = data
+        self.local_port = port
+        self.task = asyncio.create_task(self.run())
+        return self
+
+    async def stop(self):
+        if self.state == "open":
+            self.send_exchange(b"BY", self.token)
+        self.task.cancel()
+        self.control.transport.close()
+        self.data.transport.close()
+        self.state = "idle"
+
+    async def run(self):
+        while True:
+            current = time.monotonic()
+
+            if self.state != "open":
+                if self.host and current - self.last_invite >= self.invite_interval:
+                    self.invite()
+
+            elif current - self.last_sync > self.sync_timeout:
+                self.close_session("no clock sync for {} s".format(self.sync_timeout))
+
+            else:
+                if self.host and current - self.last_sync >= (1 if self.syncs < 3 else self.sync_interval):
+                    self.sync()
+                if self.received_sequence != self.feedback_sequence:
+                    # receiver feedback, lets the device forget what we already have
+                    self.feedback_sequence = self.received_sequence
+                    self.send_control(struct.pack(">H2sII", 0xFFFF, b"RS", self.ssrc, self.received_sequence << 16))
+
+            await asyncio.sleep(0.25)
+
+    # session
+
+    def invite(self):
+        # invitation on the control port first, the data port once that one is accepted
+        if self.state == "idle":
+            self.state = "control"
+            self.token = random.getrandbits(32)
+            self.peer_control = (self.host, self.port)
+            self.peer_data = (self.host, self.port + 1)
+        self.last_invite = time.monotonic()
+        self.send_exchange(b"IN", self.token, self.state)
+
+    def open_session(self):
+        self.state = "open"
+        self.syncs = 0
+        self.last_sync = time.monotonic()
+        self.received_sequence = None
+        self.feedback_sequence = None
+        self.last_transit = None
+        print("RTP-MIDI session open:", self.url, self.peer_name)
+        if self.host:
+            self.sync()
+
+    def close_session(self, reason):
+        print("RTP-MIDI session closed:", self.url, reason)
+        self.state = "idle"
+        self.last_invite = time.monotonic()
+        self.pending.clear()
+        self.sysex.clear()
+
+    def sync(self):
+        self.send_data(struct.pack(">H2sIB3xQQQ", 0xFFFF, b"CK", self.ssrc, 0, ticks(), 0, 0))
+
+    def send_exchange(self, command, token, channel="control"):
+        payload = struct.pack(">H2sIII", 0xFFFF, command, PROTOCOL_VERSION, token, self.ssrc)
+        if command != b"BY":
+            payload += SESSION_NAME.encode() + b"\0"
+        if channel == "control":
+            self.send_control(payload)
+        else:
+            self.send_data(payload)
+
+    def send_control(self, payload):
+        if self.peer_control is not None:
+            self.control.transport.sendto(payload, self.peer_control)
+
+    def send_data(self, payload):
+        if self.peer_data is not None:
+            self.data.transport.sendto(payload, self.peer_data)
+
+    def received(self, channel, data, addr):
+        if data[:2] == b"\xff\xff" and len(data) >= 4:
+            self.received_exchange(channel, data, addr)
+        elif channel == "data" and self.state == "open" and len(data) > 12:
+            self.received_rtp(data)
+
+    def received_exchange(self, channel, data, addr):
+        command = data[2:4]
+
+        if command in (b"IN", b"OK", b"NO", b"BY") and len(data) >= 16:
+            _, _, version, token, ssrc = struct.unpack_from(">H2sIII", data)
+            name = data[16:].split(b"\0")[0].decode(errors="replace")
+
+            if command == b"IN":
+                # the device invites us, a new invitation replaces an older session
+                if channel == "control":
+                    self.peer_control = addr
+                    self.peer_ssrc = ssrc
+                    self.peer_name = name
+                    self.token = token
+                    self.state = "control"
+                    self.send_exchange(b"OK", token)
+                elif ssrc == self.peer_ssrc:
+                    self.peer_data = addr
+                    self.send_exchange(b"OK", token, "data")
+                    self.open_session()
+
+            elif command == b"OK" and token == self.token:
+                self.peer_ssrc = ssrc
+                self.peer_name = name
+                if channel == "control" and self.state == "control":
+                    self.state = "data"
+                    self.invite()
+                elif channel == "data" and self.state == "data":
+                    self.open_session()
+
+            elif command == b"NO" and token == self.token:
+                print("RTP-MIDI invitation rejected:", self.url, name)
+                self.state = "idle"
+
+            elif command == b"BY" and ssrc == self.peer_ssrc and self.state != "idle":
+                self.close_session("ended by the peer")
+
+        elif command == b"CK" and len(data) >= 36 and self.state == "open":
+            _, _, ssrc, count, first, second, third = struct.unpack_from(">H2sIB3xQQQ", data)
+            current = ticks()
+            if count == 0:
+                self.send_data(struct.pack(">H2sIB3xQQQ", 0xFFFF, b"CK", self.ssrc, 1, first, current, 0))
+            elif count == 1:
+                self.send_data(struct.pack(">H2sIB3xQQQ", 0xFFFF, b"CK", self.ssrc, 2, first, second, current))
+                self.sync_done(current - first)
+            else:
+                # the device started this sync, time our answer until its last step
+                self.sync_done(current - second)
+
+    def sync_done(self, rtt):
+        self.rtt = rtt / 10000
+        self.rtt_samples.append(self.rtt)
+        self.syncs += 1
+        self.last_sync = time.monotonic()
+
+    def received_rtp(self, data):
+        first, payload_type, sequence, timestamp, ssrc = struct.unpack_from(">BBHII", data)
+        if first >> 6 != 2 or payload_type & 0x7F != PAYLOAD_TYPE:
+            return
+
+        if self.received_sequence is not None:
+            gap = (sequence - self.received_sequence) & 0xFFFF
+            if gap == 0 or gap > 0x8000:
+                # duplicate or late packet
+                return
+            self.lost += gap - 1
+        self.received_sequence = sequence
+        self.packets_received += 1
+
+        # interarrival jitter as in RFC 3550, in ticks
+        transit = (ticks() - timestamp) & 0xFFFFFFFF
+        if self.last_transit is not None:
+            difference = abs((transit - self.last_transit + 0x80000000) % 0x100000000 - 0x80000000)
+            self.jitter += (difference - self.jitter) / 16
+        self.last_transit = transit
+
+        # header length: 12 bytes plus the CSRC list
+        messages = decode_commands(data, 12 + 4 * (first & 0x0F), self.sysex)
+        self.messages_received += len(messages)
+        if not self.opened:
+            return
+
+        current = time.perf_counter()
+        for msg in messages:
+            delta = 0 if self.last_message is None else current - self.last_message
+            self.last_message = current
+            if self.callback is not None:
+                self.callback[0]((msg, delta), self.callback[1])
+            else:
+                self.messages.append((msg, delta))
+
+    # rtmidi MidiIn / MidiOut
+
+    def get_ports(self):
+        # the port only exists while the session is up, so hot-plug handling sees a dropped session as unplugged
+        return [self.url] if self.state == "open" else []
+
+    def open_port(self, port=0):
+        self.opened = True
+
+    def close_port(self):
+        self.opened = False
+        self.callback = None
+        self.messages.clear()
+
+    def is_port_open(self):
+        return self.opened
+
+    def set_callback(self, func, data=None):
+        self.callback = (func, data)
+
+    def cancel_callback(self):
+        self.callback = None
+
+    def get_message(self):
+        return self.messages.popleft() if self.messages else None
+
+    def send_message(self, msg):
+        if not self.opened or self.state != "open":
+            return
+        self.pending.append(msg)
+        # everything sent during this loop tick goes out in one packet
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flush_handle = None
+        if self.state != "open" or not self.pending:
+            self.pending.clear()
+            return
+
+        timestamp = ticks() & 0xFFFFFFFF
+        batch = []
+        size = 0
+        for msg in self.pending + [None]:
+            if msg is None or (batch and size + len(msg) + 1 > MAX_COMMAND_BYTES):
+                self.sequence = (self.sequence + 1) & 0xFFFF
+                packet = struct.pack(">BBHII", 0x80, PAYLOAD_TYPE, self.sequence, timestamp, self.ssrc) + encode_commands(batch)
+                self.send_data(packet)
+                self.packets_sent += 1
+                self.messages_sent += len(batch)
+                self.bytes_sent += len(packet)
+                batch = []
+                size = 0
+            if msg is not None:
+                batch.append(msg)
+                size += len(msg) + 1
+        self.pending.clear()
+
+    def stats(self):
+        samples = sorted(self.rtt_samples)
+        return {
+            "state": self.state,
+            "rtt": self.rtt or 0,
+            "rtt_p50": samples[len(samples) // 2] if samples else 0,
+            "jitter": self.jitter / 10000,
+            "packets_sent": self.packets_sent,
+            "messages_sent": self.messages_sent,
+            "bytes_sent": self.bytes_sent,
+            "packets_received": self.packets_received,
+            "messages_received": self.messages_received,
+            "lost": self.lost,
+        }
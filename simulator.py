@@ -0,0 +1,562 @@
+import os
+import sys
+import math
+import time
+import asyncio
+import tempfile
+import threading
+import collections
+import importlib.util
+
+import msgpack
+import websockets
+
+# stand-ins for OBS and the X-Touch Extender, the bridge runs against them without hardware:
+#   python simulator.py    runs the bridge with a simulated X-Touch and a stand-in obs-websocket v5 server
+
+# event subscription bits of the event types the stand-in emits, everything else is an Inputs event
+EVENT_INTENTS = {
+    "CurrentSceneCollectionChanged": 1 << 1,
+    "CurrentProgramSceneChanged": 1 << 2,
+    "SceneCreated": 1 << 2,
+    "SceneRemoved": 1 << 2,
+    "SceneNameChanged": 1 << 2,
+    "SceneItemCreated": 1 << 7,
+    "SceneItemRemoved": 1 << 7,
+    "SceneItemListReindexed": 1 << 7,
+    "InputVolumeMeters": 1 << 16,
+}
+
+# Set* requests on an input: the field they set and the event that reports it
+SET_EVENTS = {
+    "SetInputVolume": ("inputVolumeMul", "InputVolumeChanged"),
+    "SetInputMute": ("inputMuted", "InputMuteStateChanged"),
+    "SetInputAudioBalance": ("inputAudioBalance", "InputAudioBalanceChanged"),
+    "SetInputAudioMonitorType": ("monitorType", "InputAudioMonitorTypeChanged"),
+}
+
+MONITOR_TYPES = ("OBS_MONITORING_TYPE_NONE", "OBS_MONITORING_TYPE_MONITOR_ONLY", "OBS_MONITORING_TYPE_MONITOR_AND_OUTPUT")
+
+
+def make_input(idx, audio=True):
+    uuid = "input-{:04d}".format(idx)
+    return {
+        "inputName": "Input {}".format(idx),
+        "inputUuid": uuid,
+        "inputKind": "wasapi_input_capture" if audio else "image_source",
+        "audio": audio,
+        "inputVolumeMul": 1.0,
+        "inputMuted": False,
+        "inputAudioBalance": 0.5,
+        "monitorType": MONITOR_TYPES[0],
+        "inputAudioTracks": {str(track): track == 1 for track in range(1, 7)},
+    }
+
+
+def make_inputs(count, audio_every=1):
+    inputs = {}
+    for idx in range(count):
+        inpt = make_input(idx, idx % audio_every == 0)
+        inputs[inpt["inputUuid"]] = inpt
+    return inputs
+
+
+class StandInOBS:
+
+    def __init__(self, inputs=None, latency=0.0, host="127.0.0.1", port=0):
+        self.inputs = make_inputs(16) if inputs is None else inputs
+        self.latency = latency
+        # requestType -> seconds, answers to these take longer than latency
+        self.delays = {}
+        self.host = host
+        self.port = port
+        self.server = None
+        self.clients = set()
+        self.subscriptions = {}
+        # Reidentify messages received
+        self.reidentified = 0
+        # (perf_counter timestamp, requestType, requestData) of every request received
+        self.requests = []
+        # Request and RequestBatch messages received, each one a round trip for the client
+        self.round_trips = 0
+        # (perf_counter timestamp, eventType) of every event sent
+        self.events = []
+        # eventType -> messages sent to subscribed clients
+        self.delivered = collections.Counter()
+        self.frame = 0
+        # sceneName -> items bottom to top, every input starts in "Scene"; groups are scenes listed in self.groups
+        self.scenes = {}
+        self.groups = set()
+        self.item_id = 0
+        self.add_scene("Scene", list(self.inputs))
+        self.program_scene = "Scene"
+        # (sourceName, filterName) -> enabled
+        self.filters = {}
+
+    @property
+    def url(self):
+        return "ws://{}:{}".format(self.host, self.port)
+
+    async def start(self):
+        # can be started again after stop() to simulate an OBS restart on the same port
+        self.server = await websockets.serve(self.handler, self.host, self.port, subprotocols=["obswebsocket.msgpack"])
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handler(self, connection):
+        await connection.send(msgpack.packb({"op": 0, "d": {"obsWebSocketVersion": "5.0.0", "rpcVersion": 1}}))
+        try:
+            async for message in connection:
+                payload = msgpack.unpackb(message)
+                if payload["op"] in (6, 8):
+                    # requests are answered independently, a slow one does not hold back the others
+                    asyncio.ensure_future(self.answer(connection, payload["op"], payload["d"]))
+                else:
+                    await self.handle(connection, payload["op"], payload["d"])
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.clients.discard(connection)
+            self.subscriptions.pop(connection, None)
+
+    async def answer(self, connection, op, data):
+        try:
+            await self.handle(connection, op, data)
+        except websockets.exceptions.ConnectionClosed:
+            # the client went away while its request was being answered
+            pass
+
+    async def handle(self, connection, op, data):
+        if op in (1, 3):  # Identify, Reidentify
+            self.subscriptions[connection] = data.get("eventSubscriptions", 0x7FF)
+            self.clients.add(connection)
+            self.reidentified += op == 3
+            await connection.send(msgpack.packb({"op": 2, "d": {"negotiatedRpcVersion": 1}}))
+        elif op == 6:  # Request
+            self.round_trips += 1
+            delay = self.delays.get(data["requestType"], self.latency)
+            if delay:
+                await asyncio.sleep(delay)
+            result = self.request(data["requestType"], data.get("requestData") or {})
+            result["requestId"] = data["requestId"]
+            await connection.send(msgpack.packb({"op": 7, "d": result}))
+        elif op == 8:  # RequestBatch
+            self.round_trips += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            results = []
+            for request in data["requests"]:
+                results.append(self.request(request["requestType"], request.get("requestData") or {}))
+                if data.get("haltOnFailure") and not results[-1]["requestStatus"]["result"]:
+                    break
+            await connection.send(msgpack.packb({"op": 9, "d": {"requestId": data["requestId"], "results": results}}))
+
+    def request(self, request_type, request_data):
+        self.requests.append((time.perf_counter(), request_type, request_data))
+        response = {"requestType": request_type, "requestStatus": {"result": True, "code": 100}}
+
+        if request_type == "GetInputList":
+            response["responseData"] = {"inputs": [
+                {"inputName": inpt["inputName"], "inputUuid": inpt["inputUuid"], "inputKind": inpt["inputKind"]}
+                for inpt in self.inputs.values()]}
+            return response
+        elif request_type == "SetCurrentProgramScene":
+            self.switch_scene(request_data["sceneName"])
+            return response
+        elif request_type == "GetSceneList":
+            response["responseData"] = {
+                "currentProgramSceneName": self.program_scene, "currentPreviewSceneName": None,
+                "scenes": [{"sceneName": name, "sceneUuid": "scene-" + name, "sceneIndex": idx}
+                           for idx, name in enumerate(name for name in self.scenes if name not in self.groups)]}
+            return response
+        elif request_type == "GetGroupList":
+            response["responseData"] = {"groups": sorted(self.groups)}
+            return response
+        elif request_type in ("GetSceneItemList", "GetGroupSceneItemList"):
+            name = request_data["sceneName"]
+            if name not in self.scenes or (name in self.groups) != (request_type == "GetGroupSceneItemList"):
+                response["requestStatus"] = {"result": False, "code": 600, "comment": "No scene was found."}
+            else:
+                response["responseData"] = {"sceneItems": [dict(item, sceneItemIndex=idx) for idx, item in enumerate(self.scenes[name])]}
+            return response
+        elif request_type == "TriggerHotkeyByName":
+            return response
+        elif request_type in ("GetSourceFilter", "SetSourceFilterEnabled"):
+            key = (request_data["sourceName"], request_data["filterName"])
+            if key not in self.filters:
+                response["requestStatus"] = {"result": False, "code": 600, "comment": "No filter was found."}
+            elif request_type == "GetSourceFilter":
+                response["responseData"] = {"filterEnabled": self.filters[key], "filterIndex": 0, "filterKind": "noise_gate_filter", "filterSettings": {}}
+            else:
+                self.filters[key] = request_data["filterEnabled"]
+            return response
+
+        inpt = self.inputs.get(request_data.get("inputUuid"))
+        if inpt is None:
+            response["requestStatus"] = {"result": False, "code": 600, "comment": "No source was found."}
+            return response
+        if not inpt["audio"] and request_type.startswith(("GetInputAudio", "SetInputAudio", "GetInputMute", "SetInputMute", "GetInputVolume", "SetInputVolume")):
+            response["requestStatus"] = {"result": False, "code": 604, "comment": "The specified input does not support audio."}
+            return response
+
+        if request_type == "GetInputAudioMonitorType":
+            response["responseData"] = {"monitorType": inpt["monitorType"]}
+        elif request_type == "GetInputMute":
+            response["responseData"] = {"inputMuted": inpt["inputMuted"]}
+        elif request_type == "GetInputAudioBalance":
+            response["responseData"] = {"inputAudioBalance": inpt["inputAudioBalance"]}
+        elif request_type == "GetInputVolume":
+            response["responseData"] = {"inputVolumeMul": inpt["inputVolumeMul"]}
+        elif request_type == "GetInputAudioTracks":
+            response["responseData"] = {"inputAudioTracks": dict(inpt["inputAudioTracks"])}
+        elif request_type in SET_EVENTS:
+            # like OBS, a request that changes nothing sends no event
+            field, event_type = SET_EVENTS[request_type]
+            if inpt[field] != request_data[field]:
+                inpt[field] = request_data[field]
+                self.input_event(event_type, inpt, **{field: inpt[field]})
+        elif request_type == "SetInputAudioTracks":
+            tracks = dict(inpt["inputAudioTracks"], **request_data["inputAudioTracks"])
+            if tracks != inpt["inputAudioTracks"]:
+                inpt["inputAudioTracks"].update(tracks)
+                self.input_event("InputAudioTracksChanged", inpt, inputAudioTracks=dict(inpt["inputAudioTracks"]))
+        else:
+            response["requestStatus"] = {"result": False, "code": 204, "comment": "Unknown request type."}
+        return response
+
+    def input_event(self, event_type, inpt, **event_data):
+        event_data["inputName"] = inpt["inputName"]
+        event_data["inputUuid"] = inpt["inputUuid"]
+        self.emit(event_type, event_data)
+
+    def emit(self, event_type, event_data, intent=None):
+        # OBS echoes changes to every subscribed client, including the one that made them
+        if intent is None:
+            intent = EVENT_INTENTS.get(event_type, 1 << 3)
+        self.send_event(event_type, intent, msgpack.packb({"op": 5, "d": {"eventType": event_type, "eventIntent": intent, "eventData": event_data}}))
+
+    def send_event(self, event_type, intent, message):
+        self.events.append((time.perf_counter(), event_type))
+        for connection in list(self.clients):
+            if self.subscriptions.get(connection, 0) & intent:
+                self.delivered[event_type] += 1
+                asyncio.ensure_future(connection.send(message))
+
+    def create_input(self, audio=True):
+        inpt = make_input(len(self.inputs), audio)
+        while inpt["inputUuid"] in self.inputs:
+            inpt = make_input(int(inpt["inputUuid"][6:]) + 1, audio)
+        self.inputs[inpt["inputUuid"]] = inpt
+        self.emit("InputCreated", {"inputName": inpt["inputName"], "inputUuid": inpt["inputUuid"], "inputKind": inpt["inputKind"]})
+        return inpt["inputUuid"]
+
+    def remove_input(self, uuid):
+        inpt = self.inputs.pop(uuid)
+        self.emit("InputRemoved", {"inputName": inpt["inputName"], "inputUuid": uuid})
+
+    def rename_input(self, uuid, name):
+        inpt = self.inputs[uuid]
+        old_name = inpt["inputName"]
+        inpt["inputName"] = name
+        self.emit("InputNameChanged", {"oldInputName": old_name, "inputName": name, "inputUuid": uuid})
+
+    def scene_source(self, source):
+        # an input uuid or the name of a scene or group
+        if source in self.scenes:
+            return {"sourceName": source, "sourceUuid": "scene-" + source, "sourceType": "OBS_SOURCE_TYPE_SCENE",
+                    "isGroup": source in self.groups, "inputKind": None}
+        inpt = self.inputs[source]
+        return {"sourceName": inpt["inputName"], "sourceUuid": source, "sourceType": "OBS_SOURCE_TYPE_INPUT",
+                "isGroup": None, "inputKind": inpt["inputKind"]}
+
+    def add_scene(self, name, sources=(), group=False):
+        # sources bottom to top, like OBS lists scene items
+        self.scenes[name] = []
+        if group:
+            self.groups.add(name)
+        self.emit("SceneCreated", {"sceneName": name, "sceneUuid": "scene-" + name, "isGroup": group})
+        for source in sources:
+            self.add_scene_item(name, source)
+
+    def add_scene_item(self, scene, source, index=None):
+        items = self.scenes[scene]
+        index = len(items) if index is None else index
+        self.item_id += 1
+        item = dict(self.scene_source(source), sceneItemId=self.item_id)
+        items.insert(index, item)
+        self.emit("SceneItemCreated", {"sceneName": scene, "sceneUuid": "scene-" + scene, "sourceName": item["sourceName"],
+                                       "sourceUuid": item["sourceUuid"], "sceneItemId": item["sceneItemId"], "sceneItemIndex": index})
+        return item["sceneItemId"]
+
+    def remove_scene_item(self, scene, item_id):
+        item = next(item for item in self.scenes[scene] if item["sceneItemId"] == item_id)
+        self.scenes[scene].remove(item)
+        self.emit("SceneItemRemoved", {"sceneName": scene, "sceneUuid": "scene-" + scene, "sourceName": item["sourceName"],
+                                       "sourceUuid": item["sourceUuid"], "sceneItemId": item_id})
+
+    def move_scene_item(self, scene, item_id, index):
+        items = self.scenes[scene]
+        item = next(item for item in items if item["sceneItemId"] == item_id)
+        items.remove(item)
+        items.insert(index, item)
+        self.emit("SceneItemListReindexed", {"sceneName": scene, "sceneUuid": "scene-" + scene, "sceneItems": [
+            {"sceneItemId": item["sceneItemId"], "sceneItemIndex": idx} for idx, item in enumerate(items)]})
+
+    def switch_scene(self, name):
+        # the program scene changes, from a request or a click in the OBS window
+        self.program_scene = name
+        self.emit("CurrentProgramSceneChanged", {"sceneName": name, "sceneUuid": "scene-" + name})
+
+    def received(self, request_type):
+        return [entry for entry in self.requests if entry[1] == request_type]
+
+    def emitted(self, event_type):
+        return [stamp for stamp, emitted_type in self.events if emitted_type == event_type]
+
+    def set_input(self, uuid, **fields):
+        # change an input as if it was done in the OBS window, the matching event goes out
+        inpt = self.inputs[uuid]
+        for field, value in fields.items():
+            inpt[field] = value
+            if field == "inputMuted":
+                self.input_event("InputMuteStateChanged", inpt, inputMuted=value)
+            elif field == "inputVolumeMul":
+                self.input_event("InputVolumeChanged", inpt, inputVolumeMul=value)
+            elif field == "inputAudioBalance":
+                self.input_event("InputAudioBalanceChanged", inpt, inputAudioBalance=value)
+            elif field == "monitorType":
+                self.input_event("InputAudioMonitorTypeChanged", inpt, monitorType=value)
+
+    def meter_event(self, frame=None):
+        # one InputVolumeMeters frame with every audio input, levels breathe slowly like program audio
+        if frame is None:
+            self.frame += 1
+            frame = self.frame
+        inputs = []
+        for idx, inpt in enumerate(self.inputs.values()):
+            if inpt["audio"]:
+                level = 0.05 + 0.04 * math.sin(frame / 20 + idx)
+                inputs.append({"inputName": inpt["inputName"], "inputUuid": inpt["inputUuid"],
+                               "inputLevelsMul": [[level * 1.2, level, level * 0.9], [level * 1.1, level * 0.95, level * 0.9]]})
+        return msgpack.packb({"op": 5, "d": {"eventType": "InputVolumeMeters", "eventIntent": 1 << 16, "eventData": {"inputs": inputs}}})
+
+    async def meter_storm(self, rate, duration):
+        # InputVolumeMeters at rate per second, OBS itself sends one every 50 ms; rate None sends as fast as possible
+        # the frames are packed up front so the storm measures the client, not the stand-in
+        frames = [self.meter_event(self.frame + idx) for idx in range(1, 127)]
+        self.frame += len(frames)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        count = 0
+        while loop.time() - start < duration:
+            self.send_event("InputVolumeMeters", 1 << 16, frames[count % len(frames)])
+            count += 1
+            if rate is None:
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(max(0, start + count / rate - loop.time()))
+        return count
+
+    async def play(self, script):
+        # script: (seconds from now, eventType, eventData) in order, a callable instead of eventType is run
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for at, event_type, event_data in script:
+            await asyncio.sleep(max(0, start + at - loop.time()))
+            if callable(event_type):
+                event_type(*event_data)
+            else:
+                self.emit(event_type, event_data)
+
+
+class SimulatedPort:
+    # rtmidi MidiIn / MidiOut look-alike connected to a SimulatedXTouch
+
+    def __init__(self, device):
+        self.device = device
+        self.opened = False
+        self.callback = None
+        self.messages = collections.deque()
+
+    def get_ports(self):
+        return [self.device.name] if self.device.plugged else []
+
+    def open_port(self, port=0):
+        self.opened = True
+
+    def close_port(self):
+        self.opened = False
+        self.callback = None
+
+    def is_port_open(self):
+        return self.opened
+
+    def set_callback(self, func, data=None):
+        self.callback = (func, data)
+
+    def cancel_callback(self):
+        self.callback = None
+
+    def get_message(self):
+        return self.messages.popleft() if self.messages else None
+
+    def send_message(self, msg):
+        if self.opened and self.device.plugged:
+            self.device.receive(msg)
+
+
+class SimulatedXTouch:
+    # X-Touch Extender in Mackie Control mode: keeps what its LEDs, rings, motor faders, meters and LCD show,
+    # and plays control changes towards the bridge
+
+    def __init__(self, name="X-Touch-Ext simulated"):
+        self.name = name
+        self.plugged = True
+        self.midi_in = SimulatedPort(self)
+        self.midi_out = SimulatedPort(self)
+        self.lock = threading.Lock()
+        self.buttons = {}
+        self.rings = [None] * 8
+        self.faders = [None] * 8
+        self.meters = [None] * 8
+        self.lcd = [32] * 112
+        self.colors = [None] * 8
+        # ("button", note), ("ring", slot), ("fader", slot), ("meter", slot), ("lcd", offset), ("colors",)
+        # -> perf_counter timestamp of the last change
+        self.changed = {}
+        self.received = 0
+        self.bytes = 0
+        self.last_input = None
+
+    def receive(self, msg):
+        current = time.perf_counter()
+        with self.lock:
+            self.received += 1
+            self.bytes += len(msg)
+            status = msg[0]
+            if status == 144:
+                self.update(("button", msg[1]), self.buttons, msg[1], msg[2], current)
+            elif status == 176 and 48 <= msg[1] < 56:
+                self.update(("ring", msg[1] - 48), self.rings, msg[1] - 48, msg[2], current)
+            elif 224 <= status < 232:
+                self.update(("fader", status - 224), self.faders, status - 224, msg[2], current)
+            elif status == 208:
+                self.update(("meter", msg[1] >> 4), self.meters, msg[1] >> 4, msg[1] & 15, current)
+            elif status == 0xF0 and msg[1:5] == [0x00, 0x00, 0x66, 0x15]:
+                if msg[5] == 0x12:
+                    offset = msg[6]
+                    cells = list(msg[7:-1])
+                    self.lcd[offset:offset + len(cells)] = cells
+                    for cell in range(offset, offset + len(cells)):
+                        self.changed[("lcd", cell)] = current
+                elif msg[5] == 0x72:
+                    self.colors = list(msg[6:14])
+                    self.changed[("colors",)] = current
+
+    def update(self, key, state, index, value, current):
+        # repeated values, like meter refreshes, change nothing on the device
+        if (state.get(index) if isinstance(state, dict) else state[index]) == value:
+            return
+        state[index] = value
+        self.changed[key] = current
+
+    def text(self, slot, line):
+        offset = 7 * slot + 56 * line
+        return "".join(chr(cell) if cell else " " for cell in self.lcd[offset:offset + 7])
+
+    # controls, played towards the bridge like the rtmidi input thread would
+
+    def send(self, msg):
+        self.last_input = time.perf_counter()
+        port = self.midi_in
+        if not port.opened or not self.plugged:
+            return
+        if port.callback is not None:
+            port.callback[0]((msg, 0.0), port.callback[1])
+        else:
+            port.messages.append((msg, 0.0))
+
+    def press(self, note):
+        self.send([144, note, 127])
+
+    def release(self, note):
+        self.send([144, note, 0])
+
+    def turn(self, slot, value):
+        # raw encoder CC value: 1 to 63 clockwise, 65 to 127 counter-clockwise
+        self.send([176, 16 + slot, value])
+
+    def touch(self, slot, touched=True):
+        self.send([144, 104 + slot, 127 if touched else 0])
+
+    def move_fader(self, slot, value):
+        self.send([224 + slot, 0, value])
+
+    def unplug(self):
+        self.plugged = False
+
+    def plug(self):
+        self.plugged = True
+
+
+def simulated_ports(devices):
+    # midi_port_factory for the bridge, every Unit gets the ports of the next simulated device
+    remaining = iter(devices)
+
+    def factory(name):
+        device = next(remaining)
+        return device.midi_in, device.midi_out
+
+    return factory
+
+
+def load_bridge(units=1, **config):
+    # a fresh copy of the bridge wired to simulated X-Touch units, config overrides its module settings
+    # the devices are reachable as bridge.units[n].midi_out.device
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Xtouch-Simpleobsws.py")
+    spec = importlib.util.spec_from_file_location("xtouch", path)
+    bridge = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bridge)
+
+    devices = [SimulatedXTouch("X-Touch-Ext simulated {}".format(idx + 1)) for idx in range(units)]
+    bridge.xtouch_ports = ["X-Touch-Ext"] * units
+    bridge.midi_port_factory = simulated_ports(devices)
+    for key, value in config.items():
+        setattr(bridge, key, value)
+    bridge.setup()
+    return bridge
+
+
+async def demo():
+    obs = await StandInOBS(make_inputs(12, audio_every=3)).start()
+    snapshot_file = os.path.join(tempfile.mkdtemp(prefix="xtouch-simulator-"), "xtouch-layout.json")
+    bridge = load_bridge(obs_url=obs.url, obs_password=None, snapshot_file=snapshot_file, mapping_file=None)
+    device = bridge.units[0].midi_out.device
+    asyncio.create_task(bridge.main())
+    while len(bridge.obs_inputs) <= 2:
+        await asyncio.sleep(0.05)
+
+    # assign the first audio input to strip 1 the way an operator would: SELECT, turn, SELECT
+    device.press(24)
+    device.turn(0, 1)
+    device.turn(0, 1)
+    device.press(24)
+    await asyncio.sleep(0.2)
+    obs.set_input("input-0000", inputMuted=True)
+
+    while True:
+        await obs.meter_storm(20, 1)
+        print("LCD |{}|".format("|".join(device.text(slot, 0) for slot in range(8))))
+        print("    |{}|  mute {}  meters {}".format("|".join(device.text(slot, 1) for slot in range(8)),
+                                                   device.buttons.get(16), device.meters))
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(demo())
+    except KeyboardInterrupt:
+        sys.exit(0)